@@ -0,0 +1,377 @@
+"""This module times and memory-profiles the pipeline stages on synthetic data.
+
+Every size gets its own working directory of synthetic raw files and a
+cpi.csv, and the stages run in order on it, each in a fresh process so its
+peak memory is its own. Results can be stored as a baseline and later runs
+compared against it: a stage slower or heavier than the baseline by more
+than the tolerance is flagged as a regression. Stages read what earlier
+stages wrote, so running a subset needs one full run of that size first.
+
+    python benchmark.py 10000 1000000 --save
+    python benchmark.py 10000 1000000
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import contextlib
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import csv_creator
+import dictionaries
+import pre_main
+import synthetic
+import top_hscodes
+from initializer import initialize, format_dataframe, get_cube, clear_cache, chunked_group_sum, \
+    filter_dataframe, TradeIndex, COLS
+from trade_deflator import Deflator
+from instrument import peak_rss
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = '../data/benchmarks/'
+BASELINE = '../data/benchmarks/baseline.json'
+SIZES = [10_000, 100_000, 1_000_000]
+TOLERANCE = 0.25
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS = 0.05
+MIN_MB = 5.0
+
+REPORTER = {'band': (1e9, 1e12), 'include': ['World']}
+
+
+def paths(workdir:str) -> dict[str, str]:
+
+    return {
+        'raw': os.path.join(workdir, 'raw', ''),
+        'cpi': os.path.join(workdir, 'cpi.csv'),
+        'processed': os.path.join(workdir, 'processed', ''),
+        'trade': os.path.join(workdir, 'processed', csv_creator.FILE_NAME),
+        'pre_main': os.path.join(workdir, 'processed', 'pre_main.csv'),
+        'main': os.path.join(workdir, 'data', 'processed-data', 'colombia', 'main.csv')
+    }
+
+
+def generate(workdir:str, rows:int, files:int=4, seed:int=0) -> int:
+
+    path = paths(workdir)
+    synthetic.write_raw(path['raw'], rows, files, seed)
+    synthetic.write_cpi(path['cpi'], seed=seed)
+
+    return rows
+
+
+def ingest(workdir:str) -> int:
+
+    path = paths(workdir)
+    dataset_path = csv_creator.ingest(path['raw'], path['processed'], full=True)
+
+    return csv_creator.get_dataset(dataset_path).count_rows()
+
+
+def write_csv(workdir:str) -> int:
+
+    path = paths(workdir)
+    dataset = csv_creator.get_dataset(os.path.join(path['processed'], csv_creator.DATASET_NAME))
+    csv_creator.write_csv(dataset, path['trade'])
+
+    return dataset.count_rows()
+
+
+def adjust(workdir:str) -> int:
+
+    path = paths(workdir)
+    df = format_dataframe(pd.read_csv(path['trade'], usecols=list(COLS)))
+    df = pre_main.adjust_dataframe('benchmark', df)
+    df.to_csv(path['pre_main'], index=False, encoding='latin1')
+
+    return len(df)
+
+
+def deflate(workdir:str) -> int:
+
+    path = paths(workdir)
+    df = initialize(path['pre_main'], cache=False)
+
+    df['RealValue'] = Deflator.from_files({'cpi': path['cpi']}).deflate(df, 'FobValue', 'USA', 'cpi')
+    df.pop('FobValue')
+
+    os.makedirs(os.path.dirname(path['main']), exist_ok=True)
+    df.to_csv(path['main'], index=False, encoding='latin1')
+
+    return len(df)
+
+
+def initialize_cold(workdir:str) -> int:
+
+    path = paths(workdir)['main']
+    clear_cache(path)
+
+    return len(initialize(path))
+
+
+def initialize_warm(workdir:str) -> int:
+    return len(initialize(paths(workdir)['main']))
+
+
+def filter_partners(workdir:str) -> int:
+
+    df = initialize(paths(workdir)['main'])
+    partners = ['Germany', 'China', 'Peru', 'Switzerland']
+
+    index = TradeIndex(df)
+    rows = sum(len(index.select(period=period, partners=[partner])) for period in ('2011', '2022') for partner in partners)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows += len(filter_dataframe(df, period='2022', partners=partners))
+
+    return rows
+
+
+def cube(workdir:str) -> int:
+
+    cube = get_cube(paths(workdir)['main'])
+
+    return len(cube.aggregate(['Year', 'Partner', 'HSCode']))
+
+
+def chunked_sum(workdir:str) -> int:
+    return len(chunked_group_sum(paths(workdir)['main'], keys=['Year', 'Partner', 'HSCode'], chunksize=250_000))
+
+
+def rankings(workdir:str) -> int:
+
+    top_hscodes.PATH = paths(workdir)['processed']
+
+    return len(top_hscodes.rankings(by='Partner', k=5))
+
+
+def chunked_rankings(workdir:str) -> int:
+
+    top_hscodes.PATH = paths(workdir)['processed']
+
+    return len(top_hscodes.chunked_rankings(by='Partner', k=5, chunksize=250_000))
+
+
+def tables(workdir:str) -> int:
+    """Imports tables_colombia, whose load of main.csv is part of the stage"""
+
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+
+    import tables_colombia
+
+    sums = tables_colombia.pivot_tables('HSCode', 'Partner', 'RealValue', 'sum')
+    means = tables_colombia.pivot_tables('HSCode', ['Partner', 'Flow'], 'RealValue', ['mean', 'count'], format='sparse')
+
+    return sum(len(table) for table in sums + means)
+
+
+STAGES = {
+    'ingest': ingest,
+    'write_csv': write_csv,
+    'pre_main': adjust,
+    'deflate': deflate,
+    'initialize_cold': initialize_cold,
+    'initialize_warm': initialize_warm,
+    'filter': filter_partners,
+    'cube': cube,
+    'chunked_sum': chunked_sum,
+    'top_hscodes': rankings,
+    'top_hscodes_chunked': chunked_rankings,
+    'tables': tables
+}
+
+
+@contextlib.contextmanager
+def isolated(workdir:str):
+    """Registers the benchmark reporter and keeps the dictionaries in workdir, restoring both on exit.
+
+    Synthetic partners never reach data/processed-data/dictionaries.json and
+    importing this module leaves pre_main.REPORTERS as it is.
+    """
+
+    previous = pre_main.REPORTERS.get('benchmark')
+    pre_main.REPORTERS['benchmark'] = REPORTER
+
+    try:
+        with dictionaries.using(os.path.join(workdir, 'dictionaries.json')):
+            yield
+    finally:
+        if previous is None:
+            pre_main.REPORTERS.pop('benchmark', None)
+        else:
+            pre_main.REPORTERS['benchmark'] = previous
+
+
+def measure(stage:str, workdir:str, traced:bool=False) -> dict:
+    """Runs one stage and returns its rows, wall and cpu seconds and memory in MB.
+
+    With traced, tracemalloc also reports the peak of memory allocated by
+    Python and NumPy during the stage, at the cost of slower timings.
+    """
+
+    start_rss = peak_rss()
+
+    if traced:
+        tracemalloc.start()
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+
+    with contextlib.redirect_stdout(io.StringIO()), isolated(workdir):
+        rows = STAGES[stage](workdir)
+
+    result = {
+        'rows': rows,
+        'wall': time.perf_counter() - start_wall,
+        'cpu': time.process_time() - start_cpu,
+        'peak_rss_mb': peak_rss(),
+        'start_rss_mb': start_rss
+    }
+
+    if traced:
+        result['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+
+    return result
+
+
+def run(sizes:list[int]=SIZES, stages:list[str]|None=None, workdir:str|None=None, traced:bool=False,
+        files:int=4, seed:int=0) -> dict[str, dict[str, dict]]:
+    """size -> stage -> measures. Synthetic data is generated once per size, files and seed"""
+
+    if not workdir:
+        workdir = WORKDIR
+
+    if not stages:
+        stages = list(STAGES)
+
+    for stage in stages:
+        if stage not in STAGES:
+            raise ValueError(f'Stage {stage} not valid. Try: {", ".join(STAGES)}')
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+
+    for size in sizes:
+
+        size_dir = os.path.abspath(os.path.join(workdir, f'{size}-{files}-{seed}'))
+
+        if not os.path.exists(paths(size_dir)['cpi']):
+            start = time.perf_counter()
+            with isolated(size_dir):
+                generate(size_dir, size, files, seed)
+            print(f'Generated {size} rows in {time.perf_counter() - start:.2f}s')
+
+        results[str(size)] = {}
+
+        for stage in stages:
+
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(measure, stage, size_dir, traced).result()
+
+            results[str(size)][stage] = result
+            print(f'{size:>12} {stage:<20} {result["wall"]:>9.3f}s {result["peak_rss_mb"] or 0:>9.1f}MB')
+
+    return results
+
+
+def compare(results:dict, baseline:dict, tolerance:float=TOLERANCE) -> pd.DataFrame:
+    """One row per size and stage found in both, with ratios to the baseline and a Regression flag"""
+
+    rows = []
+
+    for size, stages in results.items():
+        for stage, result in stages.items():
+
+            base = baseline.get(size, {}).get(stage)
+
+            if not base:
+                continue
+
+            row = {'Size': int(size), 'Stage': stage, 'Wall': result['wall'], 'BaseWall': base['wall']}
+            # tracemalloc slows stages down, so traced and untraced timings are not compared
+            timed = ('traced_peak_mb' in result) == ('traced_peak_mb' in base)
+            slower = timed and result['wall'] > base['wall'] * (1 + tolerance) and result['wall'] - base['wall'] > MIN_SECONDS
+
+            heavier = False
+            if result.get('peak_rss_mb') and base.get('peak_rss_mb'):
+                row['PeakMB'] = result['peak_rss_mb']
+                row['BasePeakMB'] = base['peak_rss_mb']
+                heavier = result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance) \
+                    and result['peak_rss_mb'] - base['peak_rss_mb'] > MIN_MB
+
+            row['WallRatio'] = result['wall'] / base['wall'] if base['wall'] else float('nan')
+            row['Regression'] = slower or heavier
+            rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+def load_baseline(path:str|None=None) -> dict:
+
+    if not path:
+        path = BASELINE
+
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as file:
+        return json.load(file)['results']
+
+
+def save_baseline(results:dict, path:str|None=None) -> str:
+    """Merges results into the baseline, so sizes not run keep their values"""
+
+    if not path:
+        path = BASELINE
+
+    merged = load_baseline(path)
+
+    for size, stages in results.items():
+        merged.setdefault(size, {}).update(stages)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    with open(path, 'w') as file:
+        json.dump({'machine': platform.platform(), 'python': platform.python_version(), 'results': merged}, file, indent=2)
+
+    return path
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmarks the pipeline stages on synthetic data')
+    parser.add_argument('sizes', nargs='*', type=int, default=SIZES)
+    parser.add_argument('--stages', help=f'comma separated subset of {",".join(STAGES)}')
+    parser.add_argument('--workdir', default=WORKDIR)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--traced', action='store_true', help='also report tracemalloc peaks')
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.stages.split(',') if args.stages else None, args.workdir,
+                  args.traced, args.files, args.seed)
+
+    if args.save:
+        print(f'Baseline saved to {save_baseline(results, args.baseline)}')
+        sys.exit()
+
+    report = compare(results, load_baseline(args.baseline), args.tolerance)
+
+    if report.empty:
+        print('No baseline to compare with. Run with --save to store one.')
+        sys.exit()
+
+    print(report.to_string(index=False))
+
+    sys.exit(1 if report['Regression'].any() else 0)
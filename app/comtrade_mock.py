@@ -0,0 +1,192 @@
+"""This module serves deterministic Comtrade extracts over HTTP for offline downloads.
+
+It answers the same query parameters as the Comtrade data API
+(reporterCode, period, cmdCode) with a csv body built by synthetic, keeps
+connections alive, supports Range and If-Range, and can fail on purpose:
+every fail_every-th request gets a 503 and every cut_every-th body is cut
+halfway through, so retries and resumed downloads can be exercised.
+Its partners are made up: load what is downloaded from it inside
+synthetic.registry().
+
+    python comtrade_mock.py --port 8765 --fail-every 5 --cut-every 7
+"""
+import sys
+import time
+import hashlib
+import argparse
+import threading
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+import synthetic
+
+ROWS = 2000
+
+
+@lru_cache(maxsize=256)
+def extract(reporter:str, period:str, hscodes:str, rows:int=ROWS) -> bytes:
+    """csv body of a reporter, year and comma separated HS codes, always the same for the same query"""
+
+    seed = int.from_bytes(hashlib.sha256(f'{reporter}|{period}|{hscodes}'.encode()).digest()[:8], 'little')
+    codes = np.array([int(code) for code in hscodes.split(',') if code], dtype='int64')
+    year = int(period)
+
+    df = synthetic.trade_frame(rows, seed, codes if len(codes) else None, range(year, year + 1))
+
+    return df.to_csv(index=False).encode('latin1')
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+
+        super().setup()
+        self.server.track('connections')
+
+    def do_GET(self):
+
+        self.server.track('active')
+
+        try:
+            self.respond(self.server.count())
+        finally:
+            self.server.track('active', -1)
+
+    def respond(self, count:int):
+
+        server = self.server
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.fail_every and count % server.fail_every == 0:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        query = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+
+        if 'reporterCode' not in query or 'period' not in query:
+            body = b'reporterCode and period are required'
+            self.send_response(400)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        body = extract(query['reporterCode'], query['period'], query.get('cmdCode', ''), server.rows)
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        start = 0
+
+        requested = self.headers.get('Range', '')
+        if requested.startswith('bytes=') and self.headers.get('If-Range', etag) == etag:
+            start = int(requested[len('bytes='):].split('-')[0] or 0)
+
+        if start >= len(body) and start:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(body)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        part = body[start:]
+
+        if start:
+            server.track('resumed')
+
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(part)))
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        if start:
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        self.end_headers()
+
+        if server.cut_every and count % server.cut_every == 0 and len(part) > 1:
+            self.wfile.write(part[:len(part) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        self.wfile.write(part)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class MockServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address:tuple[str, int], rows:int=ROWS, fail_every:int=0, cut_every:int=0,
+                 latency:float=0.0, verbose:bool=False):
+
+        super().__init__(address, Handler)
+
+        self.rows = rows
+        self.fail_every = fail_every
+        self.cut_every = cut_every
+        self.latency = latency
+        self.verbose = verbose
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        # Counters for tests: connections accepted, ranges served and requests in flight
+        self.connections = 0
+        self.resumed = 0
+        self.active = 0
+        self.peak = 0
+
+    def count(self) -> int:
+
+        with self.lock:
+            self.requests += 1
+            return self.requests
+
+    def track(self, counter:str, step:int=1) -> None:
+
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + step)
+            self.peak = max(self.peak, self.active)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/data/v1/get/C/A/HS'
+
+
+def serve(port:int=0, **kwargs) -> MockServer:
+    """Starts a server in a background thread. port=0 picks a free port, see server.url"""
+
+    server = MockServer(('127.0.0.1', port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Serves synthetic Comtrade extracts')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rows', type=int, default=ROWS)
+    parser.add_argument('--fail-every', type=int, default=0)
+    parser.add_argument('--cut-every', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockServer(('127.0.0.1', args.port), args.rows, args.fail_every, args.cut_every, args.latency, verbose=True)
+    print(f'Serving {server.url}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit()
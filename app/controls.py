@@ -0,0 +1,153 @@
+"""This module selects control partners by matching pre-period trajectories"""
+import numpy as np
+import pandas as pd
+
+VALUE = 'FobValue'
+PERIOD = (2001, 2011)
+
+
+def trajectories(dataframe:pd.DataFrame, treated:list[str], value:str=VALUE, years:tuple=PERIOD,
+                 by:list[str]=[], exclude:list[str]=[]) -> tuple[np.ndarray, np.ndarray, pd.Index, pd.DataFrame]:
+    """Dense pre-period trajectories.
+
+    Returns the candidates cube (groups x candidates x years), the treated
+    target (groups x years, mean of the treated partners), the candidate
+    partners and one row of by values per group.
+    """
+
+    low, high = years
+    df = dataframe[dataframe['Year'].between(low, high)].dropna(subset=by + ['Partner'])
+
+    sums = df.groupby(by + ['Partner', 'Year'], observed=True)[value].sum().reset_index()
+
+    if by:
+        group = sums.groupby(by, observed=True, sort=True).ngroup().to_numpy()
+        groups = sums[by].drop_duplicates().sort_values(by).reset_index(drop=True)
+    else:
+        group = np.zeros(len(sums), dtype=np.intp)
+        groups = pd.DataFrame(index=[0])
+
+    partner, partners = pd.factorize(sums['Partner'].astype('str'), sort=True)
+    year = sums['Year'].to_numpy().astype(np.intp) - low
+
+    cube = np.zeros((len(groups), len(partners), high - low + 1))
+    cube[group, partner, year] = sums[value].to_numpy()
+
+    is_treated = partners.isin(treated)
+
+    if not is_treated.any():
+        raise ValueError(f'No treated partner {treated} has trade between {low} and {high}')
+
+    target = cube[:, is_treated].mean(axis=1)
+    candidates = ~is_treated & ~partners.isin(exclude)
+
+    return cube[:, candidates], target, partners[candidates], groups
+
+
+def level_distance(candidates:np.ndarray, target:np.ndarray) -> np.ndarray:
+    """Root mean squared distance between log levels, lower is closer"""
+
+    diff = np.log1p(candidates) - np.log1p(target)[:, None, :]
+
+    return np.sqrt((diff ** 2).mean(axis=-1))
+
+
+def growth_correlation(candidates:np.ndarray, target:np.ndarray) -> np.ndarray:
+    """Pearson correlation of yearly log growth, NaN for flat trajectories"""
+
+    x = np.diff(np.log1p(candidates), axis=-1)
+    y = np.diff(np.log1p(target), axis=-1)[:, None, :]
+
+    x = x - x.mean(axis=-1, keepdims=True)
+    y = y - y.mean(axis=-1, keepdims=True)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = (x * y).sum(axis=-1) / np.sqrt((x ** 2).sum(axis=-1) * (y ** 2).sum(axis=-1))
+
+    return corr
+
+
+def project_simplex(v:np.ndarray) -> np.ndarray:
+    """Euclidean projection of every row of v onto the probability simplex"""
+
+    u = -np.sort(-v, axis=-1)
+    css = np.cumsum(u, axis=-1) - 1
+    ind = np.arange(1, v.shape[-1] + 1)
+
+    rho = (u - css / ind > 0).sum(axis=-1, keepdims=True)
+    theta = np.take_along_axis(css, rho - 1, axis=-1) / rho
+
+    return np.maximum(v - theta, 0)
+
+
+def synthetic_weights(candidates:np.ndarray, target:np.ndarray, iterations:int=500) -> np.ndarray:
+    """Synthetic control weights, higher is closer.
+
+    Solves min ||w X - y||^2 with w >= 0 and sum(w) = 1 for every group at
+    once by accelerated projected gradient. Trajectories are scaled by the
+    target mean so groups of any size converge alike.
+    """
+
+    if candidates.shape[1] == 0:
+        raise ValueError('No candidate partners to weight, check treated and exclude')
+
+    scale = np.abs(target).mean(axis=-1, keepdims=True)
+    scale[scale == 0] = 1
+
+    x = candidates / scale[:, :, None]
+    y = target / scale
+
+    step = 1 / (2 * (x ** 2).sum(axis=(1, 2), keepdims=True)[:, :, 0] + 1e-12)
+
+    n = x.shape[1]
+    w = np.full((x.shape[0], n), 1 / n)
+    z = w.copy()
+    t = 1.0
+
+    for _ in range(iterations):
+
+        residual = np.einsum('gp,gpy->gy', z, x) - y
+        gradient = 2 * np.einsum('gy,gpy->gp', residual, x)
+
+        w_next = project_simplex(z - step * gradient)
+        t_next = (1 + np.sqrt(1 + 4 * t ** 2)) / 2
+        z = w_next + ((t - 1) / t_next) * (w_next - w)
+
+        w, t = w_next, t_next
+
+    return w
+
+
+SCORES = {
+    'level': (level_distance, True),
+    'correlation': (growth_correlation, False),
+    'synthetic': (synthetic_weights, False)
+}
+
+
+def select_controls(dataframe:pd.DataFrame, treated:list[str], score:str='level', k:int=10,
+                    years:tuple=PERIOD, by:list[str]=[], value:str=VALUE, exclude:list[str]=[]) -> pd.DataFrame:
+    """Top k control partners for every by group, e.g. by=['HSCode'].
+
+    Every candidate of every group is scored in one pass. Returns by
+    columns, Partner, Score and Rank (1 is the best match).
+    """
+
+    if score not in SCORES:
+        raise ValueError(f'Score {score} not valid. Try: {", ".join(SCORES)}')
+
+    func, ascending = SCORES[score]
+
+    candidates, target, partners, groups = trajectories(dataframe, treated, value, years, by, exclude)
+    scores = func(candidates, target)
+
+    ordering = np.where(np.isnan(scores), np.inf, scores if ascending else -scores)
+    k = min(k, len(partners))
+    top = np.argsort(ordering, axis=-1, kind='stable')[:, :k]
+
+    result = groups.loc[groups.index.repeat(k)].reset_index(drop=True) if by else pd.DataFrame(index=range(k))
+    result['Partner'] = partners.to_numpy()[top.ravel()]
+    result['Score'] = np.take_along_axis(scores, top, axis=-1).ravel()
+    result['Rank'] = np.tile(np.arange(1, k + 1), len(groups))
+
+    return result
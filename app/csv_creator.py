@@ -1,54 +1,332 @@
 """This module creates an unified csv from others csv"""
 
 import os
+import re
+import json
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+try:
+    from instrument import instrumented, stage
+except ModuleNotFoundError:
+    from app.instrument import instrumented, stage
 
 PATH = '../data/raw-data/switzerland/tophscodes/'
 DEST_PATH = '../data/processed-data/switzerland/'
 FILE_NAME = 'trade20012022.csv'
+DATASET_NAME = 'trade20012022'
+MANIFEST_NAME = '_manifest.json'
+MARKER_SUFFIX = '.marker'
 COLS = ['refPeriodId', 'reporterDesc', 'partnerISO', 'isOriginalClassification', 'fobvalue']
+PARTITIONS = ['refPeriodId', 'reporterDesc']
+
+SCHEMA = pa.schema([
+    ('refPeriodId', pa.int32()),
+    ('reporterDesc', pa.string()),
+    ('partnerISO', pa.string()),
+    ('isOriginalClassification', pa.int64()),
+    ('fobvalue', pa.float64())
+])
+
+PARTITIONING = ds.partitioning(
+    pa.schema([SCHEMA.field(col) for col in PARTITIONS]), flavor='hive'
+)
+
+def get_files(path:str|None=None) -> list[str]:
+
+    if not path:
+        path = PATH
 
-def get_files() -> list[str]:
-    data = [f for f in os.listdir(f'{PATH}') if f.endswith('.csv')]
+    data = [f for f in os.listdir(f'{path}') if f.endswith('.csv')]
     print(f'\nFound files: {data}')
     return data
 
-def read_files() -> list[pd.DataFrame]:
-    data = get_files()
-    frames = []
-    print('\nReading files...')
-
-    for file in data:
-        try:
-            tmp = pd.read_csv(PATH+file, encoding='latin1', usecols=COLS) 
-            frames.append(tmp)
-            print(f'\n{file} read successfully')
-        except Exception as e:
-            print(f'\nError reading {file}: {e}')
-            
-    return frames
+def ingest_file(path:str, file:str, dataset_path:str) -> int:
+    """Parses one raw file and writes it into the partitioned dataset.
 
-def create_dataframe() -> pd.DataFrame:
-    frames = read_files()
-    if frames:
-        print('\nMaking the dataframe...')
-        df = pd.concat(frames, ignore_index=True)
-        print('\nDataframe created')
+    Runs inside a worker process, so only one raw file is held in memory
+    per worker. Fragments are named after the source file, which means
+    re-ingesting a file overwrites its own fragments only.
+    """
+
+    with stage('csv_creator.ingest_file') as record:
+
+        tmp = pd.read_csv(path+file, encoding='latin1', usecols=COLS)
+        table = pa.Table.from_pandas(tmp[COLS], schema=SCHEMA, preserve_index=False)
+
+        stem = os.path.splitext(file)[0]
+
+        ds.write_dataset(
+            table,
+            dataset_path,
+            format='parquet',
+            partitioning=PARTITIONING,
+            basename_template=f'{stem}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore'
+        )
+
+        record['file'] = file
+        record['rows_out'] = table.num_rows
+
+    return table.num_rows
+
+def file_hash(file_path:str, chunk_size:int=1 << 20) -> str:
+
+    digest = hashlib.sha256()
+
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def load_manifest(dataset_path:str) -> dict[str, dict]:
+
+    manifest_path = os.path.join(dataset_path, MANIFEST_NAME)
+
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path) as file:
+        return json.load(file)
+
+def save_manifest(dataset_path:str, manifest:dict[str, dict]) -> None:
+
+    manifest_path = os.path.join(dataset_path, MANIFEST_NAME)
+    tmp_path = manifest_path + '.tmp'
+
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+
+    os.replace(tmp_path, manifest_path)
+
+def manifest_marker(manifest:dict[str, dict]) -> str:
+    """Hash of the ingested file contents, unchanged when only mtimes move"""
+
+    digest = hashlib.sha256()
+
+    for file in sorted(manifest):
+        digest.update(f'{file}:{manifest[file]["hash"]}\n'.encode())
+
+    return digest.hexdigest()
+
+def read_marker(dest:str) -> str|None:
+
+    marker_path = dest + MARKER_SUFFIX
+
+    if not os.path.exists(marker_path):
+        return None
+
+    with open(marker_path) as file:
+        return file.read().strip()
+
+def save_marker(dest:str, marker:str) -> None:
+
+    marker_path = dest + MARKER_SUFFIX
+    tmp_path = marker_path + '.tmp'
+
+    with open(tmp_path, 'w') as file:
+        file.write(marker)
+
+    os.replace(tmp_path, marker_path)
+
+def file_entry(path:str, file:str, previous:dict|None=None) -> dict:
+    """Builds the manifest entry of a raw file.
+
+    The content hash is only recomputed when size or mtime moved.
+    """
+
+    file_path = path + file
+    stat = os.stat(file_path)
+
+    entry = {
+        'path': file_path,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns
+    }
+
+    if previous and previous['size'] == entry['size'] and previous['mtime'] == entry['mtime']:
+        entry['hash'] = previous['hash']
     else:
+        entry['hash'] = file_hash(file_path)
+
+    return entry
+
+def drop_fragments(dataset_path:str, file:str) -> None:
+    """Deletes every fragment written from a raw file"""
+
+    stem = os.path.splitext(file)[0]
+    pattern = re.compile(rf'{re.escape(stem)}-\d+\.parquet')
+
+    for root, _, names in os.walk(dataset_path):
+        for name in names:
+            if pattern.fullmatch(name):
+                os.remove(os.path.join(root, name))
+
+@instrumented
+def ingest(path:str|None=None, dest_path:str|None=None, workers:int|None=None, full:bool=False) -> str:
+    """Streams raw files into a parquet dataset partitioned by year and reporter.
+
+    Files are parsed in parallel across a process pool and never concatenated
+    in memory. A manifest with path, size, mtime and hash of every ingested
+    file lives next to the dataset, so only new or changed files are parsed
+    and the fragments of deleted files are dropped. Pass full=True to rebuild
+    from scratch. Returns the dataset path.
+
+    A file that fails to parse leaves no fragment and no manifest entry,
+    so the next run tries it again; once the pool is done a RuntimeError
+    lists every failure.
+    """
+
+    if not path:
+        path = PATH
+
+    if not dest_path:
+        dest_path = DEST_PATH
+
+    data = get_files(path)
+
+    if not data:
         raise ValueError('Frames cannot be empty')
-        
+
+    dataset_path = os.path.join(dest_path, DATASET_NAME)
+
+    if full and os.path.exists(dataset_path):
+        shutil.rmtree(dataset_path)
+
+    os.makedirs(dataset_path, exist_ok=True)
+
+    manifest = load_manifest(dataset_path)
+    current = {file: file_entry(path, file, manifest.get(file)) for file in data}
+
+    deleted = [file for file in manifest if file not in current]
+    changed = [
+        file for file in data
+        if file not in manifest or manifest[file]['hash'] != current[file]['hash']
+    ]
+    touched = [
+        file for file in data
+        if file not in changed and manifest[file] != current[file]
+    ]
+
+    for file in deleted + changed:
+        drop_fragments(dataset_path, file)
+        manifest.pop(file, None)
+
+    for file in touched:
+        manifest[file] = current[file]
+
+    print(f'\nChanged files: {changed}')
+    print(f'\nDeleted files: {deleted}')
+
+    failed = {}
+
+    if changed:
+
+        print('\nReading files...')
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+
+            futures = {
+                pool.submit(ingest_file, path, file, dataset_path): file
+                for file in changed
+            }
+
+            for future in as_completed(futures):
+                file = futures[future]
+                try:
+                    rows = future.result()
+                    manifest[file] = current[file]
+                    print(f'\n{file} read successfully ({rows} rows)')
+                except Exception as e:
+                    failed[file] = e
+                    print(f'\nError reading {file}: {e}')
+
+    for file in failed:
+        drop_fragments(dataset_path, file)
+
+    if deleted or changed or touched:
+        save_manifest(dataset_path, manifest)
+
+    if failed:
+        errors = '; '.join(f'{file}: {error}' for file, error in sorted(failed.items()))
+        raise RuntimeError(f'Could not ingest {len(failed)} of {len(changed)} files. {errors}')
+
+    if not manifest:
+        raise ValueError('Frames cannot be empty')
+
+    return dataset_path
+
+def get_dataset(dataset_path:str|None=None) -> ds.Dataset:
+
+    if not dataset_path:
+        dataset_path = os.path.join(DEST_PATH, DATASET_NAME)
+
+    return ds.dataset(dataset_path, format='parquet', partitioning=PARTITIONING)
+
+def create_dataframe() -> pd.DataFrame:
+    dataset_path = ingest()
+    print('\nMaking the dataframe...')
+    df = get_dataset(dataset_path).to_table(columns=COLS).to_pandas()
+    print('\nDataframe created')
+
     return df
 
-def save_dataframe() -> None:
-    df = create_dataframe()
+def write_csv(dataset:ds.Dataset, dest:str) -> None:
+    """Writes the dataset to a single csv one record batch at a time.
+
+    Batches go to a temporary file that replaces dest only once complete,
+    so a failed write never leaves a truncated csv that looks up to date.
+    """
+
+    header = True
+    tmp_path = dest + f'.{os.getpid()}.tmp'
+
+    try:
+        with stage('csv_creator.write_csv') as record, open(tmp_path, 'w', newline='') as file:
+
+            rows = 0
+
+            for batch in dataset.to_batches(columns=COLS):
+                batch.to_pandas().to_csv(file, index=False, header=header)
+                header = False
+                rows += batch.num_rows
+
+            record['rows_out'] = rows
+
+        os.replace(tmp_path, dest)
+
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@instrumented
+def save_dataframe(workers:int|None=None, full:bool=False) -> None:
+    dataset_path = ingest(workers=workers, full=full)
     file_name = FILE_NAME
+    dest = DEST_PATH + file_name
+
+    # The csv records which file contents it was written from, so a touched
+    # manifest whose hashes didn't move doesn't rewrite it
+    marker = manifest_marker(load_manifest(dataset_path))
+
+    if os.path.exists(dest) and read_marker(dest) == marker:
+        print('\nDataframe is up to date')
+        return
+
     try:
         print('\nSaving dataframe to csv...')
-        df.to_csv(DEST_PATH + file_name, index=False)
+        write_csv(get_dataset(dataset_path), dest)
+        save_marker(dest, marker)
         print('\nDataframe saved')
     except Exception as e:
         print(f'something went wrong saving the dataframe: {e}')
-        
-        
+
+
 if __name__ == '__main__':
-    save_dataframe()
\ No newline at end of file
+    save_dataframe()
@@ -0,0 +1,109 @@
+"""This module keeps pre-aggregated sums of trade values"""
+import os
+import itertools
+import pandas as pd
+
+DIMS = ['Year', 'Partner', 'HSCode', 'Flow']
+VALUE = 'RealValue'
+TOTAL = 'total'
+
+
+class Cube:
+    """Sums of a value at (Year, Partner, HSCode, Flow) granularity plus every roll-up.
+
+    cells maps a tuple of dimensions to the frame of sums grouped by them.
+    aggregate() answers from the smallest cell set that covers the requested
+    dimensions and filters, so no raw rows are ever grouped again.
+    """
+
+    def __init__(self, cells:dict[tuple, pd.DataFrame], value:str=VALUE):
+
+        self.cells = cells
+        self.value = value
+        self.dims = list(max(cells, key=len))
+
+    @classmethod
+    def build(cls, dataframe:pd.DataFrame, value:str=VALUE, dims:list[str]=DIMS, rollups:bool=True) -> 'Cube':
+
+        dims = [dim for dim in dims if dim in dataframe.columns]
+
+        base = dataframe.groupby(dims, observed=True)[value].sum().reset_index()
+        cells = {tuple(dims): base}
+
+        if rollups:
+            for size in range(len(dims) - 1, -1, -1):
+                for subset in itertools.combinations(dims, size):
+                    cells[subset] = group_sum(base, list(subset), value)
+
+        return cls(cells, value)
+
+    def source(self, dims:set[str]) -> pd.DataFrame:
+        """Smallest stored cell set grouped by at least dims"""
+
+        candidates = [key for key in self.cells if dims <= set(key)]
+
+        if not candidates:
+            raise ValueError(f'Dimensions {sorted(dims)} not in cube. Valid: {self.dims}')
+
+        return self.cells[min(candidates, key=lambda key: len(self.cells[key]))]
+
+    def aggregate(self, dims:list[str]=[], years:tuple|None=None, **filters) -> pd.DataFrame:
+        """Sums of the value grouped by dims.
+
+        years is an inclusive (low, high) range and filters map a dimension
+        to a value or list of values, e.g. Partner=['Peru', 'Chile'].
+        """
+
+        needed = set(dims) | set(filters)
+        if years:
+            needed.add('Year')
+
+        df = self.source(needed)
+
+        if years or filters:
+
+            mask = pd.Series(True, index=df.index)
+
+            if years:
+                low, high = years
+                mask &= df['Year'].between(low, high)
+
+            for dim, values in filters.items():
+                if not isinstance(values, (list, tuple, set)):
+                    values = [values]
+                mask &= df[dim].isin(values)
+
+            df = df[mask]
+
+        if set(dims) == set(df.columns) - {self.value}:
+            return df[list(dims) + [self.value]].reset_index(drop=True)
+
+        return group_sum(df, list(dims), self.value)
+
+    def save(self, path:str) -> None:
+
+        os.makedirs(path, exist_ok=True)
+
+        for key, frame in self.cells.items():
+            name = '-'.join(key) if key else TOTAL
+            frame.to_parquet(os.path.join(path, f'{name}.parquet'), index=False)
+
+    @classmethod
+    def load(cls, path:str, value:str=VALUE) -> 'Cube':
+
+        cells = {}
+
+        for file in os.listdir(path):
+            name = os.path.splitext(file)[0]
+            key = () if name == TOTAL else tuple(name.split('-'))
+            cells[key] = pd.read_parquet(os.path.join(path, file))
+
+        return cls(cells, value)
+
+
+def group_sum(dataframe:pd.DataFrame, dims:list[str], value:str=VALUE) -> pd.DataFrame:
+
+    if not dims:
+        return pd.DataFrame({value: [dataframe[value].sum()]})
+
+    return dataframe.groupby(dims, observed=True)[value].sum().reset_index()
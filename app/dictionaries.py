@@ -0,0 +1,341 @@
+"""This module keeps one list of categories per column shared by every file of the project.
+
+Every partner, flow or other registered value seen is appended to a list
+persisted in data/processed-data/dictionaries.json, so frames loaded from
+different files, chunks or processes share the same CategoricalDtype and
+concatenate or merge without falling back to object. Frames encoded before
+the registry grew are put back on the same dtype by concat(). Values are never
+reordered or removed, so a code keeps its value once given. Tables and
+figures that should list values sorted go through sort_categories() on
+their way out. HSCode is left out by default, as its int32 values are
+already stable codes (see hscodes).
+
+Synthetic, mock and benchmark data keep their own file, see SYNTHETIC and
+using(), so made-up partners never reach the project's dictionaries.
+"""
+import os
+import json
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATH = os.path.join(ROOT, 'data', 'processed-data', 'dictionaries.json')
+SYNTHETIC = os.path.join(ROOT, 'data', 'synthetic', 'dictionaries.json')
+COLUMNS = ['Partner', 'Flow']
+
+# Compact mode: narrower numbers, registered columns as categories
+COMPACT = {
+    'Year': 'int16',
+    'FobValue': 'float32',
+    'RealValue': 'float32'
+}
+
+LOCK_TIMEOUT = 30.0
+
+
+@contextmanager
+def lock(path:str, timeout:float=LOCK_TIMEOUT):
+    """Exclusive lock file next to path. A lock older than timeout is taken as stale"""
+
+    lock_path = path + '.lock'
+    start = time.monotonic()
+
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > timeout:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() - start > timeout:
+                raise TimeoutError(f'Could not lock {path}')
+            time.sleep(0.01)
+
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
+
+
+def ordered(values:list) -> list:
+    """values sorted, by their text when they can't be compared"""
+
+    try:
+        return sorted(values)
+    except TypeError:
+        return sorted(values, key=str)
+
+
+class Registry:
+    """Column -> categories in the order first seen, read from and appended to a json file"""
+
+    def __init__(self, path:str|None=None):
+
+        self.path = path or os.environ.get('TRADE_DICTIONARIES') or PATH
+        self.categories = {}
+        self.dtypes = {}
+        self.loaded = None
+
+    def load(self) -> None:
+        """Reads the file again when another process changed it"""
+
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+
+        if mtime == self.loaded:
+            return
+
+        with open(self.path) as file:
+            self.categories = json.load(file)
+
+        self.dtypes = {}
+        self.loaded = mtime
+
+    def save(self) -> None:
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + f'.{os.getpid()}.tmp'
+
+        with open(tmp_path, 'w') as file:
+            json.dump(self.categories, file, indent=1, default=int)
+
+        os.replace(tmp_path, self.path)
+        self.loaded = os.path.getmtime(self.path)
+
+    def extend(self, column:str, values) -> None:
+        """Appends the values column doesn't have yet, sorted, under the file lock"""
+
+        self.load()
+
+        known = set(self.categories.get(column, []))
+        new = [value for value in pd.unique(pd.Series(list(values))) if pd.notna(value) and value not in known]
+
+        if not new:
+            return
+
+        with lock(self.path):
+
+            self.load()
+            known = set(self.categories.get(column, []))
+            new = ordered([value for value in new if value not in known])
+
+            if new:
+                self.categories.setdefault(column, []).extend(
+                    int(value) if hasattr(value, 'item') and not isinstance(value, str) else value for value in new
+                )
+                self.dtypes.pop(column, None)
+                self.save()
+
+    def dtype(self, column:str) -> pd.CategoricalDtype:
+
+        self.load()
+
+        if column not in self.dtypes:
+            self.dtypes[column] = pd.CategoricalDtype(self.categories.get(column, []))
+
+        return self.dtypes[column]
+
+    def encode(self, dataframe:pd.DataFrame, columns:list[str]|None=None, categorical:bool=False) -> pd.DataFrame:
+        """Copy of dataframe with the categorical registered columns re-coded to the shared categories.
+
+        Only categories are compared and extended, then every column is
+        re-coded in one vectorized pass. With categorical=True, registered
+        columns that aren't categorical yet are converted too. Column data
+        is shared with dataframe until re-coded, dataframe is left as it is.
+        """
+
+        if columns is None:
+            columns = COLUMNS
+
+        dataframe = dataframe.copy(deep=False)
+
+        for column in columns:
+
+            if column not in dataframe.columns:
+                continue
+
+            series = dataframe[column]
+            is_categorical = isinstance(series.dtype, pd.CategoricalDtype)
+
+            if not is_categorical and not categorical:
+                continue
+
+            values = series.cat.categories if is_categorical else series.dropna().unique()
+            self.extend(column, values)
+
+            dtype = self.dtype(column)
+
+            # Unordered dtypes compare equal whatever the order of their categories
+            if is_categorical and series.cat.categories.equals(dtype.categories):
+                continue
+
+            if is_categorical:
+                dataframe[column] = series.cat.set_categories(dtype.categories)
+            else:
+                dataframe[column] = series.astype(dtype)
+
+        return dataframe
+
+    def encode_table(self, table:pa.Table, columns:list[str]|None=None) -> pa.Table:
+        """table with the dictionary registered columns re-coded to the shared categories.
+
+        Same as encode(), but on the Arrow side, so to_pandas() builds the
+        shared CategoricalDtype directly and the other columns of a memory
+        mapped table are not copied once more to be re-coded.
+        """
+
+        if columns is None:
+            columns = COLUMNS
+
+        for column in columns:
+
+            if column not in table.column_names:
+                continue
+
+            kind = table.schema.field(column).type
+
+            if not pa.types.is_dictionary(kind):
+                continue
+
+            chunks = table.column(column).chunks
+            self.extend(column, {value for chunk in chunks for value in chunk.dictionary.to_pylist()})
+
+            categories = pa.array(list(self.dtype(column).categories), kind.value_type)
+
+            if all(chunk.dictionary.equals(categories) for chunk in chunks):
+                continue
+
+            recoded = [
+                pa.DictionaryArray.from_arrays(
+                    pc.take(pc.index_in(chunk.dictionary, value_set=categories), chunk.indices), categories
+                )
+                for chunk in chunks
+            ]
+
+            table = table.set_column(
+                table.schema.get_field_index(column), column,
+                pa.chunked_array(recoded, pa.dictionary(pa.int32(), kind.value_type))
+            )
+
+        return table
+
+    def concat(self, frames:list[pd.DataFrame], columns:list[str]|None=None, **kwargs) -> pd.DataFrame:
+        """pd.concat of frames whose registered columns are all re-coded to the current categories.
+
+        A frame encoded before the registry grew keeps the smaller dtype, and
+        pd.concat falls back to object when dtypes differ. Every value is
+        registered first, so all frames end up with the same dtype. kwargs go
+        to pd.concat.
+        """
+
+        if columns is None:
+            columns = COLUMNS
+
+        frames = list(frames)
+        categorical = [
+            column for column in columns
+            if any(column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames)
+        ]
+
+        for frame in frames:
+            for column in categorical:
+                if column in frame.columns:
+                    series = frame[column]
+                    self.extend(column, series.cat.categories if isinstance(series.dtype, pd.CategoricalDtype)
+                                else series.dropna().unique())
+
+        return pd.concat([self.encode(frame, categorical, categorical=True) for frame in frames], **kwargs)
+
+
+REGISTRY = Registry()
+
+
+def configure(path:str) -> Registry:
+    """Points the shared registry to another file, e.g. for synthetic data"""
+
+    global REGISTRY
+    REGISTRY = Registry(path)
+
+    return REGISTRY
+
+
+@contextmanager
+def using(path:str):
+    """Points the shared registry to path inside the block, e.g. for synthetic data"""
+
+    global REGISTRY
+    previous = REGISTRY
+    REGISTRY = Registry(path)
+
+    try:
+        yield REGISTRY
+    finally:
+        REGISTRY = previous
+
+
+def encode(dataframe:pd.DataFrame, columns:list[str]|None=None, categorical:bool=False) -> pd.DataFrame:
+    return REGISTRY.encode(dataframe, columns, categorical)
+
+
+def encode_table(table:pa.Table, columns:list[str]|None=None) -> pa.Table:
+    return REGISTRY.encode_table(table, columns)
+
+
+def concat(frames:list[pd.DataFrame], columns:list[str]|None=None, **kwargs) -> pd.DataFrame:
+    return REGISTRY.concat(frames, columns, **kwargs)
+
+
+def dtype(column:str) -> pd.CategoricalDtype:
+    return REGISTRY.dtype(column)
+
+
+def sort_categories(dataframe:pd.DataFrame, columns:list[str]|None=None) -> pd.DataFrame:
+    """Copy of dataframe whose categorical registered columns list their categories sorted.
+
+    Meant for tables and figures, whose groupby and legend order follow the
+    categories. The codes are re-mapped, so encode() the result again before
+    concatenating it with encoded frames.
+    """
+
+    if columns is None:
+        columns = COLUMNS
+
+    dataframe = dataframe.copy(deep=False)
+
+    for column in columns:
+        if column in dataframe.columns and isinstance(dataframe[column].dtype, pd.CategoricalDtype):
+            series = dataframe[column]
+            dataframe[column] = series.cat.reorder_categories(ordered(list(series.cat.categories)))
+
+    return dataframe
+
+
+def compact_dtypes(dtypes:dict) -> dict:
+    """dtypes with narrower numbers and the registered columns as categories"""
+
+    result = dict(dtypes)
+    result.update({column: 'category' for column in COLUMNS})
+    result.update(COMPACT)
+
+    return result
+
+
+def compact(dataframe:pd.DataFrame) -> pd.DataFrame:
+    """Narrows the numbers and encodes the registered columns of a loaded frame"""
+
+    narrow = {column: dtype for column, dtype in COMPACT.items() if column in dataframe.columns}
+
+    return encode(dataframe.astype(narrow), categorical=True)
@@ -0,0 +1,334 @@
+"""This module downloads Comtrade extracts into the raw-data layout csv_creator reads.
+
+Every reporter x year x HS code batch is one job and one csv in
+raw-data/<country>/tophscodes/. Jobs run concurrently on an
+httpx.AsyncClient whose pool keeps at most concurrency connections alive,
+paced by a token bucket, and failed requests are retried with
+exponential backoff. Bodies are streamed to a
+.part file and a state file next to the csvs records the progress of every
+job, so an interrupted run resumes where it stopped: finished jobs are
+skipped and partial ones continue with a Range request.
+
+    python comtrade_mock.py --port 8765
+    python downloader.py colombia --years 2001-2022 --url http://127.0.0.1:8765/data/v1/get/C/A/HS
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass
+from urllib.parse import urlencode
+
+import httpx
+import pandas as pd
+
+from instrument import stage
+
+URL = 'https://comtradeapi.un.org/data/v1/get/C/A/HS'
+DEST = '../data/raw-data/{country}/tophscodes/'
+STATE_NAME = '_download_state.json'
+KEY_HEADER = 'Ocp-Apim-Subscription-Key'
+
+# UN M49 reporter codes used by Comtrade
+REPORTERS = {
+    'colombia': 170,
+    'switzerland': 757
+}
+
+HSCODES = ['0901', '2709', '3004', '7108']
+YEARS = range(2001, 2023)
+
+CONCURRENCY = 8
+RATE = 5.0
+RETRIES = 5
+BACKOFF = 0.5
+TIMEOUT = 60.0
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status:int, retry_after:float|None=None):
+        super().__init__(f'HTTP {status}')
+        self.status = status
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Job:
+    """One extract: a reporter, a year and a batch of HS codes"""
+
+    country: str
+    reporter: int
+    year: int
+    hscodes: tuple[str, ...]
+    batch: int
+
+    @property
+    def name(self) -> str:
+        return f'{self.country}-{self.year}-{self.batch:03d}.csv'
+
+    def query(self) -> dict:
+        return {
+            'reporterCode': self.reporter,
+            'period': self.year,
+            'cmdCode': ','.join(self.hscodes),
+            'flowCode': 'M,X'
+        }
+
+
+def jobs(countries:list[str], years:range=YEARS, hscodes:list[str]=HSCODES, batch_size:int=10) -> list[Job]:
+
+    for country in countries:
+        if country not in REPORTERS:
+            raise ValueError(f'Reporter {country} not configured. Try: {", ".join(REPORTERS)}')
+
+    batches = [tuple(hscodes[i:i + batch_size]) for i in range(0, len(hscodes), batch_size)]
+
+    return [
+        Job(country, REPORTERS[country], year, codes, batch)
+        for country in countries
+        for year in years
+        for batch, codes in enumerate(batches)
+    ]
+
+
+class TokenBucket:
+    """Allows rate requests per second on average and bursts of capacity"""
+
+    def __init__(self, rate:float=RATE, capacity:float|None=None):
+
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+
+        while True:
+
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def retry_after(headers:httpx.Headers) -> float|None:
+
+    try:
+        return float(headers['retry-after'])
+    except (KeyError, ValueError):
+        return None
+
+
+class Downloader:
+
+    def __init__(self, url:str=URL, dest:str=DEST, key:str|None=None, concurrency:int=CONCURRENCY,
+                 rate:float=RATE, retries:int=RETRIES, backoff:float=BACKOFF, timeout:float=TIMEOUT):
+
+        self.url = url
+        self.dest = dest
+        self.key = key or os.environ.get('COMTRADE_KEY')
+        self.concurrency = concurrency
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.states = {}
+
+    def directory(self, job:Job) -> str:
+        return self.dest.format(country=job.country)
+
+    def load_state(self, directory:str) -> dict:
+
+        if directory not in self.states:
+
+            path = os.path.join(directory, STATE_NAME)
+            state = {}
+
+            if os.path.exists(path):
+                with open(path) as file:
+                    state = json.load(file)
+
+            self.states[directory] = state
+
+        return self.states[directory]
+
+    def save_state(self, directory:str) -> None:
+
+        path = os.path.join(directory, STATE_NAME)
+        tmp_path = path + '.tmp'
+
+        with open(tmp_path, 'w') as file:
+            json.dump(self.states[directory], file, indent=2, sort_keys=True)
+
+        os.replace(tmp_path, path)
+
+    def update(self, job:Job, **entry) -> None:
+
+        directory = self.directory(job)
+        state = self.load_state(directory)
+        state[job.name] = {**state.get(job.name, {}), **entry}
+        self.save_state(directory)
+
+    def done(self, job:Job) -> bool:
+
+        entry = self.load_state(self.directory(job)).get(job.name, {})
+
+        return entry.get('status') == 'done' and os.path.exists(os.path.join(self.directory(job), job.name))
+
+    async def request(self, client:httpx.AsyncClient, job:Job) -> int:
+        """One attempt at a job. Resumes the .part file and returns the bytes written"""
+
+        directory = self.directory(job)
+        part_path = os.path.join(directory, job.name + '.part')
+        entry = self.load_state(directory).get(job.name, {})
+
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        headers = {'Accept-Encoding': 'identity'}
+
+        if self.key:
+            headers[KEY_HEADER] = self.key
+
+        if offset and entry.get('etag'):
+            headers.update({'Range': f'bytes={offset}-', 'If-Range': entry['etag']})
+
+        async with asyncio.timeout(self.timeout):
+            async with client.stream('GET', self.url, params=job.query(), headers=headers) as response:
+
+                if response.status_code == 416 and offset:
+                    # The .part file already holds the whole body
+                    os.replace(part_path, os.path.join(directory, job.name))
+                    return offset
+
+                if response.status_code not in (200, 206):
+                    # Read so the connection goes back to the pool
+                    await response.aread()
+                    raise HTTPError(response.status_code, retry_after(response.headers))
+
+                if response.status_code == 200:
+                    offset = 0
+
+                self.update(job, status='partial', etag=response.headers.get('etag'),
+                            url=f'{self.url}?{urlencode(job.query())}')
+
+                if response.headers.get('content-type', '').startswith('application/json'):
+                    return await self.write_json(response, directory, job)
+
+                written = 0
+
+                # Raw bytes as they arrive, so a cut body leaves all it got in the
+                # .part file and its size is the offset of the next Range
+                with open(part_path, 'ab' if offset else 'wb') as file:
+                    async for chunk in response.aiter_raw():
+                        file.write(chunk)
+                        written += len(chunk)
+
+        os.replace(part_path, os.path.join(directory, job.name))
+
+        return offset + written
+
+    async def write_json(self, response:httpx.Response, directory:str, job:Job) -> int:
+        """Writes the records of a Comtrade JSON response as the job's csv"""
+
+        content = await response.aread()
+        records = json.loads(content).get('data', [])
+
+        pd.DataFrame(records).to_csv(os.path.join(directory, job.name), index=False, encoding='latin1')
+
+        return len(content)
+
+    async def fetch(self, client:httpx.AsyncClient, bucket:TokenBucket, job:Job) -> str:
+        """Runs a job until it succeeds or runs out of retries, and returns its status"""
+
+        os.makedirs(self.directory(job), exist_ok=True)
+
+        for attempt in range(self.retries + 1):
+
+            await bucket.acquire()
+
+            try:
+                size = await self.request(client, job)
+                self.update(job, status='done', bytes=size, attempts=attempt + 1)
+                return 'done'
+
+            except HTTPError as e:
+                if e.status not in RETRY_STATUS or attempt == self.retries:
+                    self.update(job, status='failed', error=str(e), attempts=attempt + 1)
+                    return 'failed'
+                delay = e.retry_after
+
+            except (httpx.TransportError, OSError, TimeoutError, ValueError) as e:
+                if attempt == self.retries:
+                    self.update(job, status='failed', error=repr(e), attempts=attempt + 1)
+                    return 'failed'
+                delay = None
+
+            if delay is None:
+                delay = self.backoff * 2 ** attempt
+
+            await asyncio.sleep(delay + random.uniform(0, self.backoff))
+
+        return 'failed'
+
+    async def download(self, jobs:list[Job]) -> dict[str, str]:
+
+        pending = [job for job in jobs if not self.done(job)]
+        result = {job.name: 'skipped' for job in jobs if job not in pending}
+
+        bucket = TokenBucket(self.rate)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+
+        # Jobs beyond concurrency wait for a connection, however long that takes
+        async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(self.timeout, pool=None)) as client:
+            statuses = await asyncio.gather(*(self.fetch(client, bucket, job) for job in pending))
+
+        result.update((job.name, status) for job, status in zip(pending, statuses))
+
+        return result
+
+    def run(self, jobs:list[Job]) -> dict[str, str]:
+        """Downloads every job not done yet and returns job name -> done, skipped or failed"""
+
+        with stage('downloader.run') as record:
+            result = asyncio.run(self.download(jobs))
+            record['jobs'] = len(jobs)
+            record['failed'] = sum(status == 'failed' for status in result.values())
+
+        return result
+
+
+def parse_years(years:str) -> range:
+
+    first, _, last = years.partition('-')
+
+    return range(int(first), int(last or first) + 1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Downloads Comtrade extracts into raw-data/<country>/tophscodes/')
+    parser.add_argument('countries', nargs='*', default=list(REPORTERS))
+    parser.add_argument('--years', default=f'{YEARS.start}-{YEARS.stop - 1}')
+    parser.add_argument('--hscodes', default=','.join(HSCODES))
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--url', default=URL)
+    parser.add_argument('--dest', default=DEST)
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--rate', type=float, default=RATE)
+    parser.add_argument('--retries', type=int, default=RETRIES)
+    args = parser.parse_args()
+
+    downloader = Downloader(args.url, args.dest, concurrency=args.concurrency, rate=args.rate, retries=args.retries)
+    result = downloader.run(jobs(args.countries, parse_years(args.years), args.hscodes.split(','), args.batch_size))
+
+    print(pd.Series(result, name='Status').value_counts().to_string())
@@ -0,0 +1,356 @@
+"""This module estimates difference-in-differences effects with high-dimensional fixed effects.
+
+Fixed effects are never turned into dummy columns. Each one is a vector of
+integer codes and is absorbed by alternating projections: the weighted
+group means of every fixed effect are subtracted in turn, with bincount,
+until they stop moving. The regression then runs on the demeaned columns
+only. PPML is solved by iteratively reweighted least squares over that
+same demeaning, and standard errors are clustered. Their small sample
+correction counts the fixed effect levels that are not nested in the
+clusters, as reghdfe and fixest do.
+
+Fixed effects are given as tuples of columns, e.g. ('Partner', 'Year').
+With one reporter, partner-year effects absorb a partner-level treatment,
+so the defaults are pair (Partner x HSCode x Flow) and product-year
+(HSCode x Flow x Year) effects. With a Reporter column, as in store.scan(),
+exporter-year, importer-year and pair effects can be used instead, see
+GRAVITY_EFFECTS.
+"""
+from math import erfc, sqrt
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from groups import GROUPS
+from instrument import instrumented
+
+VALUE = 'RealValue'
+START = 2012
+CLUSTER = 'Partner'
+FIXED_EFFECTS = [('Partner', 'HSCode', 'Flow'), ('HSCode', 'Flow', 'Year')]
+GRAVITY_EFFECTS = [('Reporter', 'Year'), ('Partner', 'Year'), ('Reporter', 'Partner', 'HSCode')]
+
+TOLERANCE = 1e-8
+MAX_ITERATIONS = 10_000
+PPML_TOLERANCE = 1e-8
+PPML_ITERATIONS = 100
+Z_95 = 1.959963984540054
+
+
+@dataclass
+class Estimate:
+    """Coefficients with clustered standard errors and how the fit went"""
+
+    method: str
+    coefficients: pd.DataFrame
+    nobs: int
+    dropped: int
+    clusters: int
+    iterations: int
+    converged: bool
+
+    def __str__(self) -> str:
+        return (f'{self.method.upper()} with {self.nobs} observations ({self.dropped} dropped), '
+                f'{self.clusters} clusters\n{self.coefficients.to_string()}')
+
+
+def fe_codes(dataframe:pd.DataFrame, fixed_effects:list) -> list[np.ndarray]:
+    """One array of group codes per fixed effect, a str meaning a single column"""
+
+    codes = []
+
+    for columns in fixed_effects:
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        codes.append(dataframe.groupby(columns, observed=True, sort=False).ngroup().to_numpy())
+
+    return codes
+
+
+def prune(codes:list[np.ndarray], y:np.ndarray, ppml:bool) -> np.ndarray:
+    """Rows left after repeatedly dropping singletons and, for PPML, groups of zeros only.
+
+    Both are fitted exactly by their fixed effect, so they add nothing but
+    would keep some estimates from existing.
+    """
+
+    keep = np.ones(len(y), dtype=bool)
+
+    while True:
+
+        drop = np.zeros(len(y), dtype=bool)
+
+        for code in codes:
+
+            counts = np.bincount(code, weights=keep)
+            drop |= counts[code] <= 1
+
+            if ppml:
+                drop |= np.bincount(code, weights=y * keep)[code] <= 0
+
+        drop &= keep
+
+        if not drop.any():
+            return keep
+
+        keep &= ~drop
+
+
+def recode(codes:list[np.ndarray], keep:np.ndarray) -> list[np.ndarray]:
+    return [np.unique(code[keep], return_inverse=True)[1] for code in codes]
+
+
+def demean(values:np.ndarray, codes:list[np.ndarray], weights:np.ndarray|None=None,
+           tolerance:float=TOLERANCE, max_iterations:int=MAX_ITERATIONS) -> tuple[np.ndarray, int, bool]:
+    """Residuals of the columns of values on every fixed effect, by alternating projections.
+
+    Returns the residuals, the sweeps made and whether the largest group
+    mean removed in the last sweep fell below tolerance times the scale of
+    its column.
+    """
+
+    if weights is None:
+        weights = np.ones(len(values))
+
+    resid = np.array(values, dtype='float64', order='F', copy=True)
+    sizes = [np.bincount(code, weights=weights) for code in codes]
+    scale = np.maximum(np.abs(resid).max(axis=0), 1e-300)
+
+    for iteration in range(1, max_iterations + 1):
+
+        change = np.zeros(resid.shape[1])
+
+        for code, size in zip(codes, sizes):
+            for j in range(resid.shape[1]):
+                means = np.bincount(code, weights=weights * resid[:, j], minlength=len(size)) / size
+                resid[:, j] -= means[code]
+                change[j] = max(change[j], np.abs(means).max())
+
+        # A single fixed effect is absorbed exactly in one sweep
+        if len(codes) == 1 or (change <= tolerance * scale).all():
+            return resid, iteration, True
+
+    return resid, max_iterations, False
+
+
+def components(first:np.ndarray, second:np.ndarray) -> int:
+    """Connected groups of two fixed effects, linked by the rows they share"""
+
+    labels = np.arange(first.max() + 1)
+
+    while True:
+        # Every group of second takes the smallest label of its groups of first, then back
+        linked = np.full(second.max() + 1, len(labels))
+        np.minimum.at(linked, second, labels[first])
+        updated = labels.copy()
+        np.minimum.at(updated, first, linked[second])
+
+        if (updated == labels).all():
+            return len(np.unique(labels))
+
+        labels = updated
+
+
+def fe_rank(codes:list[np.ndarray]) -> int:
+    """Independent dummy columns of the fixed effects, exact for two and one less per fixed effect after that"""
+
+    if not codes:
+        return 0
+
+    rank = sum(int(code.max()) + 1 for code in codes)
+
+    if len(codes) > 1:
+        rank -= components(codes[0], codes[1]) + len(codes) - 2
+
+    return rank
+
+
+def nested(code:np.ndarray, clusters:np.ndarray) -> bool:
+    """Whether every group of a fixed effect lies within one cluster"""
+
+    first = np.zeros(code.max() + 1, dtype=clusters.dtype)
+    first[code] = clusters
+
+    return bool((first[code] == clusters).all())
+
+
+def absorbed_df(codes:list[np.ndarray], clusters:np.ndarray) -> int:
+    """Degrees of freedom taken by the fixed effects that are not nested in the clusters.
+
+    A fixed effect within one cluster sums to zero in the cluster scores
+    already, so only the rank the others add beyond it counts.
+    """
+
+    return fe_rank(codes) - fe_rank([code for code in codes if nested(code, clusters)])
+
+
+def cluster_vcov(x:np.ndarray, scores:np.ndarray, bread:np.ndarray, clusters:np.ndarray,
+                 absorbed:int=0) -> tuple[np.ndarray, int]:
+    """Clustered sandwich with the usual G/(G-1) * (N-1)/(N-K) correction.
+
+    K counts the columns of x and the absorbed degrees of freedom, see absorbed_df().
+    """
+
+    n = x.shape[0]
+    k = x.shape[1] + absorbed
+    groups = clusters.max() + 1
+
+    sums = np.column_stack([np.bincount(clusters, weights=x[:, j] * scores, minlength=groups) for j in range(x.shape[1])])
+    meat = sums.T @ sums
+
+    correction = groups / (groups - 1) * (n - 1) / (n - k) if groups > 1 and n > k else 1.0
+
+    return correction * bread @ meat @ bread, groups
+
+
+def check_absorbed(x:np.ndarray, xd:np.ndarray, names:list[str]) -> None:
+
+    for j, name in enumerate(names):
+        if np.abs(xd[:, j]).max() <= 1e-9 * max(np.abs(x[:, j]).max(), 1e-300):
+            raise ValueError(f'{name} is absorbed by the fixed effects. Try other fixed_effects')
+
+
+def coefficient_table(names:list[str], beta:np.ndarray, vcov:np.ndarray) -> pd.DataFrame:
+
+    se = np.sqrt(np.diag(vcov))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = beta / se
+
+    return pd.DataFrame({
+        'Coefficient': beta,
+        'StdError': se,
+        'z': z,
+        'PValue': [erfc(abs(value) / sqrt(2)) if np.isfinite(value) else np.nan for value in z],
+        'Low': beta - Z_95 * se,
+        'High': beta + Z_95 * se
+    }, index=pd.Index(names, name='Variable'))
+
+
+def prepare(dataframe:pd.DataFrame, y:str, x:list[str], fixed_effects:list, cluster:str, ppml:bool):
+    """y, x, fixed effect codes and cluster codes of the rows that can be estimated"""
+
+    df = dataframe.dropna(subset=[y] + x)
+    values = df[y].to_numpy(dtype='float64')
+
+    codes = fe_codes(df, fixed_effects)
+    keep = prune(codes, values, ppml)
+
+    clusters = pd.factorize(df[cluster].to_numpy()[keep])[0]
+
+    return values[keep], df[x].to_numpy(dtype='float64')[keep], recode(codes, keep), clusters, len(dataframe) - keep.sum()
+
+
+@instrumented
+def ols(dataframe:pd.DataFrame, y:str, x:list[str], fixed_effects:list=FIXED_EFFECTS, cluster:str=CLUSTER,
+        tolerance:float=TOLERANCE) -> Estimate:
+    """Least squares of y on x with the fixed effects absorbed, standard errors clustered by cluster"""
+
+    values, regressors, codes, clusters, dropped = prepare(dataframe, y, x, fixed_effects, cluster, False)
+
+    demeaned, iterations, converged = demean(np.column_stack([values, regressors]), codes, tolerance=tolerance)
+    yd, xd = demeaned[:, 0], demeaned[:, 1:]
+    check_absorbed(regressors, xd, x)
+
+    bread = np.linalg.inv(xd.T @ xd)
+    beta = bread @ (xd.T @ yd)
+
+    vcov, groups = cluster_vcov(xd, yd - xd @ beta, bread, clusters, absorbed_df(codes, clusters))
+
+    return Estimate('ols', coefficient_table(x, beta, vcov), len(values), int(dropped), groups, iterations, converged)
+
+
+@instrumented
+def ppml(dataframe:pd.DataFrame, y:str, x:list[str], fixed_effects:list=FIXED_EFFECTS, cluster:str=CLUSTER,
+         tolerance:float=PPML_TOLERANCE, max_iterations:int=PPML_ITERATIONS) -> Estimate:
+    """Poisson pseudo-maximum likelihood of y on x with the fixed effects absorbed.
+
+    Every IRLS step demeans the working variable and x with weights mu and
+    solves the weighted least squares; the fixed effects are never
+    estimated. y is scaled by its mean, which only shifts them.
+    """
+
+    values, regressors, codes, clusters, dropped = prepare(dataframe, y, x, fixed_effects, cluster, True)
+
+    values = values / values.mean()
+    mu = (values + values.mean()) / 2
+    eta = np.log(mu)
+    deviance = np.inf
+    converged = False
+
+    for iteration in range(1, max_iterations + 1):
+
+        z = eta + (values - mu) / mu
+        demeaned, _, _ = demean(np.column_stack([z, regressors]), codes, mu, min(TOLERANCE, tolerance))
+        zd, xd = demeaned[:, 0], demeaned[:, 1:]
+
+        if iteration == 1:
+            check_absorbed(regressors, xd, x)
+
+        weighted = xd * mu[:, None]
+        bread = np.linalg.inv(xd.T @ weighted)
+        beta = bread @ (weighted.T @ zd)
+
+        eta = z - (zd - xd @ beta)
+        mu = np.exp(eta)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(values > 0, values * np.log(values / mu), 0.0) - (values - mu)
+
+        previous, deviance = deviance, 2 * terms.sum()
+
+        if abs(deviance - previous) / max(deviance, 0.1) < tolerance:
+            converged = True
+            break
+
+    vcov, groups = cluster_vcov(xd, values - mu, bread, clusters, absorbed_df(codes, clusters))
+
+    return Estimate('ppml', coefficient_table(x, beta, vcov), len(values), int(dropped), groups, iteration, converged)
+
+
+def treated_partners(treated:list[str]|str) -> list[str]:
+    """Partners of a group registered in groups, or the list itself"""
+
+    if isinstance(treated, str):
+        if treated not in GROUPS:
+            raise ValueError(f'Group {treated} not registered. Try a list of partners or: {", ".join(GROUPS)}')
+        return list(GROUPS[treated])
+
+    return list(treated)
+
+
+def did(dataframe:pd.DataFrame, treated:list[str]|str='EFTA', start:int=START, method:str='ppml',
+        value:str=VALUE, fixed_effects:list=FIXED_EFFECTS, cluster:str=CLUSTER, controls:list[str]|None=None) -> Estimate:
+    """Difference-in-differences of trade with treated partners from start on, e.g. the 2011 EFTA agreement.
+
+    The coefficient of Treated x Post is the effect: the change in log
+    trade for PPML, in log positive trade for OLS. Rows of the same
+    fixed effect cells are summed first, controls are averaged. For OLS,
+    the cells without positive trade count as dropped.
+    """
+
+    if method not in ('ppml', 'ols'):
+        raise ValueError(f'Method {method} not valid. Try: ppml, ols')
+
+    if controls is None:
+        controls = []
+
+    columns = {col for effect in fixed_effects for col in ([effect] if isinstance(effect, str) else effect)}
+    keys = list(dict.fromkeys(sorted(columns | {cluster, 'Partner', 'Year'})))
+
+    aggregations = {value: 'sum', **{col: 'mean' for col in controls}}
+    df = dataframe.groupby(keys, observed=True).agg(aggregations).reset_index()
+    df['Treated x Post'] = (df['Partner'].isin(treated_partners(treated)) & (df['Year'] >= start)).astype('float64')
+
+    x = ['Treated x Post'] + controls
+
+    if method == 'ppml':
+        return ppml(df, value, x, fixed_effects, cluster)
+
+    positive = df[df[value] > 0].copy()
+    positive['LogValue'] = np.log(positive[value])
+
+    estimate = ols(positive, 'LogValue', x, fixed_effects, cluster)
+    estimate.dropped += len(df) - len(positive)
+
+    return estimate
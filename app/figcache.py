@@ -0,0 +1,175 @@
+"""This module skips drawing figures whose data and parameters did not change.
+
+A figure's key hashes the data slice it draws, its parameters, the source
+of the modules drawing it and of this module. Each saved image gets a
+<image>.figmeta.json file holding that key, and a copy named by the key,
+both under .figcache in the image's directory, so going back to an
+earlier version of the data restores the image instead of drawing it
+again. The output directory itself only holds the images.
+"""
+import os
+import json
+import shutil
+import hashlib
+import datetime
+from functools import lru_cache
+import pandas as pd
+import matplotlib
+
+FIGURE_CACHE = '.figcache'
+METADATA_SUFFIX = '.figmeta.json'
+# Unused cached figures kept per directory, so recent versions can be restored
+KEEP = 5
+
+
+@lru_cache(maxsize=None)
+def source_hash(path:str, mtime:float) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def data_hash(data:pd.DataFrame|pd.Series) -> str:
+    """Hash of the values, column names and dtypes, the index left out"""
+
+    hasher = hashlib.sha256()
+
+    if isinstance(data, pd.Series):
+        data = data.to_frame()
+
+    hasher.update(json.dumps([[str(name), str(dtype)] for name, dtype in data.dtypes.items()]).encode())
+    hasher.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+
+    return hasher.hexdigest()
+
+
+def figure_key(data:pd.DataFrame|pd.Series, spec:dict, source:str|list[str]|None=None) -> str:
+    """Key of a figure drawn from data with the parameters in spec by the code in source.
+
+    source is a path or a list of paths, e.g. the plotting script and the
+    modules preparing what it draws.
+    """
+
+    hasher = hashlib.sha256()
+    hasher.update(data_hash(data).encode())
+    hasher.update(json.dumps(spec, sort_keys=True, default=str).encode())
+
+    sources = [source] if isinstance(source, str) else list(source or [])
+
+    for path in sources + [__file__]:
+        hasher.update(source_hash(os.path.abspath(path), os.path.getmtime(path)).encode())
+
+    return hasher.hexdigest()[:32]
+
+
+def metadata_path(output:str) -> str:
+    directory = os.path.join(os.path.dirname(output) or '.', FIGURE_CACHE)
+    return os.path.join(directory, os.path.basename(output) + METADATA_SUFFIX)
+
+
+def entry_path(output:str, key:str) -> str:
+    directory = os.path.join(os.path.dirname(output) or '.', FIGURE_CACHE)
+    return os.path.join(directory, key + os.path.splitext(output)[1])
+
+
+def read_metadata(output:str) -> dict:
+
+    try:
+        with open(metadata_path(output)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_metadata(output:str, metadata:dict) -> None:
+
+    os.makedirs(os.path.dirname(metadata_path(output)), exist_ok=True)
+
+    with open(metadata_path(output), 'w') as f:
+        json.dump(metadata, f, indent=2, default=str)
+
+
+def fresh(output:str, key:str) -> bool:
+    """True when output holds the figure for key, restoring it from the cache if needed"""
+
+    if read_metadata(output).get('key') == key and os.path.exists(output):
+        return True
+
+    entry = entry_path(output, key)
+
+    if not os.path.exists(entry):
+        return False
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    shutil.copyfile(entry, output)
+    os.utime(entry)
+
+    try:
+        with open(os.path.splitext(entry)[0] + '.json') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        metadata = {'key': key}
+
+    metadata['restored'] = datetime.datetime.now().isoformat(timespec='seconds')
+    write_metadata(output, metadata)
+
+    return True
+
+
+def store(output:str, key:str, spec:dict, rows:int|None=None) -> None:
+    """Records the figure just saved to output under key"""
+
+    metadata = {
+        'key': key,
+        'spec': spec,
+        'rows': rows,
+        'rendered': datetime.datetime.now().isoformat(timespec='seconds'),
+        'matplotlib': matplotlib.__version__
+    }
+
+    entry = entry_path(output, key)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    shutil.copyfile(output, entry)
+
+    with open(os.path.splitext(entry)[0] + '.json', 'w') as f:
+        json.dump(metadata, f, indent=2, default=str)
+
+    write_metadata(output, metadata)
+
+
+def evict(directory:str, keep:int=KEEP) -> int:
+    """Removes cached figures of directory no image currently points to.
+
+    The keep most recently used of them are left in place. Returns the
+    number of figures removed.
+    """
+
+    cache = os.path.join(directory, FIGURE_CACHE)
+
+    if not os.path.isdir(cache):
+        return 0
+
+    current = set()
+
+    for name in os.listdir(cache):
+        if name.endswith(METADATA_SUFFIX):
+            try:
+                with open(os.path.join(cache, name)) as f:
+                    current.add(json.load(f).get('key'))
+            except (OSError, ValueError, AttributeError):
+                continue
+
+    entries = {}
+
+    for name in os.listdir(cache):
+        stem, extension = os.path.splitext(name)
+        if stem not in current and extension != '.json':
+            entries[stem] = os.path.join(cache, name)
+
+    stale = sorted(entries, key=lambda stem: os.path.getmtime(entries[stem]), reverse=True)[keep:]
+
+    for stem in stale:
+        os.remove(entries[stem])
+        if os.path.exists(os.path.join(cache, stem + '.json')):
+            os.remove(os.path.join(cache, stem + '.json'))
+
+    return len(stale)
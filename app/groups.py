@@ -0,0 +1,147 @@
+"""This module tags partners with the country groups they belong to"""
+import numpy as np
+import pandas as pd
+
+# Group -> partner -> (first year, last year) of membership, None when open.
+# Partner names are written as they appear in the trade data.
+GROUPS = {
+    'EFTA': {
+        'Switzerland': (1960, None),
+        'Norway': (1960, None),
+        'Iceland': (1970, None),
+        'Liechtenstein': (1991, None)
+    },
+    'EU': {
+        'Belgium': (1958, None), 'France': (1958, None), 'Germany': (1958, None),
+        'Italy': (1958, None), 'Luxembourg': (1958, None), 'Netherlands': (1958, None),
+        'Denmark': (1973, None), 'Ireland': (1973, None), 'United Kingdom': (1973, 2020),
+        'Greece': (1981, None), 'Portugal': (1986, None), 'Spain': (1986, None),
+        'Austria': (1995, None), 'Finland': (1995, None), 'Sweden': (1995, None),
+        'Cyprus': (2004, None), 'Czechia': (2004, None), 'Estonia': (2004, None),
+        'Hungary': (2004, None), 'Latvia': (2004, None), 'Lithuania': (2004, None),
+        'Malta': (2004, None), 'Poland': (2004, None), 'Slovakia': (2004, None),
+        'Slovenia': (2004, None), 'Bulgaria': (2007, None), 'Romania': (2007, None),
+        'Croatia': (2013, None)
+    },
+    'Pacific Alliance': {
+        'Chile': (2012, None),
+        'Colombia': (2012, None),
+        'Mexico': (2012, None),
+        'Peru': (2012, None)
+    },
+    'Mercosur': {
+        'Argentina': (1991, None),
+        'Brazil': (1991, None),
+        'Paraguay': (1991, None),
+        'Uruguay': (1991, None),
+        'Venezuela': (2012, 2016),
+        'Bolivia': (2024, None)
+    },
+    'World': {
+        'World': (None, None)
+    }
+}
+
+# EFTA members the first region tagging left out. Pass as exclude to region()
+# to reproduce EFTA totals of Switzerland, Norway and Iceland only.
+EFTA_LEFT_OUT = ['Liechtenstein']
+
+
+def register(name:str, members:dict[str, tuple]|list[str]) -> None:
+    """Adds or replaces a group. A list of partners means membership in every year"""
+
+    if not isinstance(members, dict):
+        members = {member: (None, None) for member in members}
+
+    GROUPS[name] = members
+
+
+def lookup(categories:pd.Index, groups:list[str], low:int, high:int) -> np.ndarray:
+    """groups x (categories + 1) x years boolean table, the extra row for missing partners"""
+
+    for name in groups:
+        if name not in GROUPS:
+            raise ValueError(f'Group {name} not registered. Try: {", ".join(GROUPS)}')
+
+    span = np.arange(low, high + 1)
+    table = np.zeros((len(groups), len(categories) + 1, len(span)), dtype=bool)
+
+    for g, name in enumerate(groups):
+
+        members = GROUPS[name]
+        positions = categories.get_indexer(list(members))
+
+        for position, (start, end) in zip(positions, members.values()):
+            if position >= 0:
+                table[g, position] = (span >= (start or span[0])) & (span <= (end or span[-1]))
+
+    return table
+
+
+def membership(partners:pd.Series, years:pd.Series|None=None, groups:list[str]|None=None) -> pd.DataFrame:
+    """One boolean column per group, True where the partner is a member that year.
+
+    Partners are mapped to category codes once and every row is tagged with
+    a single lookup into a groups x partners x years table. Without years,
+    membership in any year counts.
+    """
+
+    if not groups:
+        groups = list(GROUPS)
+
+    categorical = partners.astype('category')
+    codes = categorical.cat.codes.to_numpy().astype(np.intp)
+
+    if years is None or len(partners) == 0:
+        table = lookup(categorical.cat.categories, groups, 1900, 2100).any(axis=-1)
+        result = table[:, codes]
+    else:
+        year_values = years.to_numpy().astype(np.intp)
+        low, high = year_values.min(), year_values.max()
+        table = lookup(categorical.cat.categories, groups, low, high)
+        result = table[:, codes, year_values - low]
+
+    return pd.DataFrame(result.T, columns=groups, index=partners.index)
+
+
+def region(partners:pd.Series, years:pd.Series|None=None, groups:list[str]|None=None, default:str='Other',
+           exclude:list[str]=[]) -> np.ndarray:
+    """Label of the first group in groups each row belongs to, default otherwise.
+
+    Partners in exclude get default whatever their membership, e.g.
+    exclude=EFTA_LEFT_OUT.
+    """
+
+    if not groups:
+        groups = list(GROUPS)
+
+    tags = membership(partners, years, groups).to_numpy()
+
+    if exclude:
+        tags = tags & ~partners.isin(exclude).to_numpy()[:, None]
+
+    labels = np.array(list(groups) + [default], dtype=object)
+
+    first = np.where(tags.any(axis=1), tags.argmax(axis=1), tags.shape[1])
+
+    return labels[first]
+
+
+def group_sum(dataframe:pd.DataFrame, keys:list[str]=['Year'], value:str='RealValue',
+              groups:list[str]|None=None) -> pd.DataFrame:
+    """Sums of value by Group and keys, a row counting for every group it belongs to.
+
+    Rows are first summed by Partner, Year and keys, so only those totals
+    are repeated per membership.
+    """
+
+    by = list(dict.fromkeys(['Partner', 'Year'] + keys))
+    totals = dataframe.groupby(by, observed=True)[value].sum().reset_index()
+
+    tags = membership(totals['Partner'], totals['Year'], groups)
+    rows, columns = np.nonzero(tags.to_numpy())
+
+    exploded = totals.iloc[rows][keys + [value]].reset_index(drop=True)
+    exploded.insert(0, 'Group', tags.columns.to_numpy()[columns])
+
+    return exploded.groupby(['Group'] + keys, observed=True)[value].sum().reset_index()
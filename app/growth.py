@@ -0,0 +1,79 @@
+"""This module computes growth metrics for every group in one pass"""
+import numpy as np
+import pandas as pd
+
+VALUE = 'RealValue'
+
+
+def year_matrix(dataframe:pd.DataFrame, keys:list[str]=['Partner'], value:str=VALUE) -> pd.DataFrame:
+    """Wide matrix of value sums, one row per keys group and one column per year.
+
+    Works on raw rows or on an already aggregated frame. Years in between
+    without trade are filled with 0 so columns are consecutive.
+    """
+
+    wide = dataframe.groupby(keys + ['Year'], observed=True)[value].sum()\
+        .unstack('Year', fill_value=0)
+
+    years = range(int(wide.columns.min()), int(wide.columns.max()) + 1)
+
+    return wide.reindex(columns=years, fill_value=0)
+
+
+def ratio(numerator:np.ndarray, denominator:np.ndarray) -> np.ndarray:
+    """numerator / denominator with NaN where the ratio is undefined"""
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = numerator / denominator
+
+    result[~np.isfinite(result)] = np.nan
+
+    return result
+
+
+def growth(dataframe:pd.DataFrame, base:int=2012, end:int=2022, keys:list[str]=['Partner'], value:str=VALUE) -> pd.DataFrame:
+    """Growth between base and end for every keys group.
+
+    Returns base and end values, total PctChange, CAGR and LogGrowth, the
+    first two in percent. Groups with no trade in base get NaN.
+    """
+
+    wide = year_matrix(dataframe, keys, value)
+
+    if base not in wide.columns or end not in wide.columns:
+        raise ValueError(f'Years {base} and {end} must be in {list(wide.columns)}')
+
+    start = wide[base].to_numpy(dtype='float64')
+    stop = wide[end].to_numpy(dtype='float64')
+    change = ratio(stop, start)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cagr = np.power(change, 1 / (end - base)) - 1
+        log_growth = np.log(change)
+
+    result = pd.DataFrame({
+        base: start,
+        end: stop,
+        'PctChange': (change - 1) * 100,
+        'CAGR': cagr * 100,
+        'LogGrowth': log_growth
+    }, index=wide.index)
+
+    return result.reset_index()
+
+
+def yoy_growth(dataframe:pd.DataFrame, keys:list[str]=['Partner'], value:str=VALUE) -> pd.DataFrame:
+    """Year over year PctChange in percent for every keys group, in long format"""
+
+    wide = year_matrix(dataframe, keys, value)
+    values = wide.to_numpy(dtype='float64')
+
+    pct = np.full(values.shape, np.nan)
+    pct[:, 1:] = (ratio(values[:, 1:], values[:, :-1]) - 1) * 100
+
+    result = wide.index.repeat(len(wide.columns)).to_frame(index=False)
+    result['Year'] = np.tile(wide.columns.to_numpy(), len(wide))
+    result[value] = values.ravel()
+    result['PctChange'] = pct.ravel()
+
+    return result
@@ -0,0 +1,88 @@
+"""This module handles HS codes as integers"""
+import numpy as np
+import pandas as pd
+
+HS_DTYPE = 'int32'
+LEVELS = {2: 'Chapter', 4: 'Heading', 6: 'Subheading'}
+
+
+def encode(series:pd.Series) -> np.ndarray:
+    """HS codes as integers, leading zeros dropped ('090111' -> 90111).
+
+    Categorical and string columns are converted once per distinct code,
+    not once per row.
+    """
+
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return series.to_numpy().astype(HS_DTYPE, copy=False)
+
+    categorical = series.astype('category')
+    categories = categorical.cat.categories.astype('int64').to_numpy().astype(HS_DTYPE)
+
+    return categories[categorical.cat.codes.to_numpy()]
+
+
+def digits_of(codes:np.ndarray) -> int:
+    """Number of digits the codes were written with: 2, 4 or 6"""
+
+    top = codes.max() if len(codes) else 0
+
+    for digits in LEVELS:
+        if top < 10 ** digits:
+            return digits
+
+    raise ValueError(f'HS code {top} has more than 6 digits')
+
+
+def level(codes:np.ndarray, to:int, digits:int|None=None) -> np.ndarray:
+    """Truncates codes to chapter (2), heading (4) or subheading (6)"""
+
+    if to not in LEVELS:
+        raise ValueError(f'HS level {to} not valid. Try: 2, 4, 6')
+
+    if digits is None:
+        digits = digits_of(codes)
+
+    if to > digits:
+        raise ValueError(f'Cannot get HS{to} from HS{digits} codes')
+
+    return codes // 10 ** (digits - to)
+
+
+def heading(codes:np.ndarray, digits:int|None=None) -> np.ndarray:
+    return level(codes, 4, digits)
+
+
+def labels(codes:np.ndarray|pd.Series, to:int) -> np.ndarray:
+    """Zero padded strings for display, built once per distinct code"""
+
+    unique, inverse = np.unique(np.asarray(codes), return_inverse=True)
+    names = pd.Index(unique).astype('str').str.zfill(to).to_numpy()
+
+    return names[inverse]
+
+
+def rollups(dataframe:pd.DataFrame, keys:list[str]=['Year', 'Partner', 'Flow'], value:str='RealValue',
+            digits:int|None=None) -> dict[int, pd.DataFrame]:
+    """Sums of value by keys and HS code at every level up to the data's own.
+
+    Each level is grouped from the one below it, so raw rows are grouped once.
+    """
+
+    codes = encode(dataframe['HSCode'])
+
+    if digits is None:
+        digits = digits_of(codes)
+
+    keys = [key for key in keys if key in dataframe.columns]
+    df = dataframe[keys + [value]].assign(HSCode=codes)
+
+    tables = {digits: df.groupby(keys + ['HSCode'], observed=True)[value].sum().reset_index()}
+
+    for to in sorted((size for size in LEVELS if size < digits), reverse=True):
+        finer_digits = min(tables)
+        finer = tables[finer_digits]
+        coarse = finer.assign(HSCode=level(finer['HSCode'].to_numpy(), to, finer_digits))
+        tables[to] = coarse.groupby(keys + ['HSCode'], observed=True)[value].sum().reset_index()
+
+    return dict(sorted(tables.items()))
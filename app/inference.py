@@ -0,0 +1,468 @@
+"""This module attaches bootstrap and permutation uncertainty to growth metrics and estimators.
+
+Replicates run in chunks over a process pool. Chunk i always draws from
+the i-th child of SeedSequence(seed), so results depend on the seed only,
+not on the number of workers or the order chunks finish in. Every chunk
+is saved to RESULTS/<kind>-<key>/ as soon as it's done, the key hashing
+the data, the specification and the source of the code drawing the
+replicates, and a rerun only computes the chunks missing. Chunk files are
+named by their size too, so a chunk left shorter by fewer replicates is
+computed again when more are asked for.
+
+Growth metrics are never recomputed from rows: sums are laid out once as
+a blocks x groups x years array, a replicate is the number of times each
+block is drawn, and a whole chunk of resampled year matrices is one
+matrix product. Estimators get resampled frames built with one take() of
+precomputed block row indexes.
+
+    bootstrap_growth(df, keys=['Partner'], block='HSCode', replicates=10_000)
+    permutation_growth(df, treated='EFTA')
+    bootstrap(df, functools.partial(estimation.did, method='ols', cluster='Draw'), block='Partner')
+"""
+import os
+import json
+import inspect
+import hashlib
+import warnings
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from growth import ratio, year_matrix, VALUE
+from estimation import Estimate, treated_partners
+from instrument import instrumented
+
+RESULTS = '../data/inference/'
+REPLICATES = 10_000
+CHUNK = 500
+ESTIMATOR_CHUNK = 25
+ALPHA = 0.05
+METRICS = ['PctChange', 'CAGR', 'LogGrowth', 'AvgPctChange']
+
+# Data shared by the replicates of a run, set once per worker process
+PAYLOAD = {}
+
+
+def load(payload:dict) -> None:
+
+    PAYLOAD.clear()
+    PAYLOAD.update(payload)
+
+
+def frame_hash(dataframe:pd.DataFrame) -> str:
+    return hashlib.sha256(pd.util.hash_pandas_object(dataframe, index=False).to_numpy().tobytes()).hexdigest()
+
+
+def describe(func) -> str:
+    """Stable name of a function or functools.partial, used in result keys"""
+
+    if hasattr(func, 'func'):
+        keywords = sorted((key, repr(value)) for key, value in func.keywords.items())
+        return f'{describe(func.func)}{[repr(arg) for arg in func.args]}{keywords}'
+
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+@lru_cache(maxsize=None)
+def file_hash(path:str, mtime:float) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()[:16]
+
+
+def source_hash(func) -> str|None:
+    """Hash of the source of the module defining func or the function of a partial, None when it has none"""
+
+    while hasattr(func, 'func'):
+        func = func.func
+
+    try:
+        path = inspect.getsourcefile(func)
+    except TypeError:
+        return None
+
+    if not path or not os.path.isfile(path):
+        return None
+
+    return file_hash(path, os.path.getmtime(path))
+
+
+def as_array(result) -> np.ndarray:
+    """Estimate coefficients, a Series or a number as a flat float array"""
+
+    if isinstance(result, Estimate):
+        result = result.coefficients['Coefficient']
+
+    return np.atleast_1d(np.asarray(result, dtype='float64')).ravel()
+
+
+def chunk_sizes(replicates:int, chunk:int) -> list[int]:
+    return [min(chunk, replicates - start) for start in range(0, replicates, chunk)]
+
+
+def result_dir(spec:dict, data_key:str, directory:str|None=None) -> str:
+
+    key = hashlib.sha256(json.dumps([spec, data_key], sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    return os.path.join(directory or RESULTS, f'{spec["kind"]}-{key}')
+
+
+def chunk_path(path:str, index:int, size:int) -> str:
+    return os.path.join(path, f'chunk-{index:05d}-{size}.npy')
+
+
+def run(spec:dict, data_key:str, func, payload:dict, replicates:int, chunk:int, seed:int=0,
+        workers:int|None=None, directory:str|None=None) -> np.ndarray:
+    """Replicates of func(size, seed_sequence) stacked in chunk order, computing only chunks not on disk"""
+
+    spec = {**spec, 'seed': seed, 'chunk': chunk, 'code': source_hash(func)}
+    path = result_dir(spec, data_key, directory)
+    os.makedirs(path, exist_ok=True)
+
+    with open(os.path.join(path, 'spec.json'), 'w') as file:
+        json.dump({**spec, 'replicates': replicates}, file, indent=2, default=str)
+
+    sizes = chunk_sizes(replicates, chunk)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    pending = [index for index in range(len(sizes)) if not os.path.exists(chunk_path(path, index, sizes[index]))]
+
+    def save(index:int, values:np.ndarray) -> None:
+
+        dest = chunk_path(path, index, sizes[index])
+        tmp_path = dest + f'.{os.getpid()}.tmp.npy'
+        np.save(tmp_path, values)
+        os.replace(tmp_path, dest)
+
+        # The same chunk saved with another size by a run of other replicates
+        for name in os.listdir(path):
+            stale = name.startswith(f'chunk-{index:05d}-') and '.tmp' not in name
+            if stale and name != os.path.basename(dest):
+                os.remove(os.path.join(path, name))
+
+    if workers == 1 or len(pending) == 1:
+
+        load(payload)
+
+        for index in pending:
+            save(index, func(sizes[index], seeds[index]))
+
+    elif pending:
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=load, initargs=(payload,)) as pool:
+
+            futures = {pool.submit(func, sizes[index], seeds[index]): index for index in pending}
+
+            for future in as_completed(futures):
+                save(futures[future], future.result())
+
+    if pending:
+        print(f'\n{len(pending)} of {len(sizes)} chunks computed in {path}')
+
+    return np.concatenate([np.load(chunk_path(path, index, size)) for index, size in enumerate(sizes)])
+
+
+def summarize(replicates:np.ndarray, observed:np.ndarray, alpha:float=ALPHA) -> pd.DataFrame:
+    """Observed values with bootstrap standard errors and percentile intervals, NaN replicates left out"""
+
+    with warnings.catch_warnings():
+        # Columns without a finite replicate are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        std = np.nanstd(replicates, axis=0, ddof=1)
+        low, high = np.nanquantile(replicates, [alpha / 2, 1 - alpha / 2], axis=0)
+
+    return pd.DataFrame({
+        'Estimate': observed,
+        'StdError': std,
+        'Low': low,
+        'High': high,
+        'Replicates': np.isfinite(replicates).sum(axis=0)
+    })
+
+
+def p_values(replicates:np.ndarray, observed:np.ndarray) -> np.ndarray:
+    """Two-sided permutation p-values, (1 + replicates at least as extreme) / (1 + replicates)"""
+
+    valid = np.isfinite(replicates)
+    extreme = (np.abs(np.where(valid, replicates, 0)) >= np.abs(observed) - 1e-12) & valid
+
+    return (1 + extreme.sum(axis=0)) / (1 + valid.sum(axis=0))
+
+
+def growth_tensor(dataframe:pd.DataFrame, keys:list[str], block:str,
+                  value:str=VALUE) -> tuple[np.ndarray, pd.DataFrame, np.ndarray]:
+    """Sums as a blocks x groups x years array, with one row of keys values per group and the years"""
+
+    sums = dataframe.groupby([block] + keys + ['Year'], observed=True)[value].sum().reset_index()
+
+    blocks = pd.factorize(sums[block], sort=True)[0]
+
+    if keys:
+        group = sums.groupby(keys, observed=True, sort=True).ngroup().to_numpy()
+        groups = sums[keys].drop_duplicates().sort_values(keys).reset_index(drop=True)
+    else:
+        group = np.zeros(len(sums), dtype=np.intp)
+        groups = pd.DataFrame(index=[0])
+
+    low, high = int(sums['Year'].min()), int(sums['Year'].max())
+    year = sums['Year'].to_numpy().astype(np.intp) - low
+
+    tensor = np.zeros((blocks.max() + 1, len(groups), high - low + 1))
+    tensor[blocks, group, year] = sums[value].to_numpy()
+
+    return tensor, groups, np.arange(low, high + 1)
+
+
+def growth_metrics(wide:np.ndarray, years:np.ndarray, base:int, end:int) -> np.ndarray:
+    """METRICS of (..., groups, years) year matrices, stacked on a new last axis.
+
+    PctChange, CAGR and LogGrowth follow growth.growth and AvgPctChange
+    initializer.avg_growth, on every leading index at once.
+    """
+
+    if base not in years or end not in years:
+        raise ValueError(f'Years {base} and {end} must be in {list(years)}')
+
+    first, last = base - years[0], end - years[0]
+    change = ratio(wide[..., last], wide[..., first])
+
+    window = wide[..., first:last + 1]
+    yearly = (ratio(window[..., 1:], window[..., :-1]) - 1) * 100
+    valid = np.isfinite(yearly)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cagr = (np.power(change, 1 / (end - base)) - 1) * 100
+        log_growth = np.log(change)
+        avg = np.where(valid, yearly, 0).sum(axis=-1) / valid.sum(axis=-1)
+
+    return np.stack([(change - 1) * 100, cagr, log_growth, avg], axis=-1)
+
+
+def growth_chunk(size:int, seed:np.random.SeedSequence) -> np.ndarray:
+    """Metrics of size block bootstrap replicates, (size, groups, metrics)"""
+
+    tensor, years, base, end = PAYLOAD['tensor'], PAYLOAD['years'], PAYLOAD['base'], PAYLOAD['end']
+    blocks, groups = tensor.shape[0], tensor.shape[1]
+
+    counts = np.random.default_rng(seed).multinomial(blocks, np.full(blocks, 1 / blocks), size=size)
+    wide = (counts @ tensor.reshape(blocks, -1)).reshape(size, groups, len(years))
+
+    return growth_metrics(wide, years, base, end)
+
+
+def long_table(groups:pd.DataFrame, keys:list[str], table:pd.DataFrame) -> pd.DataFrame:
+    """One row per group and metric from a table of groups x metrics rows in that order"""
+
+    result = groups.loc[groups.index.repeat(len(METRICS))].reset_index(drop=True) if keys else pd.DataFrame(index=table.index)
+    result['Metric'] = np.tile(METRICS, len(groups))
+
+    return pd.concat([result, table], axis=1)
+
+
+@instrumented
+def bootstrap_growth(dataframe:pd.DataFrame, keys:list[str]=['Partner'], block:str='HSCode', base:int=2012,
+                     end:int=2022, replicates:int=REPLICATES, seed:int=0, workers:int|None=None,
+                     value:str=VALUE, alpha:float=ALPHA, directory:str|None=None) -> pd.DataFrame:
+    """Block bootstrap of the growth metrics of every keys group, resampling whole blocks.
+
+    block is the unit drawn with replacement, e.g. HSCode for the growth of
+    each partner or Partner for the growth of a group. Returns keys,
+    Metric, Estimate, StdError, the percentile interval and the number of
+    finite replicates.
+    """
+
+    tensor, groups, years = growth_tensor(dataframe, keys, block, value)
+    observed = growth_metrics(tensor.sum(axis=0), years, base, end)
+
+    spec = {'kind': 'growth', 'keys': keys, 'block': block, 'base': base, 'end': end, 'value': value}
+    payload = {'tensor': tensor, 'years': years, 'base': base, 'end': end}
+    data_key = hashlib.sha256(tensor.tobytes() + years.tobytes()).hexdigest()
+
+    draws = run(spec, data_key, growth_chunk, payload, replicates, CHUNK, seed, workers, directory)
+    table = summarize(draws.reshape(len(draws), -1), observed.ravel(), alpha)
+
+    return long_table(groups, keys, table)
+
+
+def permutation_chunk(size:int, seed:np.random.SeedSequence) -> np.ndarray:
+    """Treated minus control mean of every metric under size random assignments, (size, metrics)"""
+
+    metrics, treated = PAYLOAD['metrics'], PAYLOAD['treated']
+    units = len(metrics)
+
+    order = np.random.default_rng(seed).random((size, units)).argsort(axis=1)
+    assigned = np.zeros((size, units), dtype=bool)
+    np.put_along_axis(assigned, order[:, :treated], True, axis=1)
+
+    return group_difference(metrics, assigned)
+
+
+def group_difference(metrics:np.ndarray, assigned:np.ndarray) -> np.ndarray:
+    """Mean of metrics over assigned units minus over the rest, NaN metrics left out, for every row of assigned"""
+
+    valid = np.isfinite(metrics)
+    values = np.where(valid, metrics, 0)
+
+    def mean(mask:np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (mask.astype('float64') @ values) / (mask.astype('float64') @ valid)
+
+    return mean(assigned) - mean(~assigned)
+
+
+@instrumented
+def permutation_growth(dataframe:pd.DataFrame, treated:list[str]|str='EFTA', column:str='Partner', base:int=2012,
+                       end:int=2022, replicates:int=REPLICATES, seed:int=0, workers:int|None=None,
+                       value:str=VALUE, directory:str|None=None) -> pd.DataFrame:
+    """Randomization test of the treated minus control difference in mean growth.
+
+    Growth is computed once per unit of column, and each replicate assigns
+    the treated label to as many random units. Returns Metric, the observed
+    Difference, its PValue and the number of finite replicates.
+    """
+
+    treated = treated_partners(treated)
+
+    wide = year_matrix(dataframe, [column], value)
+    metrics = growth_metrics(wide.to_numpy(dtype='float64'), wide.columns.to_numpy(), base, end)
+
+    assigned = wide.index.isin(treated)
+
+    if not assigned.any() or assigned.all():
+        raise ValueError(f'{column} needs treated and control units, found {assigned.sum()} of {len(assigned)} treated')
+
+    observed = group_difference(metrics, assigned[None, :])[0]
+
+    spec = {'kind': 'permutation-growth', 'column': column, 'treated': sorted(treated), 'base': base, 'end': end,
+            'value': value}
+    payload = {'metrics': metrics, 'treated': int(assigned.sum())}
+    data_key = hashlib.sha256(metrics.tobytes()).hexdigest()
+
+    draws = run(spec, data_key, permutation_chunk, payload, replicates, CHUNK, seed, workers, directory)
+
+    return pd.DataFrame({
+        'Metric': METRICS,
+        'Difference': observed,
+        'PValue': p_values(draws, observed),
+        'Replicates': np.isfinite(draws).sum(axis=0)
+    })
+
+
+def block_rows(codes:np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Rows sorted by block, with the start and length of every block in that order"""
+
+    order = np.argsort(codes, kind='stable')
+    lengths = np.bincount(codes)
+    starts = np.cumsum(lengths) - lengths
+
+    return order, starts, lengths
+
+
+def resample_rows(rng:np.random.Generator, order:np.ndarray, starts:np.ndarray,
+                  lengths:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Rows of as many blocks as there are, drawn with replacement, and the draw each row belongs to"""
+
+    drawn = rng.integers(0, len(lengths), len(lengths))
+    sizes = lengths[drawn]
+
+    offsets = np.repeat(starts[drawn] - (np.cumsum(sizes) - sizes), sizes) + np.arange(sizes.sum())
+
+    return order[offsets], np.repeat(np.arange(len(drawn)), sizes)
+
+
+def estimate(estimator, *args, width:int) -> np.ndarray:
+    """as_array of estimator(*args), NaN when a replicate can't be estimated"""
+
+    try:
+        values = as_array(estimator(*args))
+    except (ValueError, np.linalg.LinAlgError):
+        return np.full(width, np.nan)
+
+    return values if len(values) == width else np.full(width, np.nan)
+
+
+def bootstrap_chunk(size:int, seed:np.random.SeedSequence) -> np.ndarray:
+
+    df, estimator, width = PAYLOAD['dataframe'], PAYLOAD['estimator'], PAYLOAD['width']
+    rng = np.random.default_rng(seed)
+    result = np.empty((size, width))
+
+    for i in range(size):
+        rows, draw = resample_rows(rng, PAYLOAD['order'], PAYLOAD['starts'], PAYLOAD['lengths'])
+        sample = df.take(rows).reset_index(drop=True)
+        sample['Draw'] = draw
+        result[i] = estimate(estimator, sample, width=width)
+
+    return result
+
+
+@instrumented
+def bootstrap(dataframe:pd.DataFrame, estimator, block:str='Partner', replicates:int=REPLICATES, seed:int=0,
+              workers:int|None=None, alpha:float=ALPHA, directory:str|None=None) -> pd.DataFrame:
+    """Block bootstrap of any estimator(dataframe) returning an Estimate, a Series or numbers.
+
+    Frames carry a Draw column numbering the drawn blocks, so a block
+    drawn twice can count as two clusters (cluster='Draw').
+    estimator must be picklable, e.g. a module function or a partial.
+    """
+
+    codes = pd.factorize(dataframe[block], sort=True)[0]
+    observed = as_array(estimator(dataframe.assign(Draw=codes)))
+    order, starts, lengths = block_rows(codes)
+
+    spec = {'kind': 'bootstrap', 'estimator': describe(estimator), 'source': source_hash(estimator), 'block': block}
+    payload = {'dataframe': dataframe, 'estimator': estimator, 'width': len(observed),
+               'order': order, 'starts': starts, 'lengths': lengths}
+
+    draws = run(spec, frame_hash(dataframe), bootstrap_chunk, payload, replicates, ESTIMATOR_CHUNK, seed, workers, directory)
+
+    return summarize(draws, observed, alpha)
+
+
+def permutation_estimator_chunk(size:int, seed:np.random.SeedSequence) -> np.ndarray:
+
+    df, estimator, width = PAYLOAD['dataframe'], PAYLOAD['estimator'], PAYLOAD['width']
+    units, treated = PAYLOAD['units'], PAYLOAD['treated']
+    rng = np.random.default_rng(seed)
+    result = np.empty((size, width))
+
+    for i in range(size):
+        result[i] = estimate(estimator, df, list(units[rng.permutation(len(units))[:treated]]), width=width)
+
+    return result
+
+
+@instrumented
+def permutation(dataframe:pd.DataFrame, estimator, treated:list[str]|str='EFTA', column:str='Partner',
+                replicates:int=REPLICATES, seed:int=0, workers:int|None=None, directory:str|None=None) -> pd.DataFrame:
+    """Randomization test of estimator(dataframe, treated), e.g. estimation.did.
+
+    Each replicate hands the estimator as many units of column as there are
+    treated, drawn at random. Returns the observed values with their
+    two-sided PValue.
+    """
+
+    treated = treated_partners(treated)
+    units = np.asarray(pd.unique(dataframe[column].astype('str')), dtype=object)
+    assigned = np.isin(units, treated)
+
+    if not assigned.any() or assigned.all():
+        raise ValueError(f'{column} needs treated and control units, found {assigned.sum()} of {len(assigned)} treated')
+
+    count = int(assigned.sum())
+
+    observed = as_array(estimator(dataframe, treated))
+
+    spec = {'kind': 'permutation', 'estimator': describe(estimator), 'source': source_hash(estimator),
+            'column': column, 'treated': sorted(treated)}
+    payload = {'dataframe': dataframe, 'estimator': estimator, 'width': len(observed),
+               'units': np.sort(units), 'treated': count}
+
+    draws = run(spec, frame_hash(dataframe), permutation_estimator_chunk, payload, replicates, ESTIMATOR_CHUNK, seed,
+                workers, directory)
+
+    return pd.DataFrame({
+        'Estimate': observed,
+        'PValue': p_values(draws, observed),
+        'Replicates': np.isfinite(draws).sum(axis=0)
+    })
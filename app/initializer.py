@@ -1,8 +1,32 @@
 """This module is for needed common operations"""
+import os
+import json
+import shutil
+import hashlib
+from typing import Iterator
 import pandas as pd
 import numpy as np
+import pyarrow.feather as feather
+
+try:
+    from cube import Cube, DIMS as CUBE_DIMS
+    from growth import growth, yoy_growth
+    from hscodes import HS_DTYPE
+    from instrument import instrumented
+    import dictionaries
+except ModuleNotFoundError:
+    from app.cube import Cube, DIMS as CUBE_DIMS
+    from app.growth import growth, yoy_growth
+    from app.hscodes import HS_DTYPE
+    from app.instrument import instrumented
+    from app import dictionaries
 
 DEFAULT = '../data/processed-data/main_df.csv'
+CACHE_DIR = '.cache'
+CACHE_INDEX = 'index.json'
+CHUNK_SIZE = 1_000_000
+# Memory mapping is only zero-copy on uncompressed feather files
+CACHE_COMPRESSION = 'uncompressed'
 
 COLS = {
     'refPeriodId': 'Year',
@@ -16,22 +40,233 @@ DTYPES = {
     'Year': 'int16',
     'Partner': 'category',
     'Flow': 'category',
-    'HSCode': 'category',
+    'HSCode': HS_DTYPE,
     'FobValue': 'float64'
 }
 
 
-def initialize(path=None) -> pd.DataFrame:
+def file_hash(path:str, chunk_size:int=1 << 20) -> str:
+
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def get_cache_dir(path:str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+
+
+def path_key(path:str) -> str:
+    return hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:12]
+
+
+def content_hash(path:str) -> str:
+    """Content hash of path, recomputed only when its size or mtime moved"""
+
+    index_path = os.path.join(get_cache_dir(path), CACHE_INDEX)
+    key = os.path.abspath(path)
+    stat = os.stat(path)
+
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as file:
+            index = json.load(file)
+
+    entry = index.get(key)
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        return entry['hash']
+
+    entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': file_hash(path)}
+    index[key] = entry
+
+    os.makedirs(get_cache_dir(path), exist_ok=True)
+    tmp_path = index_path + f'.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(index, file, indent=2)
+    os.replace(tmp_path, index_path)
+
+    return entry['hash']
+
+
+def read_dtypes(dtypes:dict, cols:dict) -> dict:
+    """Translates dtypes given on formatted names to the names in the csv"""
+
+    result = {}
+    for source, target in cols.items():
+        if target in dtypes:
+            result[source] = dtypes[target]
+
+    for col, dtype in dtypes.items():
+        if col not in cols.values():
+            result[col] = dtype
+
+    return result
+
+
+@instrumented
+def initialize(path=None, dtypes:dict|None=None, cols:dict|None=None, cache:bool=True,
+               compact:bool=False) -> pd.DataFrame:
+    """Loads a processed csv.
+
+    dtypes and cols are applied while parsing, so the result doesn't need a
+    format_dataframe() pass. The parsed frame is kept in a feather cache next
+    to the source, keyed by its path, its content hash and the read options.
+    Cache hits are memory mapped instead of parsed. See clear_cache().
+
+    Categorical columns are encoded against the shared dictionaries, so
+    frames from different files concatenate as categories. compact reads
+    with DTYPES and dtypes, then narrows the values to float32.
+    """
 
     if not path:
         path = DEFAULT
     else: path = path
 
-    df = pd.read_csv(path, encoding='latin1')
+    if compact:
+        dtypes = dictionaries.compact_dtypes({**DTYPES, **(dtypes or {})})
+
+    if not cache:
+        return read_csv(path, dtypes, cols)
+
+    options = json.dumps([dtypes, cols, CACHE_COMPRESSION], sort_keys=True)
+    content_key = content_hash(path)[:16]
+    options_key = hashlib.sha256(options.encode()).hexdigest()[:8]
+
+    cache_dir = get_cache_dir(path)
+    prefix = f'{path_key(path)}-'
+    cache_path = os.path.join(cache_dir, f'{prefix}{content_key}-{options_key}.feather')
+
+    if os.path.exists(cache_path):
+        return dictionaries.encode_table(feather.read_table(cache_path, memory_map=True)).to_pandas(split_blocks=True)
+
+    df = read_csv(path, dtypes, cols)
+    evict(path, content_key)
+
+    tmp_path = cache_path + f'.{os.getpid()}.tmp'
+    feather.write_feather(df, tmp_path, compression=CACHE_COMPRESSION)
+    os.replace(tmp_path, cache_path)
 
     return df
 
 
+@instrumented
+def read_csv(path:str, dtypes:dict|None, cols:dict|None) -> pd.DataFrame:
+
+    if dtypes:
+        df = pd.read_csv(path, encoding='latin1', dtype=read_dtypes(dtypes, cols or {}))
+    else:
+        df = pd.read_csv(path, encoding='latin1')
+
+    if cols:
+        df = df.rename(columns=cols)
+
+    return dictionaries.encode(df)
+
+
+def evict(path:str, content_key:str) -> None:
+    """Removes cached copies of path built from an older content"""
+
+    cache_dir = get_cache_dir(path)
+    prefix = f'{path_key(path)}-'
+
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and not name.startswith(prefix + content_key):
+            remove_entry(os.path.join(cache_dir, name))
+
+
+def remove_entry(path:str) -> None:
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+@instrumented
+def get_cube(path=None, value:str='RealValue', dtypes:dict|None=None, cols:dict|None=None,
+             chunksize:int|None=None) -> Cube:
+    """Aggregate cube of a processed csv.
+
+    The cube is persisted in the same cache directory as initialize() and
+    is rebuilt only when the source content or the read options change. With chunksize the
+    source is summed chunk by chunk instead of loaded whole.
+    """
+
+    if not path:
+        path = DEFAULT
+
+    options = json.dumps([value, dtypes, cols], sort_keys=True)
+    content_key = content_hash(path)[:16]
+    options_key = hashlib.sha256(options.encode()).hexdigest()[:8]
+    cube_path = os.path.join(get_cache_dir(path), f'{path_key(path)}-{content_key}-{options_key}.cube')
+
+    if os.path.exists(cube_path):
+        return Cube.load(cube_path, value)
+
+    if chunksize:
+        header = pd.read_csv(path, encoding='latin1', nrows=0).rename(columns=cols or {})
+        dims = [dim for dim in CUBE_DIMS if dim in header.columns]
+        df = chunked_group_sum(path, dims, value, chunksize=chunksize, dtypes=dtypes, cols=cols)
+        evict(path, content_key)
+    else:
+        df = initialize(path, dtypes=dtypes, cols=cols)
+
+    cube = Cube.build(df, value)
+
+    tmp_path = cube_path + f'.{os.getpid()}.tmp'
+    cube.save(tmp_path)
+
+    try:
+        os.replace(tmp_path, cube_path)
+    except OSError:
+        # Another process stored the same cube first, a directory can't be replaced
+        if not os.path.exists(cube_path):
+            raise
+        remove_entry(tmp_path)
+
+    return cube
+
+
+def clear_cache(path=None) -> int:
+    """Drops every cached copy of path. Returns the number of removed files"""
+
+    if not path:
+        path = DEFAULT
+
+    cache_dir = get_cache_dir(path)
+
+    if not os.path.exists(cache_dir):
+        return 0
+
+    prefix = f'{path_key(path)}-'
+    removed = 0
+
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix):
+            remove_entry(os.path.join(cache_dir, name))
+            removed += 1
+
+    return removed
+
+
+def cast_dataframe(df:pd.DataFrame, dtypes:dict) -> pd.DataFrame:
+    """astype only on the columns whose dtype differs, e.g. after a cached initialize()"""
+
+    pending = {
+        col: dtype for col, dtype in dtypes.items()
+        if col not in df.columns or str(df[col].dtype) != str(dtype)
+    }
+
+    if not pending:
+        return dictionaries.encode(df)
+
+    return dictionaries.encode(df.astype(pending))
+
+
 def format_dataframe(dataframe:pd.DataFrame, format='all', dtypes:dict={}, cols:dict={}) -> pd.DataFrame:
 
     df = dataframe
@@ -53,7 +288,7 @@ def format_dataframe(dataframe:pd.DataFrame, format='all', dtypes:dict={}, cols:
         case 'all':
 
             df = df.rename(columns=cols)
-            df = df.astype(dtypes)
+            df = cast_dataframe(df, dtypes)
             return df
 
         case 'cols':
@@ -63,7 +298,7 @@ def format_dataframe(dataframe:pd.DataFrame, format='all', dtypes:dict={}, cols:
 
         case 'dtypes':
 
-            df = df.astype(dtypes)
+            df = cast_dataframe(df, dtypes)
             return df
         
         case _:
@@ -71,61 +306,244 @@ def format_dataframe(dataframe:pd.DataFrame, format='all', dtypes:dict={}, cols:
             raise ValueError(f'Argument {format} not valid. Try: dtypes, cols, all')
 
 
-def filter_dataframe(dataframe:pd.DataFrame=pd.DataFrame()\
+PERIODS = {
+    '2011': (-np.inf, 2011),
+    '2022': (2012, np.inf),
+    'all': (-np.inf, np.inf)
+}
+
+
+REPORT_PERIODS = {
+    '2001-2011': (2001, 2011),
+    '2012-2022': (2012, 2022)
+}
+
+
+def tag_periods(years:pd.Series, periods:dict[str, tuple]|None=None) -> pd.Categorical:
+    """Label of the (first, last) year range each year falls in, NaN outside all"""
+
+    if not periods:
+        periods = REPORT_PERIODS
+
+    values = years.to_numpy()
+    codes = np.full(len(values), -1, dtype=np.int8)
+
+    for code, (low, high) in enumerate(periods.values()):
+        codes[(codes == -1) & (values >= low) & (values <= high)] = code
+
+    return pd.Categorical.from_codes(codes, categories=list(periods))
+
+
+def period_bounds(period:str) -> tuple[float, float]:
+
+    if period not in PERIODS:
+        raise ValueError('incorrect input on period arg')
+
+    return PERIODS[period]
+
+
+def category_codes(series:pd.Series, values:list) -> np.ndarray:
+    """Integer codes of values in a categorical series, unknown values dropped"""
+
+    categories = series.cat.categories
+    codes = categories.get_indexer(pd.Index(values).astype(categories.dtype))
+
+    return codes[codes >= 0]
+
+
+def isin_mask(series:pd.Series, values:list) -> np.ndarray:
+    """Boolean mask of series in values, on category codes when possible"""
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return np.isin(series.cat.codes.to_numpy(), category_codes(series, values))
+
+    return series.isin(values).to_numpy()
+
+
+class TradeIndex:
+    """A frame sorted once by (Partner, Year, HSCode) category codes.
+
+    Each partner owns a contiguous block of rows sorted by year, so a
+    partner/period lookup is a slice found with searchsorted and an HS code
+    lookup is a mask on integer codes.
+    """
+
+    def __init__(self, dataframe:pd.DataFrame):
+
+        df = dataframe.astype({
+            col: 'category' for col in ['Partner', 'HSCode']
+            if col in dataframe.columns
+            and not isinstance(dataframe[col].dtype, pd.CategoricalDtype)
+        })
+
+        partners = df['Partner'].cat.codes.to_numpy()
+        years = df['Year'].to_numpy()
+
+        if 'HSCode' in df.columns:
+            hscodes = df['HSCode'].cat.codes.to_numpy()
+        else:
+            hscodes = np.zeros(len(df), dtype=np.int8)
+
+        order = np.lexsort((hscodes, years, partners))
+
+        self.df = df.take(order).reset_index(drop=True)
+        self.years = years[order]
+        self.hscodes = hscodes[order]
+        self.bounds = np.searchsorted(
+            partners[order],
+            np.arange(len(df['Partner'].cat.categories) + 1)
+        )
+
+    def rows(self, period:str='all', partners:list[str]=[], hscodes:list=[]) -> np.ndarray:
+
+        low, high = period_bounds(period)
+
+        if partners:
+            codes = category_codes(self.df['Partner'], partners)
+        else:
+            codes = np.arange(len(self.bounds) - 1)
+
+        blocks = []
+
+        for code in codes:
+            start, stop = self.bounds[code], self.bounds[code + 1]
+            years = self.years[start:stop]
+            first = start + np.searchsorted(years, low, side='left')
+            last = start + np.searchsorted(years, high, side='right')
+            blocks.append(np.arange(first, last))
+
+        rows = np.concatenate(blocks) if blocks else np.array([], dtype=np.intp)
+
+        if hscodes:
+            rows = rows[np.isin(self.hscodes[rows], category_codes(self.df['HSCode'], hscodes))]
+
+        return rows
+
+    def select(self, period:str='all', partners:list[str]=[], hscodes:list=[]) -> pd.DataFrame:
+        return self.df.iloc[self.rows(period, partners, hscodes)]
+
+
+def filter_dataframe(dataframe:pd.DataFrame|TradeIndex=pd.DataFrame()\
                      , period:str='all'\
                      , partners:list[str]=[]\
+                     , hscodes:list=[]\
                      ) -> pd.DataFrame:
+
+    if isinstance(dataframe, TradeIndex):
+        return dataframe.select(period, partners, hscodes)
+
     df = dataframe
 
-    match period:
-        case '2011':
-            df = df.query('Year <= 2011')
-        case '2022':
-            df = df.query('Year >= 2012')
-        case 'all':
-            ...
-        case _:
-            raise ValueError('incorrect input on period arg')
+    if not partners:
+        print('partner arg was not passed. Filterng for all partners...')
+
+    return df[filter_mask(df, period, partners, hscodes)]
+
+
+def filter_mask(df:pd.DataFrame, period:str='all', partners:list[str]=[], hscodes:list=[]) -> np.ndarray:
+
+    low, high = period_bounds(period)
+
+    mask = np.ones(len(df), dtype=bool)
+
+    if period != 'all':
+        years = df['Year'].to_numpy()
+        mask &= (years >= low) & (years <= high)
 
     if partners:
-        df = df.query(f'Partner in {partners}')
-    else:
-        print('partner arg was not passed. Filterng for all partners...')
+        mask &= isin_mask(df['Partner'], partners)
+
+    if hscodes:
+        mask &= isin_mask(df['HSCode'], hscodes)
+
+    return mask
+
+
+def iter_chunks(path=None, chunksize:int=CHUNK_SIZE, dtypes:dict|None=None, cols:dict|None=None,
+                usecols:list[str]|None=None) -> Iterator[pd.DataFrame]:
+    """Reads and formats a csv chunksize rows at a time.
+
+    Categorical columns are encoded against the shared dictionaries, so
+    every chunk has the same categories and partial results combine.
+    """
+
+    if not path:
+        path = DEFAULT
+
+    read = read_dtypes(dtypes, cols or {}) if dtypes else None
+
+    reader = pd.read_csv(path, encoding='latin1', dtype=read, usecols=usecols, chunksize=chunksize)
+
+    for chunk in reader:
+        if cols:
+            chunk = chunk.rename(columns=cols)
+        yield dictionaries.encode(chunk)
+
+
+def filter_chunks(path=None, period:str='all', partners:list[str]=[], hscodes:list=[],
+                  chunksize:int=CHUNK_SIZE, dtypes:dict|None=None, cols:dict|None=None) -> Iterator[pd.DataFrame]:
+    """Rows of every chunk matching the filters, see filter_dataframe"""
+
+    for chunk in iter_chunks(path, chunksize, dtypes, cols):
+        yield chunk[filter_mask(chunk, period, partners, hscodes)]
+
+
+@instrumented
+def chunked_group_sum(path=None, keys:list[str]=['Year', 'Partner'], value:str='RealValue',
+                      period:str='all', partners:list[str]=[], hscodes:list=[],
+                      chunksize:int=CHUNK_SIZE, dtypes:dict|None=None, cols:dict|None=None) -> pd.DataFrame:
+    """Sums of value by keys over a csv that doesn't fit in memory.
+
+    Each chunk is filtered and summed, and partial sums are combined as
+    they come, so memory grows with the number of groups, not of rows.
+    """
+
+    partial = None
+
+    for chunk in filter_chunks(path, period, partners, hscodes, chunksize, dtypes, cols):
+
+        sums = chunk.groupby(keys, observed=True)[value].sum()
+        partial = sums if partial is None else partial.add(sums, fill_value=0)
+
+    if partial is None:
+        return pd.DataFrame(columns=keys + [value])
+
+    df = partial.reset_index()
+
+    if dtypes:
+        df = cast_dataframe(df, {col: dtype for col, dtype in dtypes.items() if col in df.columns})
 
     return df
 
-def total_growth():
+def growth_source(dataframe:pd.DataFrame|None, keys:list[str], base:int, end:int) -> pd.DataFrame:
+    """The loaded frame, or the cube roll-up over keys when none is given"""
 
-    df = filter_dataframe(period='2022')
-    groups = df.groupby(['Year', 'Partner'], observed=False)['RealValue']\
-        .sum()
+    if dataframe is None:
+        return get_cube().aggregate(keys + ['Year'], years=(base, end))
 
-    tw = groups.reset_index()
-    tw = tw.query('Year == 2012 or Year == 2022')
+    return dataframe
 
-    ptc = tw.groupby(['Year', 'Partner'], observed=False)['RealValue'].sum().pct_change(periods=17).fillna(0)
-    ptc *= 100
 
-    tw['PctChange'] = ptc.values
+def total_growth(dataframe:pd.DataFrame|None=None, base:int=2012, end:int=2022, keys:list[str]=['Partner']) -> pd.DataFrame:
+    """Growth between base and end for every keys group.
 
-    return tw
+    See growth.growth for the returned metrics.
+    """
 
+    df = growth_source(dataframe, keys, base, end)
 
-def avg_growth():
+    return growth(df, base=base, end=end, keys=keys)
 
-    df = filter_dataframe(period='2022')
-    groups = df.groupby(['Year', 'Partner'], observed=False)['RealValue']\
-        .sum()
 
-    pct_changes = groups.pct_change(periods=17).fillna(0)
-    pct_changes = pct_changes.reset_index()
+def avg_growth(dataframe:pd.DataFrame|None=None, base:int=2012, end:int=2022, keys:list[str]=['Partner']) -> pd.Series:
+    """Mean year over year PctChange between base and end for every keys group"""
 
-    groups = groups.reset_index()
-    groups['PctChange'] = pct_changes['RealValue']
+    df = growth_source(dataframe, keys, base, end)
+    df = df[df['Year'].between(base, end)]
 
-    avg_growth = groups.groupby('Partner', observed=False)['PctChange'].mean()
-    avg_growth *= 100
+    groups = yoy_growth(df, keys=keys)
 
+    avg_growth = groups.groupby(keys, observed=True)['PctChange'].mean()
 
     return avg_growth
 
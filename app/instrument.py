@@ -0,0 +1,273 @@
+"""This module records how long each pipeline stage took and how much memory it used.
+
+Stages are functions wrapped by @instrumented or blocks run inside
+`with stage(name) as record`. Each run yields one record with wall and cpu
+seconds, the peak RSS of the process and how much the stage raised it,
+optional tracemalloc peaks, input and output row counts and the enclosing
+stage, appended as a JSON line to the metrics file. Nothing is recorded
+until a metrics file is configured, either with configure() or with the
+METRICS_PATH environment variable, so instrumented code runs as before.
+
+    METRICS_PATH=metrics.jsonl METRICS_PROFILE_DIR=profiles python pre_main.py colombia
+    python instrument.py metrics.jsonl [--json]
+"""
+import os
+import sys
+import json
+import time
+import cProfile
+import datetime
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+CONFIG = {
+    'path': os.environ.get('METRICS_PATH') or None,
+    'profile_dir': os.environ.get('METRICS_PROFILE_DIR') or None,
+    'tracemalloc': bool(os.environ.get('METRICS_TRACEMALLOC'))
+}
+
+LOCAL = threading.local()
+
+
+def configure(path:str|None=None, profile_dir:str|None=None, tracemalloc:bool=False) -> None:
+    """Sets the metrics file, the cProfile dump directory and tracemalloc tracking.
+
+    The environment variables are updated too, so worker processes started
+    afterwards record into the same file.
+    """
+
+    CONFIG.update(path=path, profile_dir=profile_dir, tracemalloc=tracemalloc)
+
+    for key, value in (('METRICS_PATH', path), ('METRICS_PROFILE_DIR', profile_dir),
+                       ('METRICS_TRACEMALLOC', '1' if tracemalloc else None)):
+        if value:
+            os.environ[key] = value
+        else:
+            os.environ.pop(key, None)
+
+
+def enabled() -> bool:
+    return bool(CONFIG['path'])
+
+
+def peak_rss() -> float|None:
+    """Peak resident memory of this process in MB, None where unavailable"""
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def current_rss() -> float|None:
+    """Resident memory of this process in MB, None where unavailable"""
+
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def count_rows(value) -> int|None:
+    """Rows of a DataFrame, Series, pyarrow Table or dataset, None for anything else"""
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+
+    if hasattr(value, 'num_rows'):
+        return value.num_rows
+
+    return None
+
+
+def stack() -> list[dict]:
+    """Stages open in this thread, innermost last, with their traced peak so far"""
+
+    if not hasattr(LOCAL, 'stack'):
+        LOCAL.stack = []
+
+    return LOCAL.stack
+
+
+def write(record:dict) -> None:
+    """Appends a record to the metrics file, one short write per line"""
+
+    directory = os.path.dirname(CONFIG['path'])
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(CONFIG['path'], 'a') as file:
+        file.write(json.dumps(record, default=str) + '\n')
+
+
+@contextmanager
+def stage(name:str, rows_in:int|None=None):
+    """Records the block as a stage. Set record['rows_out'] and other fields inside it"""
+
+    if not enabled():
+        yield {}
+        return
+
+    parents = stack()
+    record = {
+        'stage': name,
+        'parent': parents[-1]['stage'] if parents else None,
+        'pid': os.getpid(),
+        'start': datetime.datetime.now().isoformat(timespec='milliseconds'),
+        'rows_in': rows_in,
+        'rows_out': None
+    }
+
+    traced = CONFIG['tracemalloc']
+    started_tracing = traced and not tracemalloc.is_tracing()
+
+    if started_tracing:
+        tracemalloc.start()
+
+    frame = {'stage': name, 'peak': 0}
+
+    if traced:
+        # reset_peak() is global, so the enclosing stage keeps its peak so far
+        traced_start, peak = tracemalloc.get_traced_memory()
+        if parents:
+            parents[-1]['peak'] = max(parents[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+
+    profiler = None
+    if CONFIG['profile_dir'] and not parents:
+        profiler = cProfile.Profile()
+
+    start_peak = peak_rss()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+
+    parents.append(frame)
+
+    if profiler:
+        profiler.enable()
+
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = repr(e)
+        raise
+    finally:
+
+        if profiler:
+            profiler.disable()
+
+        parents.pop()
+
+        record['wall'] = time.perf_counter() - start_wall
+        record['cpu'] = time.process_time() - start_cpu
+        record['rss_mb'] = current_rss()
+        record['peak_rss_mb'] = peak_rss()
+
+        if start_peak is not None:
+            record['peak_rss_delta_mb'] = record['peak_rss_mb'] - start_peak
+
+        if traced:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame['peak'])
+            if parents:
+                parents[-1]['peak'] = max(parents[-1]['peak'], peak)
+            record['traced_delta_mb'] = (current - traced_start) / 1024 ** 2
+            record['traced_peak_mb'] = (peak - traced_start) / 1024 ** 2
+
+        if started_tracing:
+            tracemalloc.stop()
+
+        if profiler:
+            os.makedirs(CONFIG['profile_dir'], exist_ok=True)
+            stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+            record['profile'] = os.path.join(CONFIG['profile_dir'], f'{name}-{stamp}-{os.getpid()}.prof')
+            profiler.dump_stats(record['profile'])
+
+        write(record)
+
+
+def instrumented(func=None, *, name:str|None=None):
+    """Decorator recording every call of func as a stage named module.function.
+
+    rows_in is the length of the first DataFrame or Table argument, rows_out
+    the length of the result when it is one.
+    """
+
+    if func is None:
+        return functools.partial(instrumented, name=name)
+
+    label = name or f'{func.__module__.split(".")[-1]}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+
+        if not enabled():
+            return func(*args, **kwargs)
+
+        rows_in = next(
+            (rows for rows in map(count_rows, (*args, *kwargs.values())) if rows is not None),
+            None
+        )
+
+        with stage(label, rows_in) as record:
+            result = func(*args, **kwargs)
+            record['rows_out'] = count_rows(result)
+
+        return result
+
+    return wrapper
+
+
+def read(path:str|None=None) -> pd.DataFrame:
+    """Records of a metrics file as a frame"""
+
+    if not path:
+        path = CONFIG['path']
+
+    with open(path) as file:
+        return pd.DataFrame([json.loads(line) for line in file if line.strip()])
+
+
+def summary(path:str|None=None) -> pd.DataFrame:
+    """Calls, total and worst wall seconds and highest peak RSS per stage, slowest first"""
+
+    df = read(path)
+
+    aggregations = {
+        'Calls': ('wall', 'size'),
+        'Wall': ('wall', 'sum'),
+        'MaxWall': ('wall', 'max'),
+        'Cpu': ('cpu', 'sum'),
+        'RowsIn': ('rows_in', 'max'),
+        'RowsOut': ('rows_out', 'max')
+    }
+
+    if 'peak_rss_mb' in df.columns:
+        aggregations['PeakRssMB'] = ('peak_rss_mb', 'max')
+
+    if 'traced_peak_mb' in df.columns:
+        aggregations['TracedPeakMB'] = ('traced_peak_mb', 'max')
+
+    return df.groupby('stage').agg(**aggregations).sort_values('Wall', ascending=False)
+
+
+if __name__ == '__main__':
+
+    args = [arg for arg in sys.argv[1:] if arg != '--json']
+    report = summary(args[0] if args else None)
+
+    if '--json' in sys.argv:
+        print(report.reset_index().to_json(orient='records', indent=2))
+    else:
+        print(report.to_string())
@@ -0,0 +1,352 @@
+"""This module runs the csv_creator -> pre_main -> trade_deflator chain as a cached DAG"""
+import os
+import sys
+import json
+import hashlib
+import inspect
+import importlib
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import csv_creator
+import pre_main
+import trade_deflator
+from initializer import format_dataframe
+
+CACHE = '../data/processed-data/.pipeline/'
+COUNTRIES = ['colombia', 'switzerland']
+
+TYPES = {
+    'int': pa.types.is_integer,
+    'float': pa.types.is_floating,
+    'str': lambda type: pa.types.is_string(type) or pa.types.is_large_string(type) or pa.types.is_dictionary(type)
+}
+
+
+@dataclass(frozen=True)
+class Stage:
+    """One step of the pipeline.
+
+    func receives the output tables of inputs, in order, plus params as
+    keyword arguments, and returns a pyarrow Table. outputs maps every
+    output column to 'int', 'float' or 'str'; requires lists the columns
+    the stage reads from its inputs. sources are files or directories whose
+    content feeds the stage besides its inputs. code names the modules func
+    relies on, whose source is part of the cache key along with the file
+    func is defined in. When export is set, the output is also written to
+    that csv.
+    """
+
+    name: str
+    func: Callable[..., pa.Table]
+    inputs: tuple[str, ...] = ()
+    params: dict = field(default_factory=dict)
+    sources: tuple[str, ...] = ()
+    code: tuple[str, ...] = ()
+    requires: tuple[str, ...] = ()
+    outputs: dict[str, str] = field(default_factory=dict)
+    export: str | None = None
+
+
+def fingerprint(path:str) -> str:
+    """Content hash of a file, or a size/mtime fingerprint of a directory"""
+
+    if os.path.isfile(path):
+        return csv_creator.file_hash(path)
+
+    if not os.path.exists(path):
+        return 'missing'
+
+    entries = sorted(
+        (name, stat.st_size, stat.st_mtime_ns)
+        for name in os.listdir(path)
+        if os.path.isfile(os.path.join(path, name))
+        for stat in [os.stat(os.path.join(path, name))]
+    )
+
+    return hashlib.sha256(json.dumps(entries).encode()).hexdigest()
+
+
+def check_outputs(stage:Stage, table:pa.Table) -> None:
+
+    for col, kind in stage.outputs.items():
+
+        if col not in table.column_names:
+            raise ValueError(f'{stage.name} output is missing column {col}')
+
+        if not TYPES[kind](table.schema.field(col).type):
+            raise TypeError(f'{stage.name} column {col} is {table.schema.field(col).type}, expected {kind}')
+
+
+def code_hashes(stage:Stage) -> dict[str, str]:
+    """Content hash of the file defining func and of every module in code"""
+
+    files = [inspect.getsourcefile(stage.func)]
+    files += [inspect.getsourcefile(importlib.import_module(name)) for name in stage.code]
+
+    return {os.path.basename(file): csv_creator.file_hash(file) for file in files}
+
+
+def cache_path(cache_dir:str, stage:Stage, key:str) -> str:
+    return os.path.join(cache_dir, f'{stage.name}-{key[:16]}.feather')
+
+
+def evict(cache_dir:str, stage:Stage, current:str) -> None:
+    """Removes outputs of stage cached under older keys"""
+
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(f'{stage.name}-') and name.endswith('.feather') and path != current:
+            os.remove(path)
+
+
+def load(path:str) -> pa.Table:
+    return feather.read_table(path, memory_map=True)
+
+
+def run_branch(stages:list[Stage], keys:dict[str, str], cache_dir:str, force:bool=False) -> dict[str, str]:
+    """Runs a connected group of stages in topological order.
+
+    Tables stay in memory between stages of the branch. Up to date stages
+    are skipped and only read from the cache when a stale stage needs them.
+    """
+
+    tables = {}
+    status = {}
+
+    def table_of(name:str) -> pa.Table:
+        if name not in tables:
+            tables[name] = load(cache_path(cache_dir, by_name[name], keys[name]))
+        return tables[name]
+
+    by_name = {stage.name: stage for stage in stages}
+
+    for stage in stages:
+
+        path = cache_path(cache_dir, stage, keys[stage.name])
+
+        if os.path.exists(path) and not force:
+            status[stage.name] = 'cached'
+        else:
+            print(f'\nRunning {stage.name}...')
+            table = stage.func(*[table_of(name) for name in stage.inputs], **stage.params)
+            check_outputs(stage, table)
+
+            tmp_path = path + f'.{os.getpid()}.tmp'
+            feather.write_feather(table, tmp_path)
+            os.replace(tmp_path, path)
+            evict(cache_dir, stage, path)
+
+            tables[stage.name] = table
+            status[stage.name] = 'ran'
+
+        if stage.export and (status[stage.name] == 'ran' or not os.path.exists(stage.export)):
+            table_of(stage.name).to_pandas().to_csv(stage.export, index=False, encoding='latin1')
+
+    return status
+
+
+class Pipeline:
+    """A DAG of stages whose outputs are cached by a hash of inputs and params"""
+
+    def __init__(self, stages:list[Stage], cache_dir:str=CACHE):
+
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+
+        for stage in stages:
+
+            for name in stage.inputs:
+                if name not in self.stages:
+                    raise ValueError(f'{stage.name} depends on unknown stage {name}')
+
+            provided = {col for name in stage.inputs for col in self.stages[name].outputs}
+            missing = set(stage.requires) - provided
+
+            if missing:
+                raise TypeError(f'{stage.name} requires {sorted(missing)} not produced by {list(stage.inputs)}')
+
+        self.order = self.toposort()
+
+    def toposort(self) -> list[Stage]:
+
+        order = []
+        state = {}
+
+        def visit(stage:Stage):
+
+            if state.get(stage.name) == 'done':
+                return
+            if state.get(stage.name) == 'visiting':
+                raise ValueError(f'Cycle through stage {stage.name}')
+
+            state[stage.name] = 'visiting'
+            for name in stage.inputs:
+                visit(self.stages[name])
+            state[stage.name] = 'done'
+            order.append(stage)
+
+        for stage in self.stages.values():
+            visit(stage)
+
+        return order
+
+    def keys(self) -> dict[str, str]:
+        """Cache key of every stage, from its code, params, sources and upstream keys"""
+
+        keys = {}
+
+        for stage in self.order:
+            payload = {
+                'name': stage.name,
+                'func': f'{stage.func.__module__}.{stage.func.__qualname__}',
+                'code': code_hashes(stage),
+                'params': stage.params,
+                'sources': [fingerprint(source) for source in stage.sources],
+                'inputs': [keys[name] for name in stage.inputs]
+            }
+            keys[stage.name] = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+        return keys
+
+    def closure(self, targets:list[str]) -> list[Stage]:
+
+        needed = set()
+        pending = list(targets)
+
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.stages[name].inputs)
+
+        return [stage for stage in self.order if stage.name in needed]
+
+    def branches(self, stages:list[Stage]) -> list[list[Stage]]:
+        """Connected components of stages, each in topological order"""
+
+        parent = {stage.name: stage.name for stage in stages}
+
+        def root(name:str) -> str:
+            while parent[name] != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        for stage in stages:
+            for name in stage.inputs:
+                parent[root(name)] = root(stage.name)
+
+        groups = {}
+        for stage in stages:
+            groups.setdefault(root(stage.name), []).append(stage)
+
+        return list(groups.values())
+
+    def run(self, targets:list[str]|None=None, workers:int|None=None, force:bool=False) -> dict[str, str]:
+        """Runs stale stages needed by targets, independent branches in parallel.
+
+        Returns the status of every stage: 'ran' or 'cached'.
+        """
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        stages = self.closure(targets or list(self.stages))
+        keys = self.keys()
+        branches = self.branches(stages)
+
+        status = {}
+
+        if workers == 1 or len(branches) == 1:
+            for branch in branches:
+                status.update(run_branch(branch, keys, self.cache_dir, force))
+            return status
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+
+            futures = [pool.submit(run_branch, branch, keys, self.cache_dir, force) for branch in branches]
+
+            for future in as_completed(futures):
+                status.update(future.result())
+
+        return status
+
+    def load(self, name:str) -> pa.Table:
+        """Cached output of a stage, memory mapped"""
+
+        return load(cache_path(self.cache_dir, self.stages[name], self.keys()[name]))
+
+
+def ingest_stage(path:str, dest_path:str) -> pa.Table:
+
+    dataset_path = csv_creator.ingest(path, dest_path)
+
+    return csv_creator.get_dataset(dataset_path).to_table(columns=csv_creator.COLS)
+
+
+def pre_main_stage(table:pa.Table, country:str) -> pa.Table:
+
+    df = format_dataframe(table.to_pandas())
+    df = pre_main.adjust_dataframe(country, df)
+
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def deflate_stage(table:pa.Table, country:str='USA', index:str='cpi') -> pa.Table:
+
+    df = trade_deflator.deflated_dataframe(table.to_pandas(), country=country, index=index)
+
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def country_stages(country:str) -> list[Stage]:
+
+    raw = f'../data/raw-data/{country}/tophscodes/'
+    processed = f'../data/processed-data/{country}/'
+
+    return [
+        Stage(
+            name=f'{country}.ingest',
+            func=ingest_stage,
+            params={'path': raw, 'dest_path': processed},
+            sources=(raw,),
+            code=('csv_creator',),
+            outputs={col: kind for col, kind in zip(csv_creator.COLS, ['int', 'str', 'str', 'int', 'float'])}
+        ),
+        Stage(
+            name=f'{country}.pre_main',
+            func=pre_main_stage,
+            inputs=(f'{country}.ingest',),
+            params={'country': country},
+            code=('pre_main', 'initializer', 'controls', 'hscodes', 'dictionaries'),
+            requires=tuple(csv_creator.COLS),
+            outputs={'Year': 'int', 'Partner': 'str', 'FobValue': 'float'},
+            export=processed + 'pre_main.csv'
+        ),
+        Stage(
+            name=f'{country}.deflate',
+            func=deflate_stage,
+            inputs=(f'{country}.pre_main',),
+            params={'country': 'USA', 'index': 'cpi'},
+            sources=tuple(path for path in trade_deflator.INDEXES.values() if os.path.exists(path)),
+            code=('trade_deflator', 'initializer', 'dictionaries'),
+            requires=('Year', 'FobValue'),
+            outputs={'Year': 'int', 'Partner': 'str', 'RealValue': 'float'},
+            export=processed + 'main.csv'
+        )
+    ]
+
+
+if __name__ == '__main__':
+
+    countries = sys.argv[1:] or COUNTRIES
+
+    pipeline = Pipeline([stage for country in countries for stage in country_stages(country)])
+    status = pipeline.run()
+
+    print(pd.Series(status, name='Status').to_string())
@@ -0,0 +1,241 @@
+"""This module reduces large data to the summaries plots actually draw"""
+import numpy as np
+import pandas as pd
+
+BINS = 50
+GRID = 200
+
+
+def group_codes(groups:pd.Series|np.ndarray|None, size:int) -> tuple[np.ndarray, np.ndarray]:
+    """Integer code per row and the sorted group labels, a single group when groups is None"""
+
+    if groups is None:
+        return np.zeros(size, dtype=np.intp), np.array([None], dtype=object)
+
+    codes, uniques = pd.factorize(np.asarray(groups), sort=True)
+
+    return codes.astype(np.intp), np.asarray(uniques)
+
+
+def edges_of(values:np.ndarray, bins:int=BINS, range:tuple|None=None) -> np.ndarray:
+    """bins + 1 evenly spaced edges over range, or over the finite values"""
+
+    if range is None:
+        finite = values[np.isfinite(values)]
+        range = (finite.min(), finite.max()) if len(finite) else (0.0, 1.0)
+
+    low, high = range
+
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+
+    return np.linspace(low, high, bins + 1)
+
+
+def bin_index(values:np.ndarray, edges:np.ndarray) -> np.ndarray:
+    """Bin of every value, -1 outside the edges or not finite. The last bin is closed"""
+
+    index = np.searchsorted(edges, values, side='right') - 1
+    index[values == edges[-1]] = len(edges) - 2
+    index[(index < 0) | (index >= len(edges) - 1) | ~np.isfinite(values)] = -1
+
+    return index
+
+
+def histogram(values:np.ndarray, groups:pd.Series|np.ndarray|None=None, bins:int=BINS,
+              range:tuple|None=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Counts per group and bin in one bincount.
+
+    Returns (counts groups x bins, edges, group labels). Every group shares
+    the same edges, as seaborn does with hue.
+    """
+
+    values = np.asarray(values, dtype='float64')
+    codes, uniques = group_codes(groups, len(values))
+    edges = edges_of(values, bins, range)
+
+    index = bin_index(values, edges)
+    keep = index >= 0
+
+    counts = np.bincount(codes[keep] * bins + index[keep], minlength=len(uniques) * bins)
+
+    return counts.reshape(len(uniques), bins), edges, uniques
+
+
+def bandwidth(values:np.ndarray) -> float:
+    """Scott's rule, the default of seaborn and scipy"""
+
+    values = values[np.isfinite(values)]
+
+    if len(values) < 2:
+        return 1.0
+
+    return float(values.std(ddof=1) * len(values) ** (-1 / 5)) or 1.0
+
+
+def group_bandwidths(values:np.ndarray, codes:np.ndarray, groups:int) -> np.ndarray:
+    """bandwidth of every group from bincounts, without a pass over the rows per group"""
+
+    finite = np.isfinite(values)
+    values, codes = values[finite], codes[finite]
+
+    n = np.bincount(codes, minlength=groups).astype('float64')
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.bincount(codes, weights=values, minlength=groups) / n
+        variance = np.bincount(codes, weights=(values - means[codes]) ** 2, minlength=groups) / (n - 1)
+        widths = np.sqrt(variance) * n ** (-1 / 5)
+
+    return np.where((n >= 2) & (widths > 0), widths, 1.0)
+
+
+def kde(values:np.ndarray, groups:pd.Series|np.ndarray|None=None, grid:int=GRID,
+        range:tuple|None=None, bw:float|None=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Gaussian density per group evaluated on a grid.
+
+    Values are binned on the grid first and the bin counts convolved with
+    the kernel, so the cost is one pass over the rows plus groups x grid
+    work, not rows x grid. Returns (density groups x grid, grid points,
+    group labels); densities integrate to 1 per group.
+    """
+
+    values = np.asarray(values, dtype='float64')
+    codes, uniques = group_codes(groups, len(values))
+
+    if range is None:
+        finite = values[np.isfinite(values)]
+        spread = 3 * bandwidth(finite)
+        range = (finite.min() - spread, finite.max() + spread) if len(finite) else (0.0, 1.0)
+
+    edges = edges_of(values, grid, range)
+    points = (edges[:-1] + edges[1:]) / 2
+    step = edges[1] - edges[0]
+
+    index = bin_index(values, edges)
+    keep = index >= 0
+    counts = np.bincount(codes[keep] * grid + index[keep], minlength=len(uniques) * grid)
+    counts = counts.reshape(len(uniques), grid).astype('float64')
+
+    density = np.zeros_like(counts)
+    widths = np.full(len(uniques), bw) if bw else group_bandwidths(values, codes, len(uniques))
+
+    for g in np.arange(len(uniques)):
+
+        total = counts[g].sum()
+        if not total:
+            continue
+
+        # Offsets past the grid never reach another point of it
+        width = widths[g]
+        reach = min(int(np.ceil(4 * width / step)), grid - 1)
+        offsets = np.arange(-reach, reach + 1) * step
+        kernel = np.exp(-0.5 * (offsets / width) ** 2) / (width * np.sqrt(2 * np.pi))
+
+        # The full convolution is centred reach points in, whatever the kernel length
+        density[g] = np.convolve(counts[g], kernel, mode='full')[reach:reach + grid] / total
+
+    return density, points, uniques
+
+
+def box_stats(values:np.ndarray, groups:pd.Series|np.ndarray|None=None, whis:float=1.5) -> list[dict]:
+    """Quartiles and whiskers per group in the format Axes.bxp draws.
+
+    One lexsort orders every group, quartiles are interpolated from
+    positions in each group's slice and whiskers found by searchsorted, so
+    no group is sorted twice. Fliers are not returned.
+    """
+
+    values = np.asarray(values, dtype='float64')
+    finite = np.isfinite(values)
+    codes, uniques = group_codes(None if groups is None else np.asarray(groups)[finite], finite.sum())
+    values = values[finite]
+
+    order = np.lexsort((values, codes))
+    ordered = values[order]
+    counts = np.bincount(codes, minlength=len(uniques))
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+
+    stats = []
+
+    for label, start, count in zip(uniques, starts, counts):
+
+        if not count:
+            continue
+
+        group = ordered[start:start + count]
+        q1, med, q3 = np.quantile(group, [0.25, 0.5, 0.75], method='linear')
+        iqr = q3 - q1
+
+        low = group[np.searchsorted(group, q1 - whis * iqr, side='left')]
+        high = group[np.searchsorted(group, q3 + whis * iqr, side='right') - 1]
+
+        stats.append({
+            'label': '' if label is None else str(label),
+            'med': med, 'q1': q1, 'q3': q3,
+            'whislo': low, 'whishi': high,
+            'fliers': np.array([]),
+            'n': int(count)
+        })
+
+    return stats
+
+
+def histogram2d(x:np.ndarray, y:np.ndarray, groups:pd.Series|np.ndarray|None=None, bins:int=BINS,
+                discrete_x:bool=False) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Counts per group, x bin and y bin in one bincount.
+
+    With discrete_x every distinct x is its own column, e.g. HS codes.
+    Returns (counts groups x nx x ny, x edges or distinct x values, y edges,
+    group labels).
+    """
+
+    x = np.asarray(x)
+    y = np.asarray(y, dtype='float64')
+    codes, uniques = group_codes(groups, len(y))
+
+    if discrete_x:
+        x_index, x_values = pd.factorize(x, sort=True)
+        x_index = x_index.astype(np.intp)
+        x_values = np.asarray(x_values)
+        nx = len(x_values)
+    else:
+        x_values = edges_of(x.astype('float64'), bins)
+        x_index = bin_index(x.astype('float64'), x_values)
+        nx = bins
+
+    y_edges = edges_of(y, bins)
+    y_index = bin_index(y, y_edges)
+
+    keep = (x_index >= 0) & (y_index >= 0)
+    flat = (codes[keep] * nx + x_index[keep]) * bins + y_index[keep]
+
+    counts = np.bincount(flat, minlength=len(uniques) * nx * bins)
+
+    return counts.reshape(len(uniques), nx, bins), x_values, y_edges, uniques
+
+
+def downsample(dataframe:pd.DataFrame, by:list[str]|None=None, n:int=1000, seed:int=0) -> pd.DataFrame:
+    """At most n rows of every by group, drawn at random without replacement.
+
+    Small groups are kept whole, so sparse series do not vanish from scatter
+    and line plots. Rows keep their original order.
+    """
+
+    if len(dataframe) <= n and not by:
+        return dataframe
+
+    keys = np.random.default_rng(seed).random(len(dataframe))
+
+    if by:
+        codes = dataframe.groupby(by, observed=True, sort=False).ngroup().to_numpy()
+    else:
+        codes = np.zeros(len(dataframe), dtype=np.intp)
+
+    order = np.lexsort((keys, codes))
+    ordered = codes[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(ordered)) + 1] if len(order) else np.array([], dtype=np.intp)
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+
+    keep = np.sort(order[rank < n])
+
+    return dataframe.iloc[keep]
@@ -0,0 +1,149 @@
+"""This module pre-processes the trade data of any reporter"""
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from initializer import format_dataframe, filter_dataframe, COLS
+from controls import select_controls
+from instrument import instrumented
+
+DB = '../data/processed-data/{country}/trade20012022.csv'
+DEST = '../data/processed-data/{country}/pre_main.csv'
+
+# FobValue band of 2001-2011 totals that selects the control group, and
+# partners always kept besides the control group. A 'match' entry, e.g.
+# {'treated': ['Norway', 'Iceland'], 'score': 'correlation', 'k': 10},
+# selects the control group by trajectory matching instead of the band
+# (see controls.select_controls)
+REPORTERS = {
+    'colombia': {
+        'band': (9.65e8, 105e9),
+        'include': ['Norway', 'Iceland']
+    },
+    'switzerland': {
+        'band': (1e9, 1.9e9),
+        'include': ['World']
+    }
+}
+
+
+def get_config(country:str) -> dict:
+
+    if country not in REPORTERS:
+        raise ValueError(f'Reporter {country} not configured. Try: {", ".join(REPORTERS)}')
+
+    return REPORTERS[country]
+
+
+@instrumented
+def get_df(country:str) -> pd.DataFrame:
+
+    cols = list(COLS.keys())
+    df = pd.read_csv(DB.format(country=country), usecols=cols)
+    df = format_dataframe(df)
+
+    return df
+
+
+def compare(dataframe:pd.DataFrame) -> pd.DataFrame:
+    """2001-2011 FobValue totals by partner, largest first"""
+
+    df = filter_dataframe(dataframe, period='2011')
+
+    df = df.groupby('Partner', observed=False)['FobValue'].sum().sort_values(ascending=False).reset_index()
+
+    return df
+
+
+def control_group(dataframe:pd.DataFrame, country:str) -> list[str]:
+
+    config = get_config(country)
+
+    if 'match' in config:
+        return match_group(dataframe, config)
+
+    low, high = config['band']
+
+    df = compare(dataframe)
+
+    control_group = df[(df['FobValue'] > low) & (df['FobValue'] < high)]
+
+    result = list(control_group['Partner'].values)
+    result.extend(config['include'])
+
+    return result
+
+
+def match_group(dataframe:pd.DataFrame, config:dict) -> list[str]:
+
+    match = dict(config['match'])
+    treated = match.pop('treated')
+
+    controls = select_controls(
+        dataframe,
+        treated,
+        exclude=config['include'] + ['World'],
+        **match
+    )
+
+    result = list(controls['Partner'].unique())
+    result.extend(treated)
+    result.extend(partner for partner in config['include'] if partner not in result)
+
+    return result
+
+
+@instrumented
+def adjust_dataframe(country:str, dataframe:pd.DataFrame|None=None) -> pd.DataFrame:
+    """Keeps the control group and the included partners.
+
+    The reporter's data is parsed once and reused for the control group.
+    """
+
+    df = get_df(country) if dataframe is None else dataframe
+    partners = control_group(df, country)
+    df = filter_dataframe(df, partners=partners).reset_index(drop=True)
+
+    return df
+
+
+@instrumented
+def process(country:str) -> str:
+    """Writes the pre_main.csv of a reporter and returns its path"""
+
+    dest = DEST.format(country=country)
+
+    df = adjust_dataframe(country)
+    df.to_csv(dest, index=False, encoding='latin1')
+
+    return dest
+
+
+def process_all(reporters:list[str]|None=None, workers:int|None=None) -> dict[str, str]:
+    """Pre-processes every reporter concurrently, one per worker"""
+
+    if not reporters:
+        reporters = list(REPORTERS)
+
+    for country in reporters:
+        get_config(country)
+
+    result = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+
+        futures = {pool.submit(process, country): country for country in reporters}
+
+        for future in as_completed(futures):
+            country = futures[future]
+            try:
+                result[country] = future.result()
+                print(f'\n{country} saved to {result[country]}')
+            except Exception as e:
+                print(f'\nError processing {country}: {e}')
+
+    return result
+
+
+if __name__ == '__main__':
+
+    process_all(sys.argv[1:])
@@ -1,51 +1,32 @@
 import pandas as pd
-from initializer import format_dataframe, filter_dataframe, COLS
+import pre_main
 
-DB = '../data/processed-data/colombia/trade20012022.csv'
-DEST = '../data/processed-data/colombia/pre_main.csv'
+COUNTRY = 'colombia'
+DB = pre_main.DB.format(country=COUNTRY)
+DEST = pre_main.DEST.format(country=COUNTRY)
 
 def get_df():
 
-    cols = list(COLS.keys())
-    df = pd.read_csv(DB, usecols=cols)
-    df = format_dataframe(df)
+    return pre_main.get_df(COUNTRY)
 
-    return df
 
+def compare(dataframe:pd.DataFrame|None=None):
 
-def compare():
+    df = get_df() if dataframe is None else dataframe
 
-    df = get_df()
+    return pre_main.compare(df)
 
-    df = filter_dataframe(df, period='2011')
+def control_group(dataframe:pd.DataFrame|None=None) -> list[str]:
 
-    df = df.groupby('Partner')['FobValue'].sum().sort_values(ascending=False).reset_index()
+    df = get_df() if dataframe is None else dataframe
 
-    return df
+    return pre_main.control_group(df, COUNTRY)
 
-def control_group() -> list[str]:
+def adjust_dataframe(dataframe:pd.DataFrame|None=None):
 
-    df = compare()
-
-    control_group = df.query('9.65e8 < FobValue < 105e9')
-
-    control_group = control_group['Partner'].values
-
-    result = list(control_group)
-    result.extend(['Norway', 'Iceland'])
-
-    return result
-
-def adjust_dataframe():
-
-    df = get_df()
-    partners = control_group()
-    df = df.query(f'Partner in {partners}').reset_index(drop=True)
-
-    return df
+    return pre_main.adjust_dataframe(COUNTRY, dataframe)
 
 
 if __name__ == '__main__':
 
-    df = adjust_dataframe()
-    df.to_csv(DEST, index=False, encoding='latin1')
\ No newline at end of file
+    pre_main.process(COUNTRY)
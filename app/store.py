@@ -0,0 +1,219 @@
+"""This module answers SQL and filtered scans over the processed trade of every reporter.
+
+build() copies each data/processed-data/{country}/main.csv into a parquet
+dataset partitioned by Reporter, sorted by Year, Partner and HSCode and
+split into row groups, so their min/max statistics let a scan skip the
+groups a filter rules out. Only the columns a scan or query uses are read.
+Columns keep the names of initializer.COLS plus RealValue and Reporter.
+
+query() runs SQL over the dataset as the table trade, queried in place by
+DuckDB. scan() takes filters as dataset expressions for anything the
+filter_dataframe arguments don't cover.
+
+    python store.py build colombia switzerland
+    python store.py "SELECT Reporter, Year, SUM(RealValue) AS RealValue FROM trade WHERE Year >= 2012 GROUP BY 1, 2"
+"""
+import os
+import sys
+import json
+import shutil
+import operator
+from functools import reduce
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import duckdb
+
+import dictionaries
+from hscodes import HS_DTYPE
+from initializer import content_hash, period_bounds
+from instrument import instrumented
+
+SOURCE = '../data/processed-data/{country}/main.csv'
+STORE = '../data/processed-data/store/'
+MANIFEST_NAME = '_manifest.json'
+COUNTRIES = ['colombia', 'switzerland']
+ROW_GROUP = 64_000
+TABLE = 'trade'
+SORT = ['Year', 'Partner', 'HSCode']
+
+SCHEMA = pa.schema([
+    ('Year', pa.int16()),
+    ('Flow', pa.string()),
+    ('Partner', pa.string()),
+    ('HSCode', pa.from_numpy_dtype(HS_DTYPE)),
+    ('FobValue', pa.float64()),
+    ('RealValue', pa.float64())
+])
+
+PARTITIONING = ds.partitioning(pa.schema([('Reporter', pa.string())]), flavor='hive')
+
+FORMAT = ds.ParquetFileFormat(read_options=ds.ParquetReadOptions(dictionary_columns=['Partner', 'Flow']))
+
+
+def load_manifest(path:str) -> dict[str, str]:
+
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path) as file:
+        return json.load(file)
+
+
+def save_manifest(path:str, manifest:dict[str, str]) -> None:
+
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    tmp_path = manifest_path + f'.{os.getpid()}.tmp'
+
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+    os.replace(tmp_path, manifest_path)
+
+
+def read_source(source:str) -> pa.Table:
+    """A main.csv as a table of SCHEMA's columns it has, sorted for row group pruning"""
+
+    header = pd.read_csv(source, encoding='latin1', nrows=0).columns
+    schema = pa.schema([field for field in SCHEMA if field.name in header])
+
+    df = pd.read_csv(
+        source, encoding='latin1', usecols=schema.names,
+        dtype={field.name: field.type.to_pandas_dtype() for field in schema if not pa.types.is_string(field.type)}
+    )
+    df = df.sort_values([col for col in SORT if col in df.columns], kind='stable')
+
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+@instrumented
+def build(countries:list[str]|None=None, path:str|None=None, source:str=SOURCE, full:bool=False) -> str:
+    """Writes the reporters whose main.csv changed since the last build. Returns the store path"""
+
+    if not countries:
+        countries = COUNTRIES
+
+    if not path:
+        path = STORE
+
+    os.makedirs(path, exist_ok=True)
+    manifest = {} if full else load_manifest(path)
+
+    for country in countries:
+
+        file = source.format(country=country)
+
+        if not os.path.exists(file):
+            print(f'\nSkipping {country}: {file} not found')
+            continue
+
+        key = content_hash(file)
+        partition = os.path.join(path, f'Reporter={country}')
+
+        if manifest.get(country) == key and os.path.isdir(partition):
+            continue
+
+        shutil.rmtree(partition, ignore_errors=True)
+
+        ds.write_dataset(
+            read_source(file),
+            partition,
+            format='parquet',
+            basename_template='part-{i}.parquet',
+            max_rows_per_group=ROW_GROUP,
+            min_rows_per_group=ROW_GROUP,
+            max_rows_per_file=ROW_GROUP * 64,
+            existing_data_behavior='overwrite_or_ignore'
+        )
+
+        manifest[country] = key
+        save_manifest(path, manifest)
+        print(f'\n{country} stored')
+
+    return path
+
+
+def get_dataset(path:str|None=None) -> ds.Dataset:
+
+    if not path:
+        path = STORE
+
+    return ds.dataset(path, format=FORMAT, partitioning=PARTITIONING, exclude_invalid_files=True)
+
+
+def to_pandas(table:pa.Table) -> pd.DataFrame:
+    return dictionaries.encode_table(table).to_pandas()
+
+
+def scan_filter(reporters:list[str]=[], period:str='all', partners:list[str]=[], hscodes:list=[],
+                flows:list[str]=[], filters:ds.Expression|None=None) -> ds.Expression|None:
+    """Dataset expression of the filter_dataframe arguments plus reporters, flows and filters"""
+
+    conditions = [] if filters is None else [filters]
+    low, high = period_bounds(period)
+
+    if low > -float('inf'):
+        conditions.append(ds.field('Year') >= int(low))
+
+    if high < float('inf'):
+        conditions.append(ds.field('Year') <= int(high))
+
+    for col, values in (('Reporter', reporters), ('Partner', partners), ('HSCode', hscodes), ('Flow', flows)):
+        if values:
+            conditions.append(ds.field(col).isin(list(values)))
+
+    return reduce(operator.and_, conditions) if conditions else None
+
+
+@instrumented
+def scan(columns:list[str]|None=None, reporters:list[str]=[], period:str='all', partners:list[str]=[],
+         hscodes:list=[], flows:list[str]=[], filters:ds.Expression|None=None, path:str|None=None,
+         arrow:bool=False) -> pd.DataFrame|pa.Table:
+    """Rows of the store matching the filters, reading only columns and the row groups that can match.
+
+    The arguments follow filter_dataframe; reporters and flows filter the
+    Reporter and Flow columns. filters is any other dataset expression,
+    e.g. ds.field('RealValue') > 0, and is joined to them by AND.
+    """
+
+    table = get_dataset(path).to_table(
+        columns=columns, filter=scan_filter(reporters, period, partners, hscodes, flows, filters)
+    )
+
+    return table if arrow else to_pandas(table)
+
+
+def query_duckdb(sql:str, dataset:ds.Dataset) -> pa.Table:
+
+    connection = duckdb.connect()
+
+    try:
+        connection.register(TABLE, dataset)
+        return connection.execute(sql).to_arrow_table()
+    finally:
+        connection.close()
+
+
+@instrumented
+def query(sql:str, path:str|None=None, arrow:bool=False) -> pd.DataFrame|pa.Table:
+    """Result of sql over the store, read as the table trade.
+
+    DuckDB queries the dataset in place, pushing the columns and conditions
+    of the query into the scan itself.
+    """
+
+    table = query_duckdb(sql, get_dataset(path))
+
+    return table if arrow else to_pandas(table)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'build':
+        print(build(sys.argv[2:]))
+        sys.exit()
+
+    print(query(' '.join(sys.argv[1:])).to_string(index=False))
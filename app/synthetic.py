@@ -0,0 +1,130 @@
+"""This module writes deterministic Comtrade shaped data for benchmarks.
+
+Load what it writes inside registry(), so its partners are encoded against
+a dictionaries file of their own and not the project's.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+import dictionaries
+
+YEARS = range(2001, 2023)
+BLOCK = 1_000_000
+
+# (Country Name, Country Code) of every generated partner. Names are the
+# partnerISO values of the raw files, as the processed data uses them.
+COUNTRIES = [
+    ('World', 'WLD'), ('USA', 'USA'), ('China', 'CHN'), ('Germany', 'DEU'),
+    ('Spain', 'ESP'), ('Netherlands', 'NLD'), ('Italy', 'ITA'), ('India', 'IND'),
+    ('Peru', 'PER'), ('Trinidad and Tobago', 'TTO'), ('Switzerland', 'CHE'),
+    ('Norway', 'NOR'), ('Iceland', 'ISL'), ('Liechtenstein', 'LIE'), ('Chile', 'CHL'),
+    ('Mexico', 'MEX'), ('Brazil', 'BRA'), ('Argentina', 'ARG'), ('Ecuador', 'ECU'),
+    ('Panama', 'PAN'), ('Canada', 'CAN'), ('Japan', 'JPN'), ('Korea', 'KOR'),
+    ('France', 'FRA'), ('Belgium', 'BEL'), ('United Kingdom', 'GBR'), ('Turkey', 'TUR'),
+    ('Venezuela', 'VEN'), ('Costa Rica', 'CRI'), ('Guatemala', 'GTM')
+]
+
+HSCODES = [901, 2709, 3004, 7108]
+
+
+def registry(path:str|None=None):
+    """Context in which the shared dictionaries are the synthetic ones, dictionaries.SYNTHETIC by default"""
+
+    return dictionaries.using(path or dictionaries.SYNTHETIC)
+
+
+def hscodes(count:int=len(HSCODES), digits:int=4, seed:int=0) -> np.ndarray:
+    """count distinct HS codes written with digits digits, the project's own four first"""
+
+    if count <= len(HSCODES) and digits == 4:
+        return np.array(HSCODES[:count], dtype='int64')
+
+    rng = np.random.default_rng(seed)
+    chapters = rng.integers(1, 98, size=count * 4)
+    tails = rng.integers(1, 10 ** (digits - 2), size=count * 4)
+    codes = np.unique(chapters * 10 ** (digits - 2) + tails)
+
+    return np.sort(rng.choice(codes, size=min(count, len(codes)), replace=False))
+
+
+def trade_frame(rows:int, seed:int=0, codes:np.ndarray|None=None, years:range=YEARS) -> pd.DataFrame:
+    """rows of raw Comtrade columns.
+
+    Partners are drawn with a skewed weight and each partner has its own
+    value scale, so partner totals spread over several orders of magnitude
+    like the real data.
+    """
+
+    if codes is None:
+        codes = hscodes()
+
+    rng = np.random.default_rng(seed)
+    names = np.array([name for name, _ in COUNTRIES], dtype=object)
+
+    weights = 1 / np.arange(1, len(names) + 1)
+    partner = rng.choice(len(names), size=rows, p=weights / weights.sum())
+    # Same scales in every block, whatever its seed
+    scale = np.random.default_rng(len(names)).normal(15, 1.5, size=len(names))
+
+    return pd.DataFrame({
+        'refPeriodId': rng.integers(years.start, years.stop, size=rows, dtype='int32'),
+        'reporterDesc': np.where(rng.random(rows) < 0.5, 'M', 'X'),
+        'partnerISO': names[partner],
+        'isOriginalClassification': rng.choice(codes, size=rows),
+        'fobvalue': np.round(rng.lognormal(scale[partner], 1.2), 2)
+    })
+
+
+def write_raw(path:str, rows:int, files:int=4, seed:int=0, codes:np.ndarray|None=None) -> list[str]:
+    """Writes rows raw rows split over files csv files and returns their names.
+
+    Files are written in blocks, so rows can exceed memory, and every block
+    has its own seed, so the output only depends on rows, files and seed.
+    """
+
+    os.makedirs(path, exist_ok=True)
+
+    if codes is None:
+        codes = hscodes()
+
+    sizes = np.full(files, rows // files)
+    sizes[:rows % files] += 1
+
+    seeds = iter(np.random.SeedSequence(seed).spawn(int(sum(-(-size // BLOCK) for size in sizes))))
+    names = []
+
+    for i, size in enumerate(sizes):
+
+        name = f'synthetic{i:03d}.csv'
+        names.append(name)
+
+        with open(os.path.join(path, name), 'w', newline='', encoding='latin1') as file:
+
+            header = True
+
+            for start in range(0, size, BLOCK):
+                block = trade_frame(min(BLOCK, size - start), next(seeds), codes)
+                block.to_csv(file, index=False, header=header)
+                header = False
+
+    return names
+
+
+def write_cpi(dest:str, years:range=YEARS, seed:int=0) -> str:
+    """World Bank style index file with every generated country, 2010 = 100"""
+
+    rng = np.random.default_rng(seed)
+
+    inflation = rng.normal(0.03, 0.015, size=(len(COUNTRIES), len(years)))
+    index = np.cumprod(1 + inflation, axis=1)
+    index = index / index[:, [min(max(2010 - years.start, 0), len(years) - 1)]] * 100
+
+    df = pd.DataFrame(np.round(index, 4), columns=[str(year) for year in years])
+    df.insert(0, 'Country Code', [code for _, code in COUNTRIES])
+    df.insert(0, 'Country Name', [name for name, _ in COUNTRIES])
+
+    os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+    df.to_csv(dest, index=False)
+
+    return dest
@@ -1,13 +1,17 @@
 import pandas as pd
 import numpy as np
-import os
-from initializer import filter_dataframe, COLS
+from initializer import get_cube, iter_chunks, period_bounds, tag_periods, COLS, CHUNK_SIZE
+from hscodes import digits_of, encode, level, rollups
+from groups import region, EFTA_LEFT_OUT
+from topk import rank_hscodes, StreamingTopK
+from instrument import instrumented
 
 
 PATH = '../data/processed-data/colombia/allhscodes/'
 FILE_NAME = 'trade20012022.csv'
 
 
+@instrumented
 def get_df():
 
     cols = list(COLS.keys())
@@ -17,40 +21,80 @@ def get_df():
     return df
 
 
-def slice_hscode() -> pd.DataFrame:
-    """Selects HSCode's first 4 digits"""
-
-    df = get_df()
-
-    df['HSCode'] = df['HSCode'].astype('str').str.slice(0, 4)
-
-    return df 
-
-
+@instrumented
 def group_dataframe() -> pd.DataFrame:
     """Groups by Partner, HSCode and Year"""
-    tmp = slice_hscode()
-    df = filter_dataframe(dataframe=tmp, period='2011')
-    df = df.groupby(['Partner', 'HSCode', 'Year'])['FobValue']\
-        .sum().reset_index()
-    return df
+    cube = get_cube(PATH+FILE_NAME, value='FobValue', cols=COLS, chunksize=CHUNK_SIZE)
+    df = cube.aggregate(['Partner', 'HSCode', 'Year'], years=period_bounds('2011'))
+    return rollups(df, keys=['Partner', 'Year'], value='FobValue')[4]
 
 
-def make_region_col() -> pd.DataFrame:
-    """Creates col Region"""
+def make_region_col(liechtenstein:bool=False) -> pd.DataFrame:
+    """Creates col Region. Liechtenstein stays out of EFTA, as in the first tagging, unless liechtenstein=True"""
     df = group_dataframe()
-    conditions = [(df['Partner'] == 'Switzerland'), (df['Partner'] == 'Norway'), (df['Partner'] == 'Iceland'), df['Partner'] == 'World']
-    choices = ['EFTA', 'EFTA', 'EFTA', 'World']
-    default = 'NO EFTA'
-    df['Region'] = np.select(condlist=conditions, choicelist=choices, default=default) 
+    df['Region'] = region(df['Partner'], df['Year'], groups=['EFTA', 'World'], default='NO EFTA',
+                          exclude=[] if liechtenstein else EFTA_LEFT_OUT)
     return df
 
 
-def top_hscodes() -> list[str]:
+@instrumented
+def top_hscodes(liechtenstein:bool=False) -> list[int]:
     """Finds EFTA top HS4 codes"""
-    df = make_region_col()
-    df = df.query('Region == "EFTA"')\
-        .groupby('HSCode')['FobValue']\
-        .sum().nlargest(5)
-    ls_hscodes = list(df.index)
-    return ls_hscodes
\ No newline at end of file
+    df = make_region_col(liechtenstein)
+    df = rank_hscodes(df[df['Region'] == 'EFTA'], by=['Region'], k=5)
+    ls_hscodes = list(df['HSCode'])
+    return ls_hscodes
+
+
+@instrumented
+def rankings(by:str='Region', k:int|None=5, periods:dict|None=None, digits:int=4,
+             liechtenstein:bool=False) -> pd.DataFrame:
+    """Top k HS codes of digits digits with shares for every (Region or Partner, Period, Flow)"""
+
+    cube = get_cube(PATH+FILE_NAME, value='FobValue', cols=COLS, chunksize=CHUNK_SIZE)
+    df = cube.aggregate(['Partner', 'HSCode', 'Year', 'Flow'])
+    df = rollups(df, keys=['Partner', 'Year', 'Flow'], value='FobValue')[digits]
+    df['Period'] = tag_periods(df['Year'], periods)
+
+    if by == 'Region':
+        df['Region'] = region(df['Partner'], df['Year'], groups=['EFTA', 'World'], default='NO EFTA',
+                              exclude=[] if liechtenstein else EFTA_LEFT_OUT)
+
+    return rank_hscodes(df, by=[by, 'Period', 'Flow'], k=k)
+
+
+def source_digits(chunksize:int=CHUNK_SIZE) -> int:
+    """Digits the HS codes of the source are written with, from its largest code"""
+
+    column = next(raw for raw, name in COLS.items() if name == 'HSCode')
+    chunks = pd.read_csv(PATH+FILE_NAME, usecols=[column], chunksize=chunksize)
+
+    return digits_of(np.array([max((encode(chunk[column]).max() for chunk in chunks if len(chunk)), default=0)]))
+
+
+@instrumented
+def chunked_rankings(by:str='Region', k:int=5, periods:dict|None=None, digits:int=4,
+                     liechtenstein:bool=False, chunksize:int=CHUNK_SIZE, hs_digits:int|None=None) -> pd.DataFrame:
+    """rankings read chunksize rows at a time, for files the cube can't be built from in memory.
+
+    hs_digits is the width of the source codes, found with a pass over the
+    HSCode column when not given, so every chunk is truncated the same way.
+    """
+
+    if hs_digits is None:
+        hs_digits = source_digits(chunksize)
+
+    top = StreamingTopK([by, 'Period', 'Flow'], k=k, value='FobValue')
+
+    for chunk in iter_chunks(PATH+FILE_NAME, chunksize, cols=COLS, usecols=list(COLS)):
+
+        chunk['HSCode'] = level(encode(chunk['HSCode']), digits, hs_digits)
+        chunk['Period'] = tag_periods(chunk['Year'], periods)
+
+        if by == 'Region':
+            chunk['Region'] = region(chunk['Partner'], chunk['Year'], groups=['EFTA', 'World'], default='NO EFTA',
+                                     exclude=[] if liechtenstein else EFTA_LEFT_OUT)
+
+        top.update(chunk)
+
+    return top.result()
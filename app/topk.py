@@ -0,0 +1,133 @@
+"""This module ranks HS codes inside every group at once"""
+import heapq
+import numpy as np
+import pandas as pd
+
+VALUE = 'FobValue'
+
+
+def rank_groups(sums:pd.DataFrame, by:list[str], value:str=VALUE, k:int|None=5, totals:np.ndarray|None=None) -> pd.DataFrame:
+    """Top k rows of every by group of an already summed frame.
+
+    One lexsort orders every group by descending value, so rank, share of
+    the group total and cumulative share come from positions and cumulative
+    sums without a per-group loop. totals, one per row, overrides the group
+    totals used for shares, e.g. when sums only keeps the top codes of each
+    group.
+    """
+
+    if by:
+        group = sums.groupby(by, observed=True, sort=False).ngroup().to_numpy()
+    else:
+        group = np.zeros(len(sums), dtype=np.intp)
+
+    values = sums[value].to_numpy(dtype='float64')
+    codes = sums['HSCode'].to_numpy()
+
+    order = np.lexsort((codes, -values, group))
+    ordered_group = group[order]
+    ordered_values = values[order]
+
+    starts = np.r_[0, np.flatnonzero(np.diff(ordered_group)) + 1] if len(order) else np.array([], dtype=np.intp)
+    counts = np.diff(np.r_[starts, len(order)])
+
+    rank = np.arange(len(order)) - np.repeat(starts, counts) + 1
+
+    cumulative = np.cumsum(ordered_values)
+    cumulative -= np.repeat(cumulative[starts] - ordered_values[starts], counts)
+
+    if totals is None:
+        group_total = np.bincount(group, weights=values)[ordered_group]
+    else:
+        group_total = np.asarray(totals, dtype='float64')[order]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = ordered_values / group_total
+        cumulative_share = cumulative / group_total
+
+    result = sums.iloc[order].reset_index(drop=True)
+    result['Rank'] = rank
+    result['Share'] = share
+    result['CumShare'] = cumulative_share
+
+    if k:
+        result = result[result['Rank'] <= k].reset_index(drop=True)
+
+    return result
+
+
+def rank_hscodes(dataframe:pd.DataFrame, by:list[str], value:str=VALUE, k:int|None=5) -> pd.DataFrame:
+    """Top k HS codes by summed value for every combination of by.
+
+    e.g. by=['Region', 'Period', 'Flow'] ranks every region, period and
+    flow in one grouped pass.
+    """
+
+    sums = dataframe.groupby(by + ['HSCode'], observed=True)[value].sum().reset_index()
+
+    return rank_groups(sums, by, value, k)
+
+
+class StreamingTopK:
+    """Top k HS codes per group over chunks of data that never fit in memory at once.
+
+    When every (group, HS code) total arrives complete in a single chunk,
+    e.g. chunks partitioned by the group columns, pass complete=True and
+    only a heap of k codes per group is kept. Otherwise partial sums are
+    accumulated per (group, HS code), bounded by the number of codes and
+    not by the number of rows. by needs at least one column.
+    """
+
+    def __init__(self, by:list[str], k:int=5, value:str=VALUE, complete:bool=False):
+
+        self.by = by
+        self.k = k
+        self.value = value
+        self.complete = complete
+        self.heaps = {}
+        self.totals = {}
+        self.sums = None
+
+    def update(self, chunk:pd.DataFrame) -> None:
+
+        sums = chunk.groupby(self.by + ['HSCode'], observed=True)[self.value].sum()
+
+        for group, total in sums.groupby(level=self.by, observed=True).sum().items():
+            self.totals[group] = self.totals.get(group, 0) + total
+
+        if not self.complete:
+            self.sums = sums if self.sums is None else self.sums.add(sums, fill_value=0)
+            return
+
+        top = rank_groups(sums.reset_index(), self.by, self.value, self.k)
+        top_groups = top[self.by].itertuples(index=False, name=None)
+
+        for group, code, value in zip(top_groups, top['HSCode'], top[self.value]):
+            group = group if len(self.by) > 1 else group[0]
+            heap = self.heaps.setdefault(group, [])
+            if len(heap) < self.k:
+                heapq.heappush(heap, (value, -code))
+            else:
+                heapq.heappushpop(heap, (value, -code))
+
+    def result(self) -> pd.DataFrame:
+
+        if not self.complete and self.sums is not None:
+            sums = self.sums.reset_index()
+        else:
+            # Before any chunk there is no row, only the columns of a ranking
+            rows = [
+                (*(group if len(self.by) > 1 else (group,)), -code, value)
+                for group, heap in self.heaps.items()
+                for value, code in heap
+            ]
+            sums = pd.DataFrame(rows, columns=self.by + ['HSCode', self.value])
+
+        if len(self.by) > 1:
+            keys = pd.MultiIndex.from_frame(sums[self.by])
+        else:
+            keys = pd.Index(sums[self.by[0]])
+
+        totals = keys.map(self.totals).to_numpy(dtype='float64')
+
+        return rank_groups(sums, self.by, self.value, self.k, totals=totals)
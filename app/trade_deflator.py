@@ -1,44 +1,146 @@
+import os
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from initializer import initialize, format_dataframe
+from initializer import initialize, DTYPES
+from instrument import instrumented
 
 # --- Cargar índice de precios ---
 CPI = '../data/raw-data/consumer-price-index/cpi.csv'
+PPI = '../data/raw-data/producer-price-index/ppi.csv'
+EUV = '../data/raw-data/export-unit-value/euv.csv'
 COUNTRY = 'colombia'
 DF = f'../data/processed-data/{COUNTRY}/pre_main.csv'
 DEST = f'../data/processed-data/{COUNTRY}/main.csv'
 
-df_infalted = initialize(path=DF)
-df_infalted = format_dataframe(df_infalted)
-
-colums_to_load = [str(x) for x in range(2001, 2023)]
-colums_to_load.append('Country Code')
-
-def cpi():
-    df_deflator = pd.read_csv(CPI, usecols=colums_to_load)
-    return df_deflator
-
-def filter_dataframe():
-    df_deflator = cpi()
-    df_deflator = df_deflator[df_deflator['Country Code'] == 'USA'] # Filtrar por Country Code
-    df_deflator = df_deflator.drop(columns=['Country Code']) # Eliminar la columna Country Code
-    return df_deflator
-
-def adjust_dataframe():
-    df_deflator = filter_dataframe()
-    df_deflator = pd.melt(df_deflator, id_vars=[], var_name='Year', value_name='Index')
-    df_deflator['Year'] = df_deflator['Year'].astype('int16')
-    return df_deflator
-
-def merge_dataframes(inflated_dataframe:pd.DataFrame) -> pd.DataFrame:
-    df_deflator = adjust_dataframe()
-    df_inflated = inflated_dataframe
-    df_merged = pd.merge(df_inflated, df_deflator[['Year', 'Index']], on='Year', how='left')
-    return df_merged
-
-def deflated_dataframe():
-    df_deflated = merge_dataframes(df_infalted)
-    df_deflated['RealValue'] = df_deflated['FobValue'] / (df_deflated['Index'] / 100)
-    df_deflated = df_deflated.drop(columns=['FobValue', 'Index'])
+INDEXES = {
+    'cpi': CPI,
+    'ppi': PPI,
+    'euv': EUV
+}
+
+YEARS = range(2001, 2023)
+
+class Deflator:
+    """Index type x Country x Year matrix of price indexes.
+
+    Countries are addressed by 'Country Code' or 'Country Name' of the
+    World Bank style files, years by their offset from the first year, so
+    deflating is a positional lookup instead of a merge.
+    """
+
+    def __init__(self, values:np.ndarray, indexes:list[str], countries:dict[str, int], years:range=YEARS):
+
+        self.values = values
+        self.indexes = indexes
+        self.countries = countries
+        self.years = years
+
+    @classmethod
+    @instrumented
+    def from_files(cls, files:dict[str, str]=INDEXES, years:range=YEARS) -> 'Deflator':
+
+        files = {index: path for index, path in files.items() if os.path.exists(path)}
+
+        if not files:
+            raise ValueError('No price index file found')
+
+        cols = [str(year) for year in years]
+        frames = {
+            index: pd.read_csv(path, usecols=lambda col: col in cols + ['Country Code', 'Country Name'])
+            for index, path in files.items()
+        }
+
+        codes = pd.Index(pd.concat([frame['Country Code'] for frame in frames.values()]).unique())
+        countries = {code: i for i, code in enumerate(codes)}
+
+        values = np.full((len(frames), len(codes), len(years)), np.nan)
+
+        for i, frame in enumerate(frames.values()):
+            rows = codes.get_indexer(frame['Country Code'])
+            values[i, rows] = frame.reindex(columns=cols).to_numpy(dtype='float64')
+
+            if 'Country Name' in frame.columns:
+                for name, row in zip(frame['Country Name'], rows):
+                    countries.setdefault(name, row)
+
+        return cls(values, list(frames), countries, years)
+
+    def rebase(self, year:int) -> 'Deflator':
+        """Same indexes with year = 100"""
+
+        if year not in self.years:
+            raise ValueError(f'Base year {year} not loaded. Try: {self.years.start}-{self.years.stop - 1}')
+
+        base = self.values[:, :, [year - self.years.start]]
+
+        return Deflator(self.values / base * 100, self.indexes, self.countries, self.years)
+
+    def lookup(self, years:pd.Series, countries:pd.Series|str, index:str='cpi') -> np.ndarray:
+        """Index value of every row, NaN for unknown countries or years"""
+
+        if index not in self.indexes:
+            raise ValueError(f'Index {index} not loaded. Loaded: {self.indexes}')
+
+        matrix = self.values[self.indexes.index(index)]
+        matrix = np.concatenate([matrix, np.full((1, matrix.shape[1]), np.nan)])
+        missing = len(matrix) - 1
+
+        year_pos = years.to_numpy().astype(np.intp) - self.years.start
+        valid = (year_pos >= 0) & (year_pos < len(self.years))
+        year_pos = np.where(valid, year_pos, 0)
+
+        if isinstance(countries, str):
+            country_pos = np.full(len(year_pos), self.countries.get(countries, missing))
+        else:
+            categorical = countries.astype('category')
+            positions = np.array(
+                [self.countries.get(country, missing) for country in categorical.cat.categories] + [missing],
+                dtype=np.intp
+            )
+            country_pos = positions[categorical.cat.codes.to_numpy()]
+
+        result = matrix[country_pos, year_pos]
+        result[~valid] = np.nan
+
+        return result
+
+    def deflate(self, dataframe:pd.DataFrame, value:str='FobValue', country:str='USA', index:str='cpi') -> np.ndarray:
+        """value / (index / 100). country is a country or a column of dataframe"""
+
+        countries = dataframe[country] if country in dataframe.columns else country
+        factors = self.lookup(dataframe['Year'], countries, index)
+
+        return dataframe[value].to_numpy() / (factors / 100)
+
+
+@lru_cache
+def get_deflator(base:int|None=None) -> Deflator:
+
+    deflator = Deflator.from_files()
+
+    if base:
+        deflator = deflator.rebase(base)
+
+    return deflator
+
+@instrumented
+def deflated_dataframe(dataframe:pd.DataFrame|None=None, country:str='USA', index:str='cpi', base:int|None=None):
+    """Replaces FobValue by RealValue in dataframe itself and returns it.
+
+    The caller's frame is changed, as no copy of the trade frame is made:
+    pass dataframe.copy() to keep FobValue.
+
+    country is a country code/name or a column such as 'Partner' to deflate
+    every row by its own country index. base re-bases the index to that year.
+    """
+
+    if dataframe is None:
+        dataframe = initialize(path=DF, dtypes=DTYPES)
+
+    df_deflated = dataframe
+    df_deflated['RealValue'] = get_deflator(base).deflate(df_deflated, 'FobValue', country, index)
+    df_deflated.pop('FobValue')
     return df_deflated
 
 if __name__ == '__main__':
@@ -47,4 +149,4 @@ if __name__ == '__main__':
 
     df = deflated_dataframe()
 
-    df.to_csv(DEST, index=False, encoding='latin1')
\ No newline at end of file
+    df.to_csv(DEST, index=False, encoding='latin1')
@@ -1,10 +1,57 @@
+import os
+import sys
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import FontProperties
+from matplotlib.patches import Patch
 import seaborn as sns
-from app.initializer import initialize, filter_dataframe
-from tables_colombia import pivot_tables
+from app.initializer import initialize, filter_dataframe, get_cube, TradeIndex, isin_mask
+from app.cube import Cube
+from app.hscodes import labels
+from app.plotprep import histogram, kde, box_stats, histogram2d, downsample
+from app.figcache import figure_key, fresh, store, evict, KEEP
+from app import plotprep
+
+PARTNERS = [
+            'Germany', 'China', 'Spain', 'USA',
+            'Netherlands', 'Italy', 'India', 'Peru',
+            'Trinidad and Tobago', 'Switzerland'
+            ]
+
+# Code a cached figure depends on, figcache adds its own
+SOURCES = [__file__, plotprep.__file__]
+
+def cache_key(data:pd.DataFrame, spec:dict, output:str|None, show:bool) -> str|None:
+    """Key of a figure that is saved without being shown, None otherwise"""
+
+    if not output or show:
+        return None
+
+    return figure_key(data, spec, SOURCES)
+
+
+def finish(fig, output:str|None=None, show:bool=True, key:str|None=None, spec:dict|None=None,
+           rows:int|None=None, **kwargs) -> None:
+    """Saves fig to output if given, then shows or closes it.
+
+    With a key, the saved image is recorded in the figure cache.
+    """
+
+    if output:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        fig.savefig(output, **kwargs)
+
+        if key:
+            store(output, key, spec or {}, rows)
+
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
+
 
 def log_transform(dfs:list[pd.DataFrame]=[]) -> list[pd.DataFrame]:
 
@@ -24,7 +71,7 @@ def log_transform(dfs:list[pd.DataFrame]=[]) -> list[pd.DataFrame]:
 
     return result 
 
-def get_df(which:str='') -> pd.DataFrame:
+def get_df(which:str='', df:pd.DataFrame|None=None) -> pd.DataFrame:
     
     if not which:
         raise ValueError(
@@ -34,15 +81,16 @@ def get_df(which:str='') -> pd.DataFrame:
             """
         )
 
-    df = initialize()
+    if df is None:
+        df = initialize()
 
     match which:
         case 'all':
             pass
         case 'partners':
-            df = df.query('Partner != "World"')
+            df = df[~isin_mask(df['Partner'], ['World'])]
         case 'world':
-            df = df.query('Partner == "World"')
+            df = filter_dataframe(df, partners=['World'])
         case _:
             raise ValueError(
                 """
@@ -56,72 +104,160 @@ def get_df(which:str='') -> pd.DataFrame:
 
 
 
-def graphic_dist():
+def trend_sums(df:pd.DataFrame|None, path:str|None, dims:list[str], partners:list[str]) -> pd.DataFrame:
+    """Sums of RealValue by dims for partners, from df when given, from the cube of path otherwise"""
 
-    partners_df = get_df(which='partners')
-    world_df = get_df(which='world')
+    cube = get_cube(path) if df is None else Cube.build(df, rollups=False)
 
-    partners_df, world_df = \
-        log_transform(
-            [
-                partners_df.copy(deep=True),
-                world_df.copy(deep=True)
-            ]
-        )
+    return cube.aggregate(dims, Partner=partners)
+
+
+def column(df:pd.DataFrame, name:str) -> np.ndarray:
+    """Values of a column, LogRealValue computed from RealValue without copying df"""
+
+    if name == 'LogRealValue' and name not in df.columns:
+        return np.log1p(df['RealValue'].to_numpy(dtype='float64'))
+
+    return df[name].to_numpy()
+
+
+def plot_box(ax, values:np.ndarray, groups:np.ndarray|None=None) -> None:
+    """Horizontal box plots drawn from precomputed quartiles, one per group"""
+
+    stats = box_stats(values, groups)
+    colors = sns.color_palette(n_colors=len(stats))
+
+    boxes = ax.bxp(stats, orientation='horizontal', showfliers=False, patch_artist=True)
+
+    for patch, color in zip(boxes['boxes'], colors):
+        patch.set_facecolor(color)
+
+    if groups is None:
+        ax.set_yticks([])
+
+
+def plot_hist(ax, values:np.ndarray, groups:np.ndarray|None=None, element:str='bars') -> None:
+    """Histogram with a KDE line per group, scaled to counts as seaborn does"""
+
+    counts, edges, uniques = histogram(values, groups)
+    density, points, _ = kde(values, groups, range=(edges[0], edges[-1]))
+    step = edges[1] - edges[0]
+
+    for count, curve, label, color in zip(counts, density, uniques, sns.color_palette(n_colors=len(uniques))):
+
+        label = None if label is None else str(label)
+
+        if element == 'step':
+            ax.stairs(count, edges, color=color, fill=True, alpha=.25, label=label)
+        else:
+            ax.stairs(count, edges, color=color, fill=True, alpha=.5, edgecolor='white', label=label)
+
+        ax.plot(points, curve * count.sum() * step, color=color)
+
+    ax.set_ylabel('Count')
+
+    if groups is not None:
+        ax.legend()
+
+
+def plot_hist2d(ax, x:np.ndarray, y:np.ndarray, groups:np.ndarray|None=None, discrete_x:bool=False) -> list:
+    """2D histogram drawn from bin counts, one translucent mesh per group.
+
+    Returns legend handles for the groups.
+    """
+
+    counts, x_values, y_edges, uniques = histogram2d(x, y, groups, discrete_x=discrete_x)
+
+    x_edges = np.arange(len(x_values) + 1) - 0.5 if discrete_x else x_values
+    handles = []
+
+    for count, label, color in zip(counts, uniques, sns.color_palette(n_colors=len(uniques))):
+
+        cmap = sns.light_palette(color, as_cmap=True)
+        ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(count.T, 0), cmap=cmap, alpha=.8)
+
+        if label is not None:
+            handles.append(Patch(color=color, label=str(label)))
+
+    if discrete_x:
+        ax.set_xticks(np.arange(len(x_values)))
+        ax.set_xticklabels(labels(x_values, 4) if np.issubdtype(np.asarray(x_values).dtype, np.integer) else x_values)
+
+    return handles
+
+
+def graphic_dist(df:pd.DataFrame|None=None, path:str|None=None, output:str='images/partners_dist.png', show:bool=True):
+
+    partners_df = get_df(which='partners', df=initialize(path) if df is None else df)
+
+    spec = {'figure': 'dist'}
+    key = cache_key(partners_df['RealValue'], spec, output, show)
+
+    if key and fresh(output, key):
+        return
+
+    values = column(partners_df, 'LogRealValue')
 
     fig, axs = plt.subplot_mosaic([['boxplot'], ['histplot']], layout='constrained')
 
-    sns.boxplot(x=partners_df['LogRealValue'], ax=axs['boxplot'])
-    sns.histplot(x=partners_df['LogRealValue'], kde=True, ax=axs['histplot'])
+    plot_box(axs['boxplot'], values)
+    plot_hist(axs['histplot'], values)
 
     axs['boxplot'].set_ylabel('IQR')
+    axs['histplot'].set_xlabel('LogRealValue')
 
     fig.suptitle('Bilateral Trade Distribution')
-    plt.savefig('images/partners_dist_hscode.png')
-    plt.show()
+    finish(fig, output, show, key, spec, len(values))
 
 
-def graphic_dist_hscode():
-    partners_df = get_df(which='partners')
-    world_df = get_df(which='world')
+def graphic_dist_hscode(df:pd.DataFrame|None=None, path:str|None=None, output:str='images/partners_dist_hscode.png', show:bool=True):
 
-    partners_df, world_df = \
-        log_transform(
-            [
-                partners_df.copy(deep=True),
-                world_df.copy(deep=True)
-            ]
-        )
+    partners_df = get_df(which='partners', df=initialize(path) if df is None else df)
+
+    spec = {'figure': 'dist_hscode'}
+    key = cache_key(partners_df[['HSCode', 'RealValue']], spec, output, show)
+
+    if key and fresh(output, key):
+        return
+
+    values = column(partners_df, 'LogRealValue')
+    hscodes = labels(partners_df['HSCode'].to_numpy(), 4)
 
     fig, axs = plt.subplot_mosaic([['boxplot'], ['histplot']], layout='constrained')
 
-    sns.boxplot(x=partners_df['LogRealValue'], hue=partners_df['HSCode'], ax=axs['boxplot'])
-    sns.histplot(x=partners_df['LogRealValue'], hue=partners_df['HSCode'], element='step', kde=True, ax=axs['histplot'])
+    plot_box(axs['boxplot'], values, hscodes)
+    plot_hist(axs['histplot'], values, hscodes, element='step')
 
     axs['boxplot'].set_ylabel('IQR')
+    axs['histplot'].set_xlabel('LogRealValue')
 
     fig.suptitle('Bilateral Trade Distribution')
-    plt.savefig('images/partners_dist_hscode.png')
-    plt.show()
+    finish(fig, output, show, key, spec, len(values))
 
 
-def graphic_heatmap():
+def graphic_heatmap(
+        df:pd.DataFrame|None=None,
+        path:str|None=None,
+        partners:list[str]=PARTNERS,
+        period:str='2022',
+        variables:dict={'x': 'HSCode', 'y': 'LogRealValue'},
+        hue:str|None='Flow',
+        figtitle:str='Heatmap by Flow 2012-2022',
+        output:str='images/bidistributions/heamap20122022.png',
+        show:bool=True
+        ):
 
-    partners = [
-                'Germany', 'China', 'Spain', 'USA',
-                'Netherlands', 'Italy', 'India', 'Peru',
-                'Trinidad and Tobago', 'Switzerland'
-                ]
+    if df is None:
+        df = initialize(path)
 
-    period = '2022'
-    variables = {'x': 'HSCode', 'y': 'LogRealValue'}
-    hue = 'Flow'
-    figtitle = 'Heatmap by Flow 2012-2022'
-
-    df = initialize()
     df = filter_dataframe(df, period=period, partners=partners)
-    df, _ = log_transform([df.copy(deep=True), pd.DataFrame()])
 
+    spec = {'figure': 'heatmap', 'partners': partners, 'period': period,
+            'variables': variables, 'hue': hue, 'figtitle': figtitle}
+    key = cache_key(df, spec, output, show)
+
+    if key and fresh(output, key):
+        return
 
     fig, axs = plt.subplot_mosaic([['1', '2', '3'],
                                    ['4', '5', '6'],
@@ -130,18 +266,20 @@ def graphic_heatmap():
                                    layout='constrained', figsize=(20, 12))
 
     axd = [ax for k, ax in axs.items()]
+
+    index = TradeIndex(df)
     
     for i, partner in enumerate(partners):
 
-        pdf = df.query(f'Partner == "{partner}"')
+        pdf = index.select(partners=[partner])
 
-        if hue:
+        x = column(pdf, variables['x'])
+        discrete_x = not pd.api.types.is_float_dtype(x.dtype)
 
-            sns.histplot(x=pdf[variables['x']], y=pdf[variables['y']], hue=pdf[hue], ax=axd[i])
+        handles = plot_hist2d(axd[i], x, column(pdf, variables['y']), column(pdf, hue) if hue else None, discrete_x)
 
-        else:
-
-            sns.histplot(x=pdf[variables['x']], y=pdf[variables['y']], ax=axd[i])
+        if handles:
+            axd[i].legend(handles=handles, title=hue)
 
         axd[i].set_title(f'{partner}')
         axd[i].set_ylabel('')
@@ -151,21 +289,26 @@ def graphic_heatmap():
     fig.supylabel(variables['y'])
     fig.supxlabel(variables['x'])
 
-    plt.savefig('images/bidistributions/heamap20122022.png')
-    plt.show()
+    finish(fig, output, show, key, spec, len(df))
+
 
+def graphic_tend_hscodes(
+        df:pd.DataFrame|None=None,
+        path:str|None=None,
+        partners:list[str]=PARTNERS,
+        output:str='images/tendencies/tend_hscode.png',
+        show:bool=True,
+        sample:int|None=None
+        ):
 
-def graphic_tend_hscodes():
+    df = trend_sums(df, path, ['Year', 'Partner', 'HSCode'], partners)
 
-    partners = [
-                'Germany', 'China', 'Spain', 'USA',
-                'Netherlands', 'Italy', 'India', 'Peru',
-                'Trinidad and Tobago', 'Switzerland'
-                ]
+    spec = {'figure': 'tend_hscodes', 'partners': partners, 'sample': sample}
+    key = cache_key(df, spec, output, show)
+
+    if key and fresh(output, key):
+        return
 
-    df = initialize()
-    df = filter_dataframe(df, period='all', partners=partners)
-    df = df.groupby(['Year', 'Partner', 'HSCode'], observed=True)['RealValue'].sum().reset_index()
     df['LogRealValue'] = np.log1p(df['RealValue'])
 
     fig, axs = plt.subplot_mosaic([['1', '2', '3'],
@@ -175,10 +318,15 @@ def graphic_tend_hscodes():
                                    layout='constrained', figsize=(20, 12))
 
     axd = [ax for k, ax in axs.items()]
+
+    index = TradeIndex(df)
     
     for i, partner in enumerate(partners):
 
-        pdf = df.query(f'Partner == "{partner}"')
+        pdf = index.select(partners=[partner])
+
+        if sample:
+            pdf = downsample(pdf, ['HSCode'], sample)
 
         sns.lineplot(x=pdf['Year'], y=pdf['LogRealValue'], hue=pdf['HSCode'], errorbar=None, legend=False, ax=axd[i])
 
@@ -186,9 +334,7 @@ def graphic_tend_hscodes():
         axd[i].set_ylabel('')
         axd[i].set_xlabel('')
 
-    hscodes = pd.unique(df['HSCode']).astype('int')
-    hscodes.sort()
-    hscodes = hscodes.astype(str)
+    hscodes = labels(np.unique(df['HSCode']), 4)
     
     fig.legend(hscodes, loc='upper right', ncols=5, bbox_to_anchor=(1, 1.05), title='HSCode')
 
@@ -196,21 +342,25 @@ def graphic_tend_hscodes():
     fig.supylabel('LogRealValue')
     fig.supxlabel('Year')
 
-    plt.savefig('images/tendencies/tend_hscode.png', bbox_inches='tight')
-    plt.show()
+    finish(fig, output, show, key, spec, len(df), bbox_inches='tight')
 
 
-def graphic_tend_flow():
+def graphic_tend_flow(
+        df:pd.DataFrame|None=None,
+        path:str|None=None,
+        partners:list[str]=PARTNERS,
+        output:str|None=None,
+        show:bool=True,
+        sample:int|None=None
+        ):
 
-    partners = [
-                'Germany', 'China', 'Spain', 'USA',
-                'Netherlands', 'Italy', 'India', 'Peru',
-                'Trinidad and Tobago', 'Switzerland'
-                ]
+    df = trend_sums(df, path, ['Partner', 'Year', 'Flow'], partners)
 
-    df = initialize()
-    df = filter_dataframe(df, period='all', partners=partners)
-    df = df.groupby(['Partner', 'Year', 'Flow'], observed=True)['RealValue'].sum().reset_index()
+    spec = {'figure': 'tend_flow', 'partners': partners, 'sample': sample}
+    key = cache_key(df, spec, output, show)
+
+    if key and fresh(output, key):
+        return
 
     fig, axs = plt.subplot_mosaic([['1', '2', '3'],
                                    ['4', '5', '6'],
@@ -219,10 +369,15 @@ def graphic_tend_flow():
                                    layout='constrained', figsize=(20, 12))
 
     axd = [ax for k, ax in axs.items()]
+
+    index = TradeIndex(df)
     
     for i, partner in enumerate(partners):
 
-        pdf = df.query(f'Partner == "{partner}"')
+        pdf = index.select(partners=[partner])
+
+        if sample:
+            pdf = downsample(pdf, ['Flow'], sample)
 
         sns.lineplot(x=pdf['Year'], y=pdf['RealValue'], hue=pdf['Flow'], errorbar=None, legend=True, ax=axd[i])
 
@@ -236,8 +391,7 @@ def graphic_tend_flow():
     fig.supylabel('RealValue')
     fig.supxlabel('Year')
 
-    #plt.savefig('images/tendencies/tend_flow.png', bbox_inches='tight')
-    plt.show()
+    finish(fig, output, show, key, spec, len(df), bbox_inches='tight')
 
 
 def contingency_table(pivot_tables:list):
@@ -284,8 +438,127 @@ def contingency_table(pivot_tables:list):
     ax1.set_ylabel('')
 
 
+FIGURES = [
+    {'figure': 'dist', 'output': 'images/partners_dist.png'},
+    {'figure': 'dist_hscode', 'output': 'images/partners_dist_hscode.png'},
+    {
+        'figure': 'heatmap',
+        'partners': PARTNERS,
+        'period': '2022',
+        'variables': {'x': 'HSCode', 'y': 'LogRealValue'},
+        'hue': 'Flow',
+        'figtitle': 'Heatmap by Flow 2012-2022',
+        'output': 'images/bidistributions/heamap20122022.png'
+    },
+    {
+        'figure': 'heatmap',
+        'partners': PARTNERS,
+        'period': '2011',
+        'variables': {'x': 'HSCode', 'y': 'LogRealValue'},
+        'hue': 'Flow',
+        'figtitle': 'Heatmap by Flow 2001-2011',
+        'output': 'images/bidistributions/heamap20012011.png'
+    },
+    {'figure': 'tend_hscodes', 'partners': PARTNERS, 'output': 'images/tendencies/tend_hscode.png'},
+    {'figure': 'tend_flow', 'partners': PARTNERS, 'output': 'images/tendencies/tend_flow.png'}
+]
+
+RENDERERS = {
+    'dist': graphic_dist,
+    'dist_hscode': graphic_dist_hscode,
+    'heatmap': graphic_heatmap,
+    'tend_hscodes': graphic_tend_hscodes,
+    'tend_flow': graphic_tend_flow
+}
+
+# Figures drawn from rows, the others are drawn from the cube of path
+ROW_FIGURES = {'dist', 'dist_hscode', 'heatmap'}
+
+
+@lru_cache(maxsize=1)
+def load_rows(path:str|None) -> pd.DataFrame:
+    """initialize(path) once per process, for every row figure it draws"""
+
+    return initialize(path)
+
+
+def render(spec:dict, df:pd.DataFrame|None=None, path:str|None=None) -> str:
+    """Draws one figure spec headlessly and returns its output path.
+
+    Without df, row figures are drawn from path and the others from its cube.
+    """
+
+    params = {key: value for key, value in spec.items() if key != 'figure'}
+
+    if spec['figure'] not in RENDERERS:
+        raise ValueError(f'Figure {spec["figure"]} not valid. Try: {", ".join(RENDERERS)}')
+
+    if df is None and spec['figure'] in ROW_FIGURES:
+        df = load_rows(path)
+
+    RENDERERS[spec['figure']](df=df, path=path, show=False, **params)
+
+    return spec.get('output')
+
+
+def init_worker() -> None:
+
+    plt.switch_backend('Agg')
+
+
+def render_all(specs:list[dict]=FIGURES, workers:int|None=None, path:str|None=None, keep:int=KEEP) -> list[str]:
+    """Renders every spec with the Agg backend.
+
+    The rows are loaded at most once per process, and only if a row figure
+    is drawn there. The trend figures only load the cube. Figures are
+    spread across a process pool, or drawn in this process when workers=1.
+    Figures whose data and spec are unchanged are not drawn again. Cached
+    figures that no output points to are evicted, keeping the keep most
+    recent per directory.
+    """
+
+    plt.switch_backend('Agg')
+
+    if workers == 1:
+        outputs = [render(spec, None, path) for spec in specs]
+        evict_outputs(outputs, keep)
+        return outputs
+
+    outputs = []
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+
+        futures = {pool.submit(render, spec, None, path): spec for spec in specs}
+
+        for future in as_completed(futures):
+            spec = futures[future]
+            try:
+                outputs.append(future.result())
+                print(f'{spec["figure"]} saved to {spec.get("output")}')
+            except Exception as e:
+                print(f'Error rendering {spec["figure"]}: {e}')
+
+    evict_outputs(outputs, keep)
+
+    return outputs
+
+
+def evict_outputs(outputs:list[str|None], keep:int=KEEP) -> int:
+    """Evicts stale cached figures from every directory written to"""
+
+    directories = {os.path.dirname(output) or '.' for output in outputs if output}
+
+    return sum(evict(directory, keep) for directory in directories)
+
+
 if __name__ == '__main__':
 
+    if sys.argv[1:] == ['batch']:
+        render_all()
+        sys.exit()
+
+    from tables_colombia import pivot_tables
+
     print('Executing graphics_colombia.py')
 
     tables = pivot_tables(
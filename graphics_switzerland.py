@@ -2,6 +2,8 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+from app.figcache import figure_key, fresh, store
+from app.hscodes import HS_DTYPE
 
 DB = 'processed-data/switzerland/main.csv'
 
@@ -9,7 +11,7 @@ DTYPES = {
     'Year': 'int16',
     'Partner': 'category',
     'Flow': 'category',
-    'HSCode': 'category',
+    'HSCode': HS_DTYPE,
     'FobValue': 'float64'
 }
 
@@ -48,7 +50,9 @@ def control_group() -> list[str]:
     return result
 
 
-def compare_tendency():
+def compare_tendency(output:str|None=None, show:bool=True):
+    """Draws the control group tendencies. A saved figure that is not shown
+    is drawn again only when its data changed."""
 
     partners = control_group()
 
@@ -56,6 +60,14 @@ def compare_tendency():
 
     df = df.groupby(['Year', 'Partner', 'HSCode'], observed=False)['RealValue'].sum().reset_index()
 
+    spec = {'figure': 'compare_tendency', 'partners': partners}
+    key = None
+
+    if output and not show:
+        key = figure_key(df[df['Partner'].isin(partners)], spec, __file__)
+        if fresh(output, key):
+            return
+
     df['LogRealValue'] = np.log1p(df['RealValue'])
 
     fig, axs = plt.subplots(nrows=3, ncols=4, layout='constrained')
@@ -64,11 +76,11 @@ def compare_tendency():
 
     for i, partner in enumerate(partners):
 
-        query = df.query(f'Partner == "{partner}"')
+        query = df[df['Partner'] == partner]
 
         sns.lineplot(x=query['Year'], y=query['RealValue'], hue=query['HSCode'], ax=axs[i], legend=False)
 
-        cordinates = query.query('Year == 2011 and HSCode == "7108"')
+        cordinates = query.query('Year == 2011 and HSCode == 7108')
         y_cordinate = cordinates['RealValue'].values
 
         axs[i].annotate(
@@ -86,7 +98,15 @@ def compare_tendency():
     fig.supylabel('RealValue')
     fig.supxlabel('Year')
 
-    plt.show()
+    if output:
+        fig.savefig(output)
+        if key:
+            store(output, key, spec, len(df))
+
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
 
 def colombia():
 
@@ -102,7 +122,7 @@ def colombia():
 
     sns.lineplot(x=query['Year'], y=query['RealValue'], hue=query['HSCode'], legend=False)
 
-    cordinates = query.query('Year == 2011 and HSCode == "3004"')
+    cordinates = query.query('Year == 2011 and HSCode == 3004')
     y_cordinate = cordinates['RealValue'].values
 
     ax.annotate(
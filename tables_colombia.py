@@ -1,5 +1,10 @@
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from app.initializer import initialize, format_dataframe, filter_dataframe
+from app.cube import Cube
+from app.dictionaries import sort_categories
+from app.hscodes import HS_DTYPE
+from app.initializer import initialize, tag_periods, REPORT_PERIODS
 
 DB = 'data/processed-data/colombia/main.csv'
 
@@ -7,42 +12,140 @@ DTYPES = {
     'Year': 'int16',
     'Partner': 'category',
     'Flow': 'category',
-    'HSCode': 'category',
+    'HSCode': HS_DTYPE,
     'RealValue': 'float64'
     }
 
-DF = initialize(DB)
-DF = format_dataframe(DF, dtypes=DTYPES)
+DF = initialize(DB, dtypes=DTYPES)
 DF = DF.query('Partner not in ["World", "USA", "Iceland"]')
+PARTNERS = list(DF['Partner'].unique())
+
+@lru_cache
+def get_table_cube() -> Cube:
+    """Cube of the rows in DF, built on first use from DF instead of a second read of DB"""
+    return Cube.build(DF, 'RealValue')
+
+def as_list(value:str|list) -> list:
+    return value if isinstance(value, list) else [value]
+
+def as_tuple(value) -> tuple:
+    return value if isinstance(value, tuple) else (value,)
+
+def pivot_long(
+        index:str|list,
+        columns:str|list,
+        values:str|list,
+        aggfunc:str|list,
+        periods:dict[str, tuple]|None=None
+        ) -> pd.DataFrame:
+    """Aggregates of every period in one grouped pass, indexed by Period, index and columns.
+
+    The period is tagged once as a categorical key of the groupby, so DF is
+    neither copied nor filtered per period, and only observed combinations
+    get a row. Columns are named as pivot_table names them, e.g. (aggfunc,
+    value) for a list of values and aggfuncs. Sums of RealValue come from
+    the cube instead of the raw rows.
+    """
+
+    if not periods:
+        periods = REPORT_PERIODS
+
+    keys = [*as_list(index), *as_list(columns)]
+
+    if all(func == 'sum' for func in as_list(aggfunc)) and as_list(values) == ['RealValue']:
+        source = get_table_cube().aggregate(list(dict.fromkeys(['Year', *keys])), Partner=PARTNERS)
+    else:
+        source = DF
+
+    # Rows and columns listed by name, not in the order the registry first saw them
+    source = sort_categories(source)
+
+    period = pd.Series(tag_periods(source['Year'], periods), index=source.index, name='Period')
+
+    long = source.groupby([period, *keys], observed=True)[values].agg(aggfunc)
+
+    if isinstance(long, pd.Series):
+        return long.to_frame()
+
+    if isinstance(long.columns, pd.MultiIndex):
+        long.columns = long.columns.swaplevel(0, 1)
+
+    return long
+
+def sparse_pivot(long:pd.DataFrame, columns:str|list) -> pd.DataFrame:
+    """Pivot of a long frame with one sparse column per columns key and statistic.
+
+    Only one dense column exists at a time, so memory follows the observed
+    cells instead of index x columns.
+    """
+
+    columns = as_list(columns)
+    rest = [name for name in long.index.names if name not in columns]
+
+    row_codes, row_labels = long.index.droplevel(columns).factorize(sort=True)
+    column_codes, column_labels = long.index.droplevel(rest).factorize(sort=True)
+
+    order = np.argsort(column_codes, kind='stable')
+    bounds = np.searchsorted(column_codes[order], np.arange(len(column_labels) + 1))
+
+    data = {}
+
+    for stat in long.columns:
+
+        stat_values = long[stat].to_numpy(dtype='float64')[order]
+        stat_rows = row_codes[order]
+
+        for code, label in enumerate(column_labels):
+
+            start, end = bounds[code], bounds[code + 1]
+
+            dense = np.full(len(row_labels), np.nan)
+            dense[stat_rows[start:end]] = stat_values[start:end]
+
+            key = label if len(long.columns) == 1 else (*as_tuple(stat), *as_tuple(label))
+            data[key] = pd.arrays.SparseArray(dense, fill_value=np.nan)
+
+    return pd.DataFrame(data, index=row_labels)
 
 def pivot_tables(
         index:str|list,
         columns:str|list,
         values:str|list,
-        aggfunc:str|list
+        aggfunc:str|list,
+        periods:dict[str, tuple]|None=None,
+        format:str='dense'
         ):
+    """One pivot table per period, all built from a single pivot_long pass.
+
+    format='dense' returns pivot_table like frames, 'sparse' frames of
+    sparse columns for HS6 x partner tables that are mostly empty, and
+    'long' the pivot_long frame itself.
+    """
+
+    if format not in ('dense', 'sparse', 'long'):
+        raise ValueError(f'Argument {format} not valid. Try: dense, sparse, long')
+
+    if not periods:
+        periods = REPORT_PERIODS
+
+    long = pivot_long(index, columns, values, aggfunc, periods)
+
+    if format == 'long':
+        return long
+
+    if isinstance(values, str) and isinstance(aggfunc, str):
+        long = long[values]
+
+    labels = long.index.get_level_values('Period')
+    tables = []
+
+    for period in periods:
+
+        table = long[labels == period].droplevel('Period')
+
+        if format == 'sparse':
+            tables.append(sparse_pivot(table.to_frame() if isinstance(table, pd.Series) else table, columns))
+        else:
+            tables.append(table.unstack(columns))
 
-    df = DF.copy()
-
-    df_20012011 = filter_dataframe(df, period='2011')
-    df_20122022 = filter_dataframe(df, period='2022')
-
-    pivot_20012011 = df_20012011\
-        .pivot_table(
-            index=index,
-            columns=columns,
-            values=values,
-            aggfunc=aggfunc,
-            observed=True
-        )
-
-    pivot_20122022 = df_20122022\
-        .pivot_table(
-            index=index,
-            columns=columns,
-            values=values,
-            aggfunc=aggfunc,
-            observed=True
-        )
-
-    return [pivot_20012011, pivot_20122022]
+    return tables
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# app modules import each other by bare name, as when run from app/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+
+@pytest.fixture(autouse=True)
+def registry(tmp_path):
+    """Every test encodes against dictionaries of its own, never the project's"""
+
+    import dictionaries
+
+    with dictionaries.using(str(tmp_path / 'dictionaries.json')) as registry:
+        yield registry
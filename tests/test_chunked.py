@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import initializer
+
+DTYPES = {**initializer.DTYPES, 'RealValue': 'float64'}
+
+
+@pytest.fixture
+def source(tmp_path):
+
+    rng = np.random.default_rng(7)
+    rows = 5000
+
+    df = pd.DataFrame({
+        'Year': rng.integers(2001, 2023, rows),
+        'Partner': rng.choice(['Peru', 'Chile', 'Norway', 'Iceland', 'Austria'], rows),
+        'Flow': rng.choice(['M', 'X'], rows),
+        'HSCode': rng.choice([901, 2709, 3004, 7108, 8703], rows),
+        'RealValue': rng.random(rows) * 100
+    })
+    # A partner that only shows up in the last chunk
+    df.loc[rows - 3:, 'Partner'] = 'Japan'
+
+    path = tmp_path / 'main.csv'
+    df.to_csv(path, index=False, encoding='latin1')
+
+    return str(path), df
+
+
+@pytest.mark.parametrize('keys, filters', [
+    (['Year', 'Partner'], {}),
+    (['Partner', 'Flow'], {'period': '2011'}),
+    (['HSCode'], {'period': '2022', 'partners': ['Peru', 'Japan']}),
+    (['Year', 'HSCode', 'Flow'], {'hscodes': [2709, 8703]})
+])
+@pytest.mark.parametrize('chunksize', [700, 10_000])
+def test_chunked_group_sum_matches_groupby(source, keys, filters, chunksize):
+
+    path, df = source
+
+    result = initializer.chunked_group_sum(path, keys, chunksize=chunksize, dtypes=DTYPES, **filters)
+
+    low, high = initializer.period_bounds(filters.get('period', 'all'))
+    mask = df['Year'].between(low, high)
+    if 'partners' in filters:
+        mask &= df['Partner'].isin(filters['partners'])
+    if 'hscodes' in filters:
+        mask &= df['HSCode'].isin(filters['hscodes'])
+
+    expected = df[mask].groupby(keys)['RealValue'].sum().reset_index().astype({key: str for key in keys})
+    # Categories keep the order they were registered in, so both are sorted as text
+    result = result.astype({key: str for key in keys})
+
+    result = result.sort_values(keys, ignore_index=True)
+    expected = expected.sort_values(keys, ignore_index=True)
+
+    pd.testing.assert_frame_equal(result[keys], expected[keys])
+    assert result['RealValue'].to_numpy() == pytest.approx(expected['RealValue'].to_numpy())
+
+
+def test_chunked_group_sum_of_no_rows(source):
+
+    path, _ = source
+
+    result = initializer.chunked_group_sum(path, ['Partner'], partners=['Nowhere'], chunksize=700, dtypes=DTYPES)
+
+    assert result.empty
+    assert list(result.columns) == ['Partner', 'RealValue']
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import controls
+
+
+@pytest.fixture
+def points():
+
+    rng = np.random.default_rng(4)
+
+    return np.vstack([
+        rng.normal(size=(50, 7)),
+        rng.normal(scale=100, size=(50, 7)),
+        -rng.random((10, 7)),
+        np.zeros((1, 7)),
+        np.full((1, 7), 5.0)
+    ])
+
+
+def test_projection_lies_on_the_simplex(points):
+
+    weights = controls.project_simplex(points)
+
+    assert weights.shape == points.shape
+    assert (weights >= 0).all()
+    assert weights.sum(axis=1) == pytest.approx(np.ones(len(points)))
+
+
+def test_projection_is_the_closest_simplex_point(points):
+
+    rng = np.random.default_rng(5)
+    weights = controls.project_simplex(points)
+
+    # Points already on the simplex stay where they are
+    inside = rng.dirichlet(np.ones(points.shape[1]), 20)
+    assert controls.project_simplex(inside) == pytest.approx(inside)
+
+    # No other point of the simplex is closer
+    others = rng.dirichlet(np.ones(points.shape[1]), 500)
+    nearest = np.linalg.norm(points[:, None] - others[None], axis=-1).min(axis=1)
+
+    assert (np.linalg.norm(points - weights, axis=1) <= nearest + 1e-12).all()
+
+
+def test_synthetic_weights_lie_on_the_simplex():
+
+    rng = np.random.default_rng(6)
+    candidates = rng.lognormal(5, 1, (3, 8, 12))
+    target = rng.lognormal(5, 1, (3, 12))
+
+    weights = controls.synthetic_weights(candidates, target)
+
+    assert (weights >= 0).all()
+    assert weights.sum(axis=1) == pytest.approx(np.ones(3))
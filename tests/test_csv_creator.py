@@ -0,0 +1,46 @@
+import os
+
+import pandas as pd
+import pytest
+
+import csv_creator
+
+
+def write_raw(directory, name:str, year:int, rows:int=5) -> None:
+
+    pd.DataFrame({
+        'refPeriodId': [year] * rows,
+        'reporterDesc': ['Colombia'] * rows,
+        'partnerISO': [f'P{i}' for i in range(rows)],
+        'isOriginalClassification': range(rows),
+        'fobvalue': [100.0 * i for i in range(rows)]
+    }).to_csv(directory / name, index=False, encoding='latin1')
+
+
+def fragments(dataset_path:str) -> list[str]:
+    return sorted(name for _, _, names in os.walk(dataset_path) for name in names if name.endswith('.parquet'))
+
+
+def test_failed_files_raise_and_leave_nothing_behind(tmp_path):
+
+    raw = tmp_path / 'raw'
+    raw.mkdir()
+    write_raw(raw, 'a.csv', 2001)
+    write_raw(raw, 'b.csv', 2002)
+    # No fobvalue column
+    pd.DataFrame({'refPeriodId': [2003]}).to_csv(raw / 'c.csv', index=False)
+
+    with pytest.raises(RuntimeError, match='c.csv'):
+        csv_creator.ingest(str(raw) + '/', str(tmp_path / 'dest'), workers=2)
+
+    dataset_path = os.path.join(tmp_path / 'dest', csv_creator.DATASET_NAME)
+
+    assert set(csv_creator.load_manifest(dataset_path)) == {'a.csv', 'b.csv'}
+    assert fragments(dataset_path) == ['a-0.parquet', 'b-0.parquet']
+
+    # Once fixed, the next run picks the file up
+    write_raw(raw, 'c.csv', 2003)
+    csv_creator.ingest(str(raw) + '/', str(tmp_path / 'dest'), workers=2)
+
+    assert set(csv_creator.load_manifest(dataset_path)) == {'a.csv', 'b.csv', 'c.csv'}
+    assert len(csv_creator.get_dataset(dataset_path).to_table()) == 15
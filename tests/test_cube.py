@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import cube
+import dictionaries
+
+
+@pytest.fixture
+def trade():
+
+    rng = np.random.default_rng(2)
+    rows = 3000
+
+    df = pd.DataFrame({
+        'Year': rng.integers(2001, 2023, rows),
+        'Partner': pd.Categorical(rng.choice(['Peru', 'Chile', 'Norway', 'Iceland'], rows)),
+        'HSCode': rng.choice([901, 2709, 3004, 7108], rows).astype('int32'),
+        'Flow': pd.Categorical(rng.choice(['M', 'X'], rows)),
+        'RealValue': rng.random(rows) * 100
+    })
+
+    return dictionaries.encode(df)
+
+
+def reference(df:pd.DataFrame, dims:list[str], years:tuple|None=None, **filters) -> pd.DataFrame:
+
+    if years:
+        df = df[df['Year'].between(*years)]
+
+    for dim, values in filters.items():
+        df = df[df[dim].isin(values if isinstance(values, list) else [values])]
+
+    if not dims:
+        return pd.DataFrame({'RealValue': [df['RealValue'].sum()]})
+
+    return df.groupby(dims, observed=True)['RealValue'].sum().reset_index()
+
+
+def assert_same_sums(result:pd.DataFrame, expected:pd.DataFrame, dims:list[str]) -> None:
+
+    result = result.sort_values(dims, ignore_index=True) if dims else result
+    expected = expected.sort_values(dims, ignore_index=True) if dims else expected
+
+    pd.testing.assert_frame_equal(result[dims].astype(object), expected[dims].astype(object))
+    assert result['RealValue'].to_numpy() == pytest.approx(expected['RealValue'].to_numpy())
+
+
+@pytest.mark.parametrize('rollups', [True, False])
+@pytest.mark.parametrize('dims, years, filters', [
+    ([], None, {}),
+    (['Year'], None, {}),
+    (['Partner', 'Flow'], (2010, 2015), {}),
+    (['HSCode'], None, {'Partner': ['Peru', 'Chile']}),
+    (['Year', 'Partner', 'HSCode', 'Flow'], (2005, 2020), {'Flow': 'X'}),
+    ([], (2020, 2022), {'HSCode': 2709, 'Partner': 'Norway'})
+])
+def test_aggregate_matches_groupby(trade, rollups, dims, years, filters):
+
+    built = cube.Cube.build(trade, rollups=rollups)
+
+    result = built.aggregate(dims, years=years, **filters)
+
+    assert_same_sums(result, reference(trade, dims, years, **filters), dims)
+
+
+def test_saved_cube_aggregates_the_same(trade, tmp_path):
+
+    cube.Cube.build(trade).save(str(tmp_path / 'cube'))
+    loaded = cube.Cube.load(str(tmp_path / 'cube'))
+
+    result = loaded.aggregate(['Partner'], years=(2001, 2010), Flow='M')
+
+    assert_same_sums(result, reference(trade, ['Partner'], (2001, 2010), Flow='M'), ['Partner'])
@@ -0,0 +1,66 @@
+import pandas as pd
+import pyarrow as pa
+
+import dictionaries
+import initializer
+
+
+def write_trade(path, partners:list[str]) -> str:
+
+    pd.DataFrame({
+        'Year': [2020] * len(partners),
+        'Partner': partners,
+        'Flow': ['Export'] * len(partners),
+        'HSCode': range(len(partners)),
+        'FobValue': [10.0] * len(partners)
+    }).to_csv(path, index=False, encoding='latin1')
+
+    return str(path)
+
+
+def test_concat_of_separately_loaded_frames(tmp_path):
+
+    first = write_trade(tmp_path / 'first.csv', ['Peru', 'Chile'])
+    second = write_trade(tmp_path / 'second.csv', ['Norway', 'Chile'])
+
+    a = initializer.initialize(first, compact=True)
+    b = initializer.initialize(second, compact=True)
+
+    # a was encoded before Norway was registered
+    assert len(a['Partner'].cat.categories) == 2
+    assert pd.concat([a, b])['Partner'].dtype != dictionaries.dtype('Partner')
+
+    df = dictionaries.concat([a, b], ignore_index=True)
+
+    assert df['Partner'].dtype == dictionaries.dtype('Partner')
+    assert df['Flow'].dtype == dictionaries.dtype('Flow')
+    assert df['Partner'].tolist() == ['Peru', 'Chile', 'Norway', 'Chile']
+
+
+def test_cache_hits_load_the_current_categories(tmp_path):
+
+    first = write_trade(tmp_path / 'first.csv', ['Peru', 'Chile'])
+    second = write_trade(tmp_path / 'second.csv', ['Norway'])
+
+    initializer.initialize(first, compact=True)
+    b = initializer.initialize(second, compact=True)
+    # Read back from the feather cache, after the registry grew
+    a = initializer.initialize(first, compact=True)
+
+    assert a['Partner'].dtype == dictionaries.dtype('Partner')
+    assert a['Partner'].tolist() == ['Peru', 'Chile']
+    assert pd.concat([a, b])['Partner'].dtype == dictionaries.dtype('Partner')
+
+
+def test_encode_table_matches_encode():
+
+    dictionaries.encode(pd.DataFrame({'Partner': pd.Categorical(['Iceland', 'Peru'])}))
+
+    table = pa.table({'Partner': pa.array(['Peru', None, 'Chile', 'Peru']).dictionary_encode(),
+                      'Value': [1.0, 2.0, 3.0, 4.0]})
+
+    result = dictionaries.encode_table(table).to_pandas()
+    expected = dictionaries.encode(table.to_pandas())
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert list(result['Partner'].cat.categories) == ['Iceland', 'Peru', 'Chile']
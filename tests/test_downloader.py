@@ -0,0 +1,125 @@
+import os
+import json
+
+import pytest
+
+import comtrade_mock
+import downloader
+
+ROWS = 200
+
+
+@pytest.fixture
+def mock():
+
+    servers = []
+
+    def start(**kwargs):
+        server = comtrade_mock.serve(rows=ROWS, **kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_jobs(years:range=range(2001, 2006)) -> list[downloader.Job]:
+    return downloader.jobs(['colombia'], years, ['0901', '2709'], batch_size=1)
+
+
+def make_downloader(server, tmp_path, **kwargs) -> downloader.Downloader:
+
+    options = {'rate': 1000.0, 'backoff': 0.01, 'retries': 5, 'timeout': 10.0, **kwargs}
+
+    return downloader.Downloader(server.url, str(tmp_path / '{country}' / ''), **options)
+
+
+def assert_complete(tmp_path, jobs:list[downloader.Job]) -> None:
+    """Every job's csv holds the whole extract and no .part file is left"""
+
+    directory = tmp_path / 'colombia'
+
+    for job in jobs:
+        expected = comtrade_mock.extract(str(job.reporter), str(job.year), ','.join(job.hscodes), ROWS)
+        assert (directory / job.name).read_bytes() == expected
+
+    assert not [name for name in os.listdir(directory) if name.endswith('.part')]
+
+
+def test_retries_server_errors(mock, tmp_path):
+
+    server = mock(fail_every=3)
+    jobs = make_jobs()
+
+    result = make_downloader(server, tmp_path).run(jobs)
+
+    assert set(result.values()) == {'done'}
+    assert server.requests > len(jobs)
+    assert_complete(tmp_path, jobs)
+
+    with open(tmp_path / 'colombia' / downloader.STATE_NAME) as file:
+        state = json.load(file)
+
+    assert max(entry['attempts'] for entry in state.values()) > 1
+
+
+def test_gives_up_after_retries(mock, tmp_path):
+
+    server = mock(fail_every=1)
+    jobs = make_jobs(range(2001, 2002))
+
+    result = make_downloader(server, tmp_path, retries=2).run(jobs)
+
+    assert set(result.values()) == {'failed'}
+    assert server.requests == len(jobs) * 3
+
+
+def test_resumes_truncated_bodies(mock, tmp_path):
+
+    server = mock(cut_every=2)
+    jobs = make_jobs()
+
+    result = make_downloader(server, tmp_path).run(jobs)
+
+    assert set(result.values()) == {'done'}
+    # Cut bodies continue with a Range request instead of starting over
+    assert server.resumed > 0
+    assert_complete(tmp_path, jobs)
+
+
+def test_resumes_a_part_file_across_runs(mock, tmp_path):
+
+    server = mock()
+    jobs = make_jobs(range(2001, 2002))
+    first = make_downloader(server, tmp_path)
+    first.run(jobs)
+
+    # A run stopped halfway through the first job
+    job = jobs[0]
+    directory = tmp_path / 'colombia'
+    body = (directory / job.name).read_bytes()
+    (directory / (job.name + '.part')).write_bytes(body[:len(body) // 3])
+    os.remove(directory / job.name)
+
+    result = make_downloader(server, tmp_path).run(jobs)
+
+    assert result == {job.name: 'done', jobs[1].name: 'skipped'}
+    assert server.resumed == 1
+    assert_complete(tmp_path, jobs)
+
+
+def test_concurrency_limit(mock, tmp_path):
+
+    server = mock(latency=0.05)
+    jobs = make_jobs(range(2001, 2007))
+
+    result = make_downloader(server, tmp_path, concurrency=3).run(jobs)
+
+    assert set(result.values()) == {'done'}
+    assert server.peak == 3
+    # Connections are kept alive and reused across jobs
+    assert server.connections <= 3
+    assert_complete(tmp_path, jobs)
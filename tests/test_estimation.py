@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import estimation
+
+PARTNERS = [f'P{i:02d}' for i in range(12)]
+TREATED = PARTNERS[:4]
+
+
+@pytest.fixture
+def panel():
+
+    rng = np.random.default_rng(3)
+
+    df = pd.MultiIndex.from_product(
+        [PARTNERS, [101, 202, 303, 404], ['M', 'X'], range(2006, 2018)],
+        names=['Partner', 'HSCode', 'Flow', 'Year']
+    ).to_frame(index=False)
+
+    treated = df['Partner'].isin(TREATED) & (df['Year'] >= estimation.START)
+    partner_effect = rng.normal(size=len(PARTNERS))[df['Partner'].str[1:].astype(int)]
+    mu = np.exp(10 + partner_effect + 0.3 * treated + rng.normal(scale=0.5, size=len(df)))
+
+    df['RealValue'] = rng.poisson(mu / 1000) * 1000.0
+    df.loc[rng.random(len(df)) < 0.05, 'RealValue'] = 0.0
+
+    return df
+
+
+def dummies(df:pd.DataFrame, effects:list) -> np.ndarray:
+
+    columns = [pd.get_dummies(df[list(effect)].astype(str).agg('|'.join, axis=1), dtype='float64')
+               for effect in effects]
+
+    return np.column_stack(columns) if columns else np.empty((len(df), 0))
+
+
+def reference(df:pd.DataFrame, y:str, x:list[str], cluster:str, ppml:bool) -> tuple[np.ndarray, np.ndarray]:
+    """Coefficients and clustered standard errors of x from a regression on every dummy column"""
+
+    effects = estimation.FIXED_EFFECTS
+    nested = [effect for effect in effects if (df.groupby(list(effect))[cluster].nunique() == 1).all()]
+
+    design = np.column_stack([df[x].to_numpy(dtype='float64'), dummies(df, effects)])
+    values = df[y].to_numpy(dtype='float64')
+
+    if ppml:
+        values = values / values.mean()
+        mu = (values + values.mean()) / 2
+        for _ in range(200):
+            z = np.log(mu) + (values - mu) / mu
+            beta = np.linalg.lstsq(design * np.sqrt(mu)[:, None], z * np.sqrt(mu), rcond=None)[0]
+            mu = np.exp(design @ beta)
+        weights, scores = mu, values - mu
+    else:
+        beta = np.linalg.lstsq(design, values, rcond=None)[0]
+        weights, scores = np.ones(len(values)), values - design @ beta
+
+    clusters = pd.factorize(df[cluster])[0]
+    groups, n = clusters.max() + 1, len(values)
+    k = len(x) + np.linalg.matrix_rank(dummies(df, effects)) - np.linalg.matrix_rank(dummies(df, nested))
+
+    bread = np.linalg.pinv(design.T @ (design * weights[:, None]))
+    sums = np.zeros((groups, design.shape[1]))
+    np.add.at(sums, clusters, design * scores[:, None])
+    vcov = groups / (groups - 1) * (n - 1) / (n - k) * bread @ sums.T @ sums @ bread
+
+    return beta[:len(x)], np.sqrt(np.diag(vcov))[:len(x)]
+
+
+@pytest.mark.parametrize('cluster', ['Partner', 'Year'])
+def test_ols_did_matches_dummy_regression(panel, cluster):
+
+    estimate = estimation.did(panel, treated=TREATED, method='ols', cluster=cluster)
+
+    df = panel[panel['RealValue'] > 0].copy()
+    df['LogValue'] = np.log(df['RealValue'])
+    df['Treated x Post'] = (df['Partner'].isin(TREATED) & (df['Year'] >= estimation.START)).astype('float64')
+    beta, se = reference(df, 'LogValue', ['Treated x Post'], cluster, ppml=False)
+
+    assert estimate.dropped == len(panel) - len(df)
+    assert estimate.coefficients['Coefficient'].to_numpy() == pytest.approx(beta, rel=1e-6)
+    assert estimate.coefficients['StdError'].to_numpy() == pytest.approx(se, rel=1e-6)
+
+
+@pytest.mark.parametrize('cluster', ['Partner', 'Year'])
+def test_ppml_did_matches_dummy_regression(panel, cluster):
+
+    estimate = estimation.did(panel, treated=TREATED, method='ppml', cluster=cluster)
+
+    df = panel.copy()
+    df['Treated x Post'] = (df['Partner'].isin(TREATED) & (df['Year'] >= estimation.START)).astype('float64')
+    beta, se = reference(df, 'RealValue', ['Treated x Post'], cluster, ppml=True)
+
+    assert estimate.converged
+    assert estimate.dropped == 0
+    assert estimate.coefficients['Coefficient'].to_numpy() == pytest.approx(beta, rel=1e-5)
+    assert estimate.coefficients['StdError'].to_numpy() == pytest.approx(se, rel=1e-5)
+
+
+def test_absorbed_df_counts_fixed_effects_outside_clusters(panel):
+
+    codes = estimation.fe_codes(panel, estimation.FIXED_EFFECTS)
+    all_rank = np.linalg.matrix_rank(dummies(panel, estimation.FIXED_EFFECTS))
+
+    # Everything is nested in a single cluster, nothing in one cluster per row, pairs in partners
+    assert estimation.absorbed_df(codes, np.zeros(len(panel), dtype='int64')) == 0
+    assert estimation.absorbed_df(codes, np.arange(len(panel))) == all_rank
+    assert estimation.absorbed_df(codes, pd.factorize(panel['Partner'])[0]) == all_rank - codes[0].max() - 1
@@ -0,0 +1,82 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import groups
+
+PARTNERS = ['United Kingdom', 'Venezuela', 'Croatia', 'Peru', 'Bolivia', 'Norway', 'World', 'Japan']
+YEARS = [1990, 2011, 2012, 2013, 2016, 2017, 2020, 2021, 2024]
+
+
+def member(partner, year:int|None, group:str) -> bool:
+    """Membership read straight from GROUPS, one row at a time"""
+
+    if partner not in groups.GROUPS[group]:
+        return False
+
+    if year is None:
+        return True
+
+    start, end = groups.GROUPS[group][partner]
+
+    return (start is None or year >= start) and (end is None or year <= end)
+
+
+@pytest.fixture
+def rows():
+
+    pairs = list(itertools.product(PARTNERS, YEARS)) + [(np.nan, 2015)]
+
+    return pd.DataFrame(pairs, columns=['Partner', 'Year'])
+
+
+@pytest.mark.parametrize('categorical', [False, True])
+def test_membership_respects_year_bounds(rows, categorical):
+
+    partners = rows['Partner'].astype('category') if categorical else rows['Partner']
+
+    result = groups.membership(partners, rows['Year'])
+
+    for name in groups.GROUPS:
+        expected = [member(partner, year, name) for partner, year in zip(rows['Partner'], rows['Year'])]
+        assert result[name].tolist() == expected, name
+
+    tagged = result.set_index([rows['Partner'], rows['Year']])
+    assert tagged.loc[('United Kingdom', 2020), 'EU'] and not tagged.loc[('United Kingdom', 2021), 'EU']
+    assert not tagged.loc[('Venezuela', 2011), 'Mercosur'] and tagged.loc[('Venezuela', 2016), 'Mercosur']
+    assert not tagged.loc[('Venezuela', 2017), 'Mercosur']
+    assert not tagged.loc[('Peru', 2011), 'Pacific Alliance'] and tagged.loc[('Peru', 2012), 'Pacific Alliance']
+
+
+def test_membership_without_years_counts_any_year(rows):
+
+    result = groups.membership(rows['Partner'], groups=['EU', 'Mercosur'])
+
+    for name in ['EU', 'Mercosur']:
+        assert result[name].tolist() == [member(partner, None, name) for partner in rows['Partner']]
+
+
+def test_registered_group_has_the_given_bounds(rows, monkeypatch):
+
+    monkeypatch.setattr(groups, 'GROUPS', dict(groups.GROUPS))
+    groups.register('Test', {'Japan': (2013, 2016), 'Peru': (None, 2011)})
+
+    result = groups.membership(rows['Partner'], rows['Year'], groups=['Test'])
+
+    expected = [member(partner, year, 'Test') for partner, year in zip(rows['Partner'], rows['Year'])]
+    assert result['Test'].tolist() == expected
+    assert sum(expected) == 4
+
+
+def test_group_sum_counts_members_only_in_their_years(rows):
+
+    df = rows.dropna().assign(RealValue=1.0)
+
+    result = groups.group_sum(df, groups=['EU']).set_index('Year')['RealValue']
+
+    # United Kingdom leaves after 2020, Croatia joins in 2013
+    assert result[2012] == 1
+    assert result[2013] == 2
+    assert result[2021] == 1
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import growth
+
+YEARS = range(2010, 2023)
+
+
+@pytest.fixture
+def trade():
+
+    rng = np.random.default_rng(1)
+
+    df = pd.MultiIndex.from_product([['Peru', 'Chile', 'Norway'], [901, 2709], YEARS],
+                                    names=['Partner', 'HSCode', 'Year']).to_frame(index=False)
+    df['RealValue'] = rng.lognormal(8, 1, len(df))
+
+    # Chile has no trade at all in 2015-2016, Norway none in 2012, no one in 2018
+    gaps = ((df['Partner'] == 'Chile') & df['Year'].isin([2015, 2016])) | \
+        ((df['Partner'] == 'Norway') & (df['Year'] == 2012)) | (df['Year'] == 2018)
+
+    return df[~gaps].reset_index(drop=True)
+
+
+def reference(df:pd.DataFrame) -> pd.DataFrame:
+    """Yearly sums of every partner with missing years as 0, plus their pct_change in percent"""
+
+    wide = df.pivot_table(index='Partner', columns='Year', values='RealValue', aggfunc='sum', fill_value=0)
+    wide = wide.reindex(columns=YEARS, fill_value=0)
+
+    long = wide.stack().rename('RealValue').reset_index()
+    long['PctChange'] = long.groupby('Partner')['RealValue'].pct_change().replace([np.inf, -np.inf], np.nan) * 100
+
+    return long
+
+
+def test_yoy_growth_matches_pct_change(trade):
+
+    result = growth.yoy_growth(trade).sort_values(['Partner', 'Year'], ignore_index=True)
+    expected = reference(trade).sort_values(['Partner', 'Year'], ignore_index=True)
+
+    assert result['Year'].tolist() == expected['Year'].tolist()
+    assert result['RealValue'].to_numpy() == pytest.approx(expected['RealValue'].to_numpy())
+    assert result['PctChange'].to_numpy() == pytest.approx(expected['PctChange'].to_numpy(), nan_ok=True)
+
+    # The year after a gap has no growth, the gap itself falls by 100%
+    chile = result[result['Partner'] == 'Chile'].set_index('Year')['PctChange']
+    assert chile[2015] == pytest.approx(-100)
+    assert np.isnan(chile[2016]) and np.isnan(chile[2017])
+
+
+@pytest.mark.parametrize('base, end', [(2012, 2022), (2010, 2018), (2014, 2017)])
+def test_growth_matches_pct_change(trade, base, end):
+
+    result = growth.growth(trade, base=base, end=end).set_index('Partner')
+
+    wide = reference(trade).pivot(index='Partner', columns='Year', values='RealValue')
+    change = wide[[base, end]].pct_change(axis=1)[end].replace([np.inf, -np.inf], np.nan) * 100
+
+    assert result.loc[change.index, 'PctChange'].to_numpy() == pytest.approx(change.to_numpy(), nan_ok=True)
+    assert result.loc[change.index, base].to_numpy() == pytest.approx(wide.loc[change.index, base].to_numpy())
+
+    cagr = ((1 + change / 100) ** (1 / (end - base)) - 1) * 100
+    assert result.loc[change.index, 'CAGR'].to_numpy() == pytest.approx(cagr.to_numpy(), nan_ok=True)
@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import growth
+import inference
+
+YEARS = range(2010, 2023)
+PARTNERS = ['Peru', 'Chile', 'Norway', 'Iceland']
+
+
+@pytest.fixture
+def trade():
+
+    rng = np.random.default_rng(0)
+
+    df = pd.MultiIndex.from_product([PARTNERS, [901, 2709, 3004, 7108, 8703], YEARS],
+                                    names=['Partner', 'HSCode', 'Year']).to_frame(index=False)
+    df['RealValue'] = rng.lognormal(10, 1, len(df))
+
+    return df
+
+
+def proportional(paths:dict[str, list[float]], blocks:int=5) -> pd.DataFrame:
+    """Rows of every partner whose HS codes all follow the partner's path, scaled"""
+
+    return pd.DataFrame([
+        {'Partner': partner, 'HSCode': code, 'Year': year, 'RealValue': value * (code + 1)}
+        for partner, path in paths.items()
+        for code in range(blocks)
+        for year, value in zip(YEARS, path)
+    ])
+
+
+def chunk_files(directory:str) -> list[str]:
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(directory)
+                  for name in names if name.startswith('chunk-'))
+
+
+def mean_value(dataframe:pd.DataFrame) -> float:
+    return dataframe['RealValue'].mean()
+
+
+def test_bootstrap_growth_resumes_to_a_fresh_result(trade, tmp_path):
+
+    kwargs = {'replicates': 1200, 'seed': 7, 'workers': 1}
+
+    fresh = inference.bootstrap_growth(trade, directory=str(tmp_path / 'fresh'), **kwargs)
+
+    first = inference.bootstrap_growth(trade, directory=str(tmp_path / 'resumed'), **kwargs)
+    files = chunk_files(str(tmp_path / 'resumed'))
+    assert len(files) == 3
+
+    # A run stopped after its first chunk
+    for path in files[1:]:
+        os.remove(path)
+    kept = os.path.getmtime(files[0])
+
+    resumed = inference.bootstrap_growth(trade, directory=str(tmp_path / 'resumed'), **kwargs)
+
+    assert os.path.getmtime(files[0]) == kept
+    pd.testing.assert_frame_equal(first, fresh)
+    pd.testing.assert_frame_equal(resumed, fresh)
+
+
+def test_more_replicates_reuse_full_chunks(trade, tmp_path):
+
+    inference.bootstrap_growth(trade, replicates=700, workers=1, directory=str(tmp_path))
+    before = {os.path.basename(path) for path in chunk_files(str(tmp_path))}
+
+    more = inference.bootstrap_growth(trade, replicates=1000, workers=1, directory=str(tmp_path))
+    after = {os.path.basename(path) for path in chunk_files(str(tmp_path))}
+
+    assert before == {'chunk-00000-500.npy', 'chunk-00001-200.npy'}
+    assert after == {'chunk-00000-500.npy', 'chunk-00001-500.npy'}
+    pd.testing.assert_frame_equal(
+        more, inference.bootstrap_growth(trade, replicates=1000, workers=1, directory=str(tmp_path / 'fresh'))
+    )
+
+
+def test_seed_alone_decides_the_replicates(trade, tmp_path):
+
+    kwargs = {'replicates': 1000}
+
+    serial = inference.bootstrap_growth(trade, seed=3, workers=1, directory=str(tmp_path / 'serial'), **kwargs)
+    parallel = inference.bootstrap_growth(trade, seed=3, workers=2, directory=str(tmp_path / 'parallel'), **kwargs)
+    other = inference.bootstrap_growth(trade, seed=4, workers=1, directory=str(tmp_path / 'other'), **kwargs)
+
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert not np.allclose(serial['StdError'], other['StdError'], equal_nan=True)
+
+
+def test_bootstrap_growth_of_proportional_blocks(tmp_path):
+
+    path = np.linspace(100, 250, len(YEARS))
+    df = proportional({'Peru': path, 'Chile': path[::-1]})
+
+    result = inference.bootstrap_growth(df, replicates=200, workers=1, directory=str(tmp_path)).set_index(['Partner', 'Metric'])
+    expected = growth.growth(df).set_index('Partner')
+
+    # Every resample scales the same paths, so every replicate is the estimate
+    for partner in ['Peru', 'Chile']:
+        for metric in ['PctChange', 'CAGR', 'LogGrowth']:
+            row = result.loc[(partner, metric)]
+            assert row['Estimate'] == pytest.approx(expected.loc[partner, metric])
+            assert row['StdError'] == pytest.approx(0, abs=1e-9)
+            assert row['Low'] == pytest.approx(row['High'])
+            assert row['Replicates'] == 200
+
+
+def test_permutation_growth_of_one_outlier(tmp_path):
+
+    flat = np.full(len(YEARS), 100.0)
+    paths = {partner: flat * np.linspace(1, 1 + i / 10, len(YEARS)) for i, partner in enumerate(PARTNERS[1:])}
+    df = proportional({'Peru': flat * np.linspace(1, 5, len(YEARS)), **paths}, blocks=1)
+
+    result = inference.permutation_growth(df, treated=['Peru'], replicates=2000, workers=1,
+                                          directory=str(tmp_path)).set_index('Metric')
+
+    # Peru is the largest of four units, drawn once in four assignments
+    assert result.loc['PctChange', 'Difference'] > 0
+    assert result.loc['PctChange', 'PValue'] == pytest.approx(0.25, abs=0.04)
+    assert result['Replicates'].eq(2000).all()
+
+
+def test_bootstrap_estimator_of_identical_blocks(tmp_path):
+
+    df = proportional({partner: np.full(len(YEARS), 10.0) for partner in PARTNERS}, blocks=2)
+
+    result = inference.bootstrap(df, mean_value, block='Partner', replicates=50, workers=1, directory=str(tmp_path))
+
+    assert result['Estimate'].iloc[0] == pytest.approx(df['RealValue'].mean())
+    assert result['StdError'].iloc[0] == pytest.approx(0, abs=1e-9)
+    assert result['Replicates'].iloc[0] == 50
+
+
+@pytest.mark.parametrize('treated', [['Austria'], PARTNERS])
+def test_permutation_needs_treated_and_control_units(trade, tmp_path, treated):
+
+    with pytest.raises(ValueError, match='treated and control'):
+        inference.permutation(trade, mean_value, treated=treated, replicates=10, workers=1, directory=str(tmp_path))
@@ -0,0 +1,106 @@
+import sys
+import textwrap
+import importlib
+
+import pytest
+
+import pipeline
+
+STAGES = '''
+import pyarrow as pa
+
+import helpers
+
+
+def first() -> pa.Table:
+    return pa.table({'Value': helpers.values()})
+
+
+def second(table:pa.Table, scale:int=1) -> pa.Table:
+    return pa.table({'Value': [value * scale for value in table['Value'].to_pylist()]})
+'''
+
+
+MODULES = ('helpers', 'stages')
+
+
+def write_module(directory, name:str, source:str) -> None:
+    """Writes a module and forgets the imported ones, as a new process would"""
+
+    (directory / f'{name}.py').write_text(textwrap.dedent(source))
+
+    for module in MODULES:
+        sys.modules.pop(module, None)
+
+    importlib.invalidate_caches()
+
+
+@pytest.fixture
+def modules(tmp_path, monkeypatch):
+
+    directory = tmp_path / 'modules'
+    directory.mkdir()
+    monkeypatch.syspath_prepend(str(directory))
+    # Edits within the same second must not load a stale .pyc
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+
+    write_module(directory, 'helpers', 'def values():\n    return [1, 2, 3]\n')
+    write_module(directory, 'stages', STAGES)
+
+    yield directory
+
+    for name in MODULES:
+        sys.modules.pop(name, None)
+
+
+def make_pipeline(cache_dir:str, scale:int=2) -> pipeline.Pipeline:
+
+    stages = importlib.import_module('stages')
+
+    return pipeline.Pipeline([
+        pipeline.Stage('first', stages.first, code=('helpers',), outputs={'Value': 'int'}),
+        pipeline.Stage('second', stages.second, inputs=('first',), params={'scale': scale},
+                       requires=('Value',), outputs={'Value': 'int'})
+    ], cache_dir=cache_dir)
+
+
+def test_keys_follow_the_code_of_every_stage(modules, tmp_path):
+
+    cache_dir = str(tmp_path / 'cache')
+    before = make_pipeline(cache_dir).keys()
+
+    assert make_pipeline(cache_dir).keys() == before
+
+    # A module named in code changes the stage and everything downstream
+    write_module(modules, 'helpers', 'def values():\n    return [1, 2, 4]\n')
+    helpers = make_pipeline(cache_dir).keys()
+
+    assert helpers['first'] != before['first']
+    assert helpers['second'] != before['second']
+
+    # The file a func is defined in changes every stage defined there
+    write_module(modules, 'stages', STAGES + '\n# Edited\n')
+    edited = make_pipeline(cache_dir).keys()
+
+    assert edited['first'] != helpers['first']
+    assert edited['second'] != helpers['second']
+
+    # Params only change their own stage
+    scaled = make_pipeline(cache_dir, scale=3).keys()
+
+    assert scaled['first'] == edited['first']
+    assert scaled['second'] != edited['second']
+
+
+def test_changed_code_runs_again(modules, tmp_path):
+
+    cache_dir = str(tmp_path / 'cache')
+
+    assert make_pipeline(cache_dir).run(workers=1) == {'first': 'ran', 'second': 'ran'}
+    assert make_pipeline(cache_dir).run(workers=1) == {'first': 'cached', 'second': 'cached'}
+
+    write_module(modules, 'helpers', 'def values():\n    return [5, 6]\n')
+    changed = make_pipeline(cache_dir)
+
+    assert changed.run(workers=1) == {'first': 'ran', 'second': 'ran'}
+    assert changed.load('second')['Value'].to_pylist() == [10, 12]
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from plotprep import bandwidth, group_bandwidths, histogram, kde
+
+
+@pytest.mark.parametrize('values', [
+    np.random.default_rng(0).normal(size=8),
+    np.array([1.0, 1.0, 1.0, 1.0, 1.0]),
+    np.array([3.0, 3.0 + 1e-9]),
+    np.array([7.0])
+])
+def test_kde_small_or_low_spread_on_histogram_range(values):
+
+    counts, edges, _ = histogram(values)
+    density, points, _ = kde(values, range=(edges[0], edges[-1]))
+
+    assert density.shape == (1, len(points))
+    assert np.isfinite(density).all()
+
+
+def test_kde_kernel_wider_than_grid():
+
+    values = np.random.default_rng(1).normal(size=100)
+    density, points, _ = kde(values, grid=50, bw=100.0)
+
+    assert density.shape == (1, 50)
+    # Flat over the grid, the kernel being much wider than it
+    assert np.allclose(density, density.mean(), rtol=1e-3)
+
+
+def test_kde_integrates_to_one_per_group():
+
+    rng = np.random.default_rng(2)
+    values = rng.normal(size=5000)
+    groups = rng.choice(['a', 'b', 'c'], size=5000)
+
+    density, points, uniques = kde(values, groups)
+
+    assert list(uniques) == ['a', 'b', 'c']
+    assert np.allclose(density.sum(axis=1) * (points[1] - points[0]), 1, atol=1e-3)
+
+
+def test_group_bandwidths_match_bandwidth():
+
+    rng = np.random.default_rng(3)
+    values = rng.normal(size=1000)
+    values[::50] = np.nan
+    codes = rng.integers(0, 4, size=1000)
+    codes[codes == 3] = 2
+
+    widths = group_bandwidths(values, codes, 4)
+
+    assert np.allclose(widths[:3], [bandwidth(values[codes == g]) for g in range(3)])
+    assert widths[3] == 1.0
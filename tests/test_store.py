@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+
+import store
+
+
+@pytest.fixture
+def store_path(tmp_path):
+
+    rng = np.random.default_rng(0)
+    rows = 2000
+
+    for country in ('colombia', 'switzerland'):
+        folder = tmp_path / country
+        folder.mkdir()
+        pd.DataFrame({
+            'Year': rng.integers(2001, 2023, rows),
+            'Flow': rng.choice(['M', 'X'], rows),
+            'Partner': rng.choice(['Peru', 'Chile', 'Norway'], rows),
+            'HSCode': rng.choice([901, 2709, 3004], rows),
+            'FobValue': rng.random(rows) * 100,
+            'RealValue': rng.random(rows) * 100
+        }).to_csv(folder / 'main.csv', index=False)
+
+    return store.build(path=str(tmp_path / 'store'), source=str(tmp_path / '{country}' / 'main.csv'))
+
+
+def reference(path:str, sql:str) -> pd.DataFrame:
+    """sql run by sqlite on every column and row of the store"""
+
+    import sqlite3
+
+    connection = sqlite3.connect(':memory:')
+    store.get_dataset(path).to_table().to_pandas().to_sql(store.TABLE, connection, index=False)
+
+    try:
+        return pd.read_sql_query(sql, connection)
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize('sql', [
+    'SELECT t.Year, SUM(t.RealValue) AS RealValue FROM trade t GROUP BY t.Year ORDER BY t.Year',
+    'SELECT trade.Partner, COUNT(*) AS Rows FROM trade GROUP BY 1 ORDER BY 1',
+    'SELECT t."HSCode", SUM(t.FobValue) AS FobValue FROM trade AS t WHERE t.Year >= 2015 GROUP BY 1 ORDER BY 1',
+    # An alias named after a column doesn't change what WHERE filters
+    'SELECT Partner AS Year, SUM(RealValue) AS RealValue FROM trade WHERE Year >= 2015 GROUP BY 1 ORDER BY 1',
+    "SELECT COUNT(*) AS Rows FROM trade WHERE Partner != 'x and Year = 2001 and y' AND Flow = 'M'"
+])
+def test_query_matches_sqlite(store_path, sql):
+
+    result = store.query(sql, path=store_path)
+
+    pd.testing.assert_frame_equal(result, reference(store_path, sql), check_dtype=False, check_categorical=False)
+
+
+def test_scan_filters_match_pandas(store_path):
+
+    df = store.scan(['Year', 'Partner', 'RealValue'], reporters=['colombia'], period='2011',
+                    partners=['Peru'], path=store_path)
+    full = store.scan(path=store_path)
+    expected = full[(full['Reporter'] == 'colombia') & full['Year'].between(2001, 2011) & (full['Partner'] == 'Peru')]
+
+    assert len(df) == len(expected)
+    assert df['RealValue'].sum() == pytest.approx(expected['RealValue'].sum())
+
+
+def test_scan_joins_filters_to_the_arguments(store_path):
+
+    df = store.scan(reporters=['switzerland'], filters=(ds.field('RealValue') > 50) | (ds.field('Flow') == 'M'),
+                    path=store_path)
+    full = store.scan(path=store_path)
+    expected = full[(full['Reporter'] == 'switzerland') & ((full['RealValue'] > 50) | (full['Flow'] == 'M'))]
+
+    assert len(df) == len(expected)
+    assert df['RealValue'].sum() == pytest.approx(expected['RealValue'].sum())
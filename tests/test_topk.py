@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from topk import rank_hscodes, StreamingTopK
+
+BY = ['Region', 'Flow']
+
+
+@pytest.fixture
+def trade():
+
+    rng = np.random.default_rng(0)
+    rows = 5000
+
+    return pd.DataFrame({
+        'Region': rng.choice(['EFTA', 'NO EFTA', 'World'], rows),
+        'Flow': rng.choice(['M', 'X'], rows),
+        'HSCode': rng.choice([901, 2709, 3004, 7108, 8703, 8471, 3002], rows),
+        'FobValue': rng.lognormal(10, 2, rows)
+    })
+
+
+def ordered(df:pd.DataFrame) -> pd.DataFrame:
+    return df.sort_values(BY + ['Rank']).reset_index(drop=True)
+
+
+def test_streaming_matches_rank_hscodes(trade):
+
+    top = StreamingTopK(BY, k=3)
+
+    for start in range(0, len(trade), 700):
+        top.update(trade.iloc[start:start + 700])
+
+    expected = rank_hscodes(trade, BY, k=3)
+
+    pd.testing.assert_frame_equal(ordered(top.result()), ordered(expected), check_dtype=False)
+
+
+def test_complete_chunks_match_rank_hscodes(trade):
+
+    top = StreamingTopK(BY, k=3, complete=True)
+
+    # Every (group, HS code) total arrives in one chunk
+    for _, chunk in trade.groupby(BY):
+        top.update(chunk)
+
+    expected = rank_hscodes(trade, BY, k=3)
+
+    pd.testing.assert_frame_equal(ordered(top.result()), ordered(expected), check_dtype=False)
+
+
+@pytest.mark.parametrize('complete', [False, True])
+def test_result_without_chunks(complete):
+
+    result = StreamingTopK(BY, complete=complete).result()
+
+    assert result.empty
+    assert list(result.columns[:4]) == BY + ['HSCode', 'FobValue']